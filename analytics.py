@@ -0,0 +1,249 @@
+# Vectorized analytics over form responses. Answers are read from the answers
+# table in keyset-paginated chunks and turned into NumPy column arrays, so
+# memory is bounded by ANALYTICS_CHUNK_SIZE however many answers a form has.
+# Only small per-value counters are carried from one chunk to the next.
+# Answers of archived forms are read from their memory mapped archive first.
+from collections import Counter
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+import numpy as np
+
+from answer_archive import ArchivedAnswers, load_archive
+from app_databases.database import database, question_table, response_table
+from app_databases.pagination import iter_submission_pages
+from config import config
+
+NO_SELECTION = -1
+
+
+@dataclass
+class AnswerChunk:
+    answer_id: np.ndarray
+    submission_id: np.ndarray
+    question_id: np.ndarray
+    rating: np.ndarray  # 0 where has_rating is False
+    has_rating: np.ndarray
+    selected: np.ndarray  # codes into a SelectionDictionary, NO_SELECTION when empty
+
+
+class SelectionDictionary:
+    """Dictionary encoding of `selected_answer`, shared by all the chunks of
+    one computation so that codes are comparable across chunks."""
+
+    def __init__(self):
+        self.values: list[str] = []
+        self._codes: dict[str, int] = {}
+
+    def encode(self, values: Iterable[Optional[str]], count: int) -> np.ndarray:
+        return np.fromiter(
+            (NO_SELECTION if value is None else self._codes.setdefault(value, len(self._codes)) for value in values),
+            dtype=np.int32, count=count)
+
+    def decode(self, code: int) -> Optional[str]:
+        if code == NO_SELECTION:
+            return None
+        if len(self.values) != len(self._codes):
+            self.values = sorted(self._codes, key=self._codes.get)
+        return self.values[code]
+
+
+def to_chunk(rows: list, dictionary: SelectionDictionary) -> AnswerChunk:
+    count = len(rows)
+    ratings = [row[3] for row in rows]
+    return AnswerChunk(
+        answer_id=np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+        submission_id=np.fromiter((row[1] or 0 for row in rows), dtype=np.int64, count=count),
+        question_id=np.fromiter((row[2] for row in rows), dtype=np.int64, count=count),
+        rating=np.fromiter((rating or 0 for rating in ratings), dtype=np.int64, count=count),
+        has_rating=np.fromiter((rating is not None for rating in ratings), dtype=bool, count=count),
+        selected=dictionary.encode((row[4] for row in rows), count),
+    )
+
+
+ANSWER_COLUMNS = (response_table.c.id, response_table.c.submission_id, response_table.c.question_id,
+                  response_table.c.rating, response_table.c.selected_answer)
+
+
+def iter_archived_chunks(archive: Optional[ArchivedAnswers], question_ids: list[int], dictionary: SelectionDictionary,
+                         chunk_size: int) -> Iterator[AnswerChunk]:
+    """Archived answers to `question_ids` in (submission id, answer id)
+    order, never splitting a submission across two chunks."""
+    if archive is None or not archive.rows:
+        return
+    columns = archive.columns
+    # Translate the archive's dictionary codes into the computation's.
+    values = archive.dictionaries["selected_answer"]
+    codes = np.append(dictionary.encode(values, len(values)), NO_SELECTION).astype(np.int32)
+    start = 0
+    while start < archive.rows:
+        end = min(start + chunk_size, archive.rows)
+        end = int(np.searchsorted(columns["submission_id"], columns["submission_id"][end - 1], side="right"))
+        window = slice(start, end)
+        wanted = np.isin(columns["question_id"][window], question_ids)
+        if wanted.any():
+            yield AnswerChunk(
+                answer_id=np.asarray(columns["answer_id"][window][wanted]),
+                submission_id=np.asarray(columns["submission_id"][window][wanted]),
+                question_id=np.asarray(columns["question_id"][window][wanted]),
+                rating=np.asarray(columns["rating"][window][wanted]),
+                has_rating=np.asarray(columns["has_rating"][window][wanted]).astype(bool),
+                selected=codes[columns["selected_answer"][window][wanted]],
+            )
+        start = end
+
+
+async def iter_question_chunks(question_ids: list[int], dictionary: SelectionDictionary,
+                               chunk_size: Optional[int] = None,
+                               form_id: Optional[int] = None) -> AsyncIterator[AnswerChunk]:
+    """Answers to `question_ids`: the archive of `form_id` first, then the
+    answers table in answer id order."""
+    chunk_size = chunk_size or config.ANALYTICS_CHUNK_SIZE
+    archive = await load_archive(form_id) if form_id is not None else None
+    for chunk in iter_archived_chunks(archive, question_ids, dictionary, chunk_size):
+        yield chunk
+    last_id = 0
+    while True:
+        rows = await database.fetch_all(
+            response_table.select().with_only_columns(*ANSWER_COLUMNS).where(
+                response_table.c.question_id.in_(question_ids), response_table.c.id > last_id).order_by(
+                response_table.c.id).limit(chunk_size))
+        if not rows:
+            return
+        chunk = to_chunk(rows, dictionary)
+        last_id = int(chunk.answer_id[-1])
+        yield chunk
+        if len(rows) < chunk_size:
+            return
+
+
+async def iter_submission_chunks(question_ids: list[int], dictionary: SelectionDictionary,
+                                 chunk_size: Optional[int] = None,
+                                 form_id: Optional[int] = None) -> AsyncIterator[AnswerChunk]:
+    """Answers to `question_ids`, the archive of `form_id` first. A
+    submission is never split across two chunks, and the answers to each
+    question are in submission id order within a chunk, so answers of the
+    same submission can be paired up inside a chunk."""
+    chunk_size = chunk_size or config.ANALYTICS_CHUNK_SIZE
+    archive = await load_archive(form_id) if form_id is not None else None
+    for chunk in iter_archived_chunks(archive, question_ids, dictionary, chunk_size):
+        yield chunk
+    async for rows in iter_submission_pages(question_ids, ANSWER_COLUMNS, chunk_size):
+        yield to_chunk(rows, dictionary)
+
+
+def merge_counts(counter: Counter, values: np.ndarray) -> None:
+    unique, counts = np.unique(values, return_counts=True)
+    counter.update(dict(zip(unique.tolist(), counts.tolist())))
+
+
+def merge_pair_counts(counter: Counter, keys: np.ndarray, values: np.ndarray) -> None:
+    if not len(keys):
+        return
+    pairs, counts = np.unique(np.stack([keys.astype(np.int64), values.astype(np.int64)]), axis=1,
+                              return_counts=True)
+    counter.update({(key, value): count for (key, value), count in zip(pairs.T.tolist(), counts.tolist())})
+
+
+def split_pair_counts(pair_counts: Counter) -> dict[int, Counter]:
+    split = {}
+    for (key, value), count in pair_counts.items():
+        split.setdefault(key, Counter())[value] += count
+    return split
+
+
+def percentiles_from_counts(values: np.ndarray, counts: np.ndarray, percentiles: list[float]) -> dict[str, float]:
+    """Exact percentiles (linear interpolation, like numpy.percentile) of a
+    sample given as distinct sorted values and their counts."""
+    total = counts.sum()
+    if total == 0:
+        return {f"{percentile:g}": None for percentile in percentiles}
+    cumulative = np.cumsum(counts)
+    ranks = np.asarray(percentiles, dtype=float) / 100 * (total - 1)
+    lower = values[np.searchsorted(cumulative, np.floor(ranks), side="right")]
+    upper = values[np.searchsorted(cumulative, np.ceil(ranks), side="right")]
+    result = lower + (upper - lower) * (ranks - np.floor(ranks))
+    return {f"{percentile:g}": float(value) for percentile, value in zip(percentiles, result)}
+
+
+def describe_ratings(rating_counts: Counter, percentiles: list[float]) -> dict:
+    values = np.array(sorted(rating_counts), dtype=np.int64)
+    counts = np.array([rating_counts[value] for value in values.tolist()], dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return {"count": 0, "mean": None, "percentiles": percentiles_from_counts(values, counts, percentiles),
+                "histogram": {}, "nps": None}
+    promoters = counts[values >= 9].sum()
+    detractors = counts[values <= 6].sum()
+    return {
+        "count": total,
+        "mean": float((values * counts).sum() / total),
+        "percentiles": percentiles_from_counts(values, counts, percentiles),
+        "histogram": {str(value): int(count) for value, count in zip(values.tolist(), counts.tolist())},
+        # Net Promoter Score on a 0-10 scale: % of 9-10 ratings minus % of 0-6 ratings.
+        "nps": float((promoters - detractors) * 100 / total),
+    }
+
+
+async def question_rating_analytics(question_id: int, percentiles: list[float],
+                                    chunk_size: Optional[int] = None) -> dict:
+    rating_counts = Counter()
+    form_id = await database.fetch_val(
+        question_table.select().with_only_columns(question_table.c.form_id).where(question_table.c.id == question_id))
+    async for chunk in iter_question_chunks([question_id], SelectionDictionary(), chunk_size, form_id):
+        merge_counts(rating_counts, chunk.rating[chunk.has_rating])
+    return {"question_id": question_id, **describe_ratings(rating_counts, percentiles)}
+
+
+async def form_rating_analytics(form_id: int, percentiles: list[float], chunk_size: Optional[int] = None) -> dict:
+    question_ids = await form_question_ids(form_id)
+    pair_counts = Counter()
+    if question_ids:
+        async for chunk in iter_question_chunks(question_ids, SelectionDictionary(), chunk_size, form_id):
+            merge_pair_counts(pair_counts, chunk.question_id[chunk.has_rating], chunk.rating[chunk.has_rating])
+    per_question = split_pair_counts(pair_counts)
+    return {
+        "form_id": form_id,
+        "questions": [
+            {"question_id": question_id, **describe_ratings(per_question.get(question_id, Counter()), percentiles)}
+            for question_id in question_ids
+        ],
+    }
+
+
+async def rating_crosstab(question_id: int, segment_question_id: int, percentiles: list[float],
+                          chunk_size: Optional[int] = None, form_id: Optional[int] = None) -> dict:
+    """Ratings given to `question_id`, segmented by the answer selected for
+    `segment_question_id` in the same submission."""
+    dictionary = SelectionDictionary()
+    pair_counts = Counter()
+    async for chunk in iter_submission_chunks([question_id, segment_question_id], dictionary, chunk_size,
+                                              form_id):
+        segment = chunk.question_id == segment_question_id
+        rated = (chunk.question_id == question_id) & chunk.has_rating
+        segment_submissions, segment_codes = chunk.submission_id[segment], chunk.selected[segment]
+        rated_submissions, ratings = chunk.submission_id[rated], chunk.rating[rated]
+        # Both sides are sorted by submission id, so pair them with a binary search.
+        if len(segment_submissions):
+            positions = np.minimum(np.searchsorted(segment_submissions, rated_submissions),
+                                   len(segment_submissions) - 1)
+            matched = segment_submissions[positions] == rated_submissions
+            codes = np.where(matched, segment_codes[positions], NO_SELECTION)
+        else:
+            codes = np.full(len(rated_submissions), NO_SELECTION, dtype=np.int32)
+        merge_pair_counts(pair_counts, codes, ratings)
+    segments = split_pair_counts(pair_counts)
+    return {
+        "question_id": question_id,
+        "segment_question_id": segment_question_id,
+        "segments": [
+            {"selected_answer": dictionary.decode(code), **describe_ratings(counts, percentiles)}
+            for code, counts in sorted(segments.items())
+        ],
+    }
+
+
+async def form_question_ids(form_id: int) -> list[int]:
+    rows = await database.fetch_all(
+        question_table.select().with_only_columns(question_table.c.id).where(question_table.c.form_id == form_id))
+    return [row.id for row in rows]
@@ -0,0 +1,219 @@
+# Columnar archive of the answers of closed forms. A form's answers are
+# compacted into one binary file per column under ARCHIVE_DIR/form_<id>/
+# (integer arrays, and dictionary encoded codes for the strings), memory
+# mapped for reading, and then pruned from the answers table. Analytics,
+# exports and rating stat rebuilds read the archive and the live table
+# together.
+import datetime
+import json
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+import numpy as np
+
+from app_databases.database import database, feedback_form_table, question_table, response_table
+from app_databases.pagination import iter_submission_pages
+from config import config
+
+logger = logging.getLogger(__name__)
+
+INTEGER_COLUMNS = ["answer_id", "submission_id", "question_id", "user_id", "rating"]
+STRING_COLUMNS = ["selected_answer", "user_input_answer"]
+NULL_CODE = -1
+
+
+def archive_path(form_id: int) -> str:
+    return os.path.join(config.ARCHIVE_DIR, f"form_{form_id}")
+
+
+class _ColumnWriter:
+    """Writes the column files of an archive. Used as a context manager, which
+    closes the files however the writing ends."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files = {}
+        try:
+            for column in INTEGER_COLUMNS + ["has_rating"] + STRING_COLUMNS:
+                self.files[column] = open(os.path.join(directory, f"{column}.bin"), "wb")
+        except OSError:
+            self._close_files()
+            raise
+        self.dictionaries: dict[str, dict[str, int]] = {column: {} for column in STRING_COLUMNS}
+        self.rows = 0
+
+    def write(self, rows: list) -> None:
+        count = len(rows)
+        columns = {
+            "answer_id": (row.id for row in rows),
+            "submission_id": (row.submission_id or 0 for row in rows),
+            "question_id": (row.question_id for row in rows),
+            "user_id": (row.user_id or 0 for row in rows),
+            "rating": (row.rating or 0 for row in rows),
+        }
+        for column, values in columns.items():
+            np.fromiter(values, dtype=np.int64, count=count).tofile(self.files[column])
+        np.fromiter((row.rating is not None for row in rows), dtype=np.uint8, count=count).tofile(
+            self.files["has_rating"])
+        for column in STRING_COLUMNS:
+            dictionary = self.dictionaries[column]
+            np.fromiter(
+                (NULL_CODE if row[column] is None else dictionary.setdefault(row[column], len(dictionary))
+                 for row in rows), dtype=np.int32, count=count).tofile(self.files[column])
+        self.rows += count
+
+    def __enter__(self) -> "_ColumnWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._close_files()
+
+    def _close_files(self) -> None:
+        for file in self.files.values():
+            file.close()
+
+    def close(self, meta: dict) -> None:
+        self._close_files()
+        for column, dictionary in self.dictionaries.items():
+            with open(os.path.join(self.directory, f"{column}.json"), "w", encoding="utf-8") as file:
+                json.dump(sorted(dictionary, key=dictionary.get), file)
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({**meta, "rows": self.rows}, file)
+
+
+@dataclass
+class ArchivedAnswers:
+    """Memory mapped columns of an archived form, sorted by submission id.
+    The answers of a submission are in answer id order, the legacy answers
+    without one (submission 0) in answer id order per question."""
+    form_id: int
+    rows: int
+    max_answer_id: int
+    columns: dict[str, np.ndarray]
+    dictionaries: dict[str, list[str]]
+
+    def decode(self, column: str, codes: np.ndarray) -> list[Optional[str]]:
+        values = self.dictionaries[column]
+        return [None if code == NULL_CODE else values[code] for code in codes.tolist()]
+
+    def iter_rows(self, batch_size: int) -> Iterator[list[dict]]:
+        for start in range(0, self.rows, batch_size):
+            window = slice(start, start + batch_size)
+            columns = {column: self.columns[column][window] for column in INTEGER_COLUMNS}
+            has_rating = self.columns["has_rating"][window].astype(bool)
+            strings = {column: self.decode(column, self.columns[column][window]) for column in STRING_COLUMNS}
+            yield [
+                {
+                    "id": answer_id,
+                    "submission_id": submission_id or None,
+                    "question_id": question_id,
+                    "user_id": user_id or None,
+                    "rating": rating if rated else None,
+                    "selected_answer": selected_answer,
+                    "user_input_answer": user_input_answer,
+                } for answer_id, submission_id, question_id, user_id, rating, rated, selected_answer, user_input_answer
+                in zip(*(columns[column].tolist() for column in INTEGER_COLUMNS), has_rating.tolist(),
+                       strings["selected_answer"], strings["user_input_answer"])
+            ]
+
+
+def read_archive(form_id: int) -> Optional[ArchivedAnswers]:
+    """The archive files of a form, whether or not its archiving completed.
+    Readers go through load_archive."""
+    directory = archive_path(form_id)
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as file:
+        meta = json.load(file)
+    columns = {}
+    dtypes = {**dict.fromkeys(INTEGER_COLUMNS, np.int64), "has_rating": np.uint8,
+              **dict.fromkeys(STRING_COLUMNS, np.int32)}
+    for column, dtype in dtypes.items():
+        # np.memmap refuses empty files
+        columns[column] = np.memmap(os.path.join(directory, f"{column}.bin"), dtype=dtype, mode="r") \
+            if meta["rows"] else np.empty(0, dtype=dtype)
+    dictionaries = {}
+    for column in STRING_COLUMNS:
+        with open(os.path.join(directory, f"{column}.json"), encoding="utf-8") as file:
+            dictionaries[column] = json.load(file)
+    return ArchivedAnswers(form_id=form_id, rows=meta["rows"], max_answer_id=meta["max_answer_id"],
+                           columns=columns, dictionaries=dictionaries)
+
+
+async def load_archive(form_id: int) -> Optional[ArchivedAnswers]:
+    """The archive of a form, once its answers have been pruned from the live
+    table. Files left by an archiving which failed before that are ignored,
+    or their answers would be counted twice."""
+    archived_at = await database.fetch_val(
+        feedback_form_table.select().with_only_columns(feedback_form_table.c.archived_at).where(
+            feedback_form_table.c.id == form_id))
+    if archived_at is None:
+        return None
+    return read_archive(form_id)
+
+
+async def _iter_answer_pages(question_ids: list[int]) -> AsyncIterator[list]:
+    """Answers to `question_ids` in the order of the archive. Legacy answers
+    without a submission come first, the archive stores them as submission 0.
+    Everything is read per question along ix_answers_question_submission_id,
+    so no page needs a sort in the database."""
+    for question_id in question_ids:
+        last_id = 0
+        while True:
+            rows = await database.fetch_all(
+                response_table.select().where(
+                    response_table.c.question_id == question_id, response_table.c.submission_id.is_(None),
+                    response_table.c.id > last_id,
+                ).order_by(response_table.c.id).limit(config.EXPORT_BATCH_SIZE))
+            if not rows:
+                break
+            yield rows
+            last_id = rows[-1].id
+    async for rows in iter_submission_pages(question_ids, list(response_table.columns), config.EXPORT_BATCH_SIZE):
+        # Pages hold whole submissions, grouped by question.
+        yield sorted(rows, key=lambda row: (row.submission_id, row.id))
+
+
+async def archive_form(form_id: int) -> dict:
+    """Compact the answers of a closed form into its archive and delete them
+    from the answers table. A form is archived once; answers which reach it
+    afterwards stay in the live table and are read alongside the archive.
+    Until `archived_at` is set, in the transaction which deletes the answers,
+    readers ignore the archive, so a failed attempt can simply be retried."""
+    question_ids = [row.id for row in await database.fetch_all(
+        question_table.select().with_only_columns(question_table.c.id).where(question_table.c.form_id == form_id))]
+    directory = archive_path(form_id)
+    staging = directory + ".staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        with _ColumnWriter(staging) as writer:
+            max_answer_id = 0
+            if question_ids:
+                async for rows in _iter_answer_pages(question_ids):
+                    writer.write(rows)
+                    max_answer_id = max(max_answer_id, max(row.id for row in rows))
+            writer.close({"form_id": form_id, "max_answer_id": max_answer_id})
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    # The form is not archived yet, so files left in its directory by an
+    # attempt which failed before the transaction below are read by no one.
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+
+    # Delete exactly the answers which were written to the archive: answers
+    # committed meanwhile, with lower ids on Postgres, stay in the live table.
+    archived_ids = read_archive(form_id).columns["answer_id"]
+    async with database.transaction():
+        for start in range(0, writer.rows, config.EXPORT_BATCH_SIZE):
+            await database.execute(response_table.delete().where(
+                response_table.c.id.in_(archived_ids[start:start + config.EXPORT_BATCH_SIZE].tolist())))
+        await database.execute(feedback_form_table.update().values(
+            archived_at=datetime.datetime.utcnow()).where(feedback_form_table.c.id == form_id))
+    logger.info("Archived %s answers of form %s", writer.rows, form_id)
+    return {"form_id": form_id, "archived_answers": writer.rows}
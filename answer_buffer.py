@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import func
+
+from app_databases.database import DATABASE_ERRORS, database, response_table, submission_table, upsert
+from config import config
+from live_results import live_results
+from rating_stats import apply_rating_deltas, rating_deltas
+
+logger = logging.getLogger(__name__)
+
+buffer_full_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many submissions in flight, please retry shortly",
+    headers={"Retry-After": "1"},
+)
+
+
+@dataclass
+class PendingSubmission:
+    reference: str
+    form_id: int
+    user_id: int
+    answers: list[dict]  # answer rows without submission_id
+
+
+async def write_submissions(submissions: list[PendingSubmission]) -> dict[str, int]:
+    """Insert submissions and their answers in one transaction, using one
+    execute_many per table regardless of how many submissions there are.
+    A user has one submission per form: submitting again replaces the answers
+    of the earlier submission, whose ratings are taken back out of the
+    aggregates. The rating aggregates are updated in the same transaction.
+    Returns the submission ids by reference."""
+    # Within a batch the latest submission of a user to a form wins.
+    latest = {(submission.user_id, submission.form_id): submission for submission in submissions}
+    statement = upsert(submission_table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[submission_table.c.user_id, submission_table.c.form_id],
+        set_={"reference": statement.excluded.reference, "created_at": func.now()},
+    )
+    async with database.transaction():
+        await database.execute_many(statement, [
+            {"reference": submission.reference, "form_id": submission.form_id, "user_id": submission.user_id}
+            for submission in latest.values()
+        ])
+        submission_ids = {
+            row.reference: row.id for row in await database.fetch_all(
+                submission_table.select().with_only_columns(submission_table.c.id, submission_table.c.reference).where(
+                    submission_table.c.reference.in_([submission.reference for submission in latest.values()])))
+        }
+        form_ids = {submission_ids[submission.reference]: submission.form_id for submission in latest.values()}
+        replaced = await database.fetch_all(
+            response_table.select().with_only_columns(
+                response_table.c.submission_id, response_table.c.question_id, response_table.c.rating).where(
+                response_table.c.submission_id.in_(list(form_ids))))
+        if replaced:
+            await database.execute(response_table.delete().where(
+                response_table.c.submission_id.in_({row.submission_id for row in replaced})))
+            await apply_rating_deltas(rating_deltas(
+                ((form_ids[row.submission_id], row.question_id, row.rating) for row in replaced), sign=-1))
+        await database.execute_many(response_table.insert(), [
+            {**answer, "submission_id": submission_ids[submission.reference]}
+            for submission in latest.values() for answer in submission.answers
+        ])
+        await apply_rating_deltas(rating_deltas(
+            (submission.form_id, answer["question_id"], answer["rating"])
+            for submission in latest.values() for answer in submission.answers))
+    for form_id in set(form_ids.values()):
+        live_results.notify(form_id)
+    for submission in submissions:
+        submission_ids.setdefault(
+            submission.reference, submission_ids[latest[(submission.user_id, submission.form_id)].reference])
+    return submission_ids
+
+
+class AnswerBuffer:
+    """Bounded in-process queue of validated submissions which a background
+    task flushes to the database once `batch_size` submissions are waiting or
+    `flush_interval` seconds have passed since the first of them arrived.
+
+    Submissions are acknowledged before they are written, so none is dropped:
+    if a batch fails each submission is retried on its own, and the ones which
+    still fail are appended to the dead letter file, from where they can be
+    replayed with `write_submissions`."""
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float, enqueue_timeout: float,
+                 retries: int, retry_delay: float, dead_letter_path: str):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.dead_letter_path = dead_letter_path
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._unwritten: list[PendingSubmission] = []  # of the batch being flushed
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed_submissions = 0
+        self.failed_submissions = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        logger.info("Starting the answer write-behind buffer")
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._flusher_done)
+
+    async def stop(self) -> None:
+        """Stop accepting submissions and wait until everything queued so far
+        has been written."""
+        if self._task is None:
+            return
+        logger.info("Draining %s buffered submissions", self._queue.qsize())
+        task, self._task = self._task, None
+        await self._queue.put(None)  # wakes the flusher up; it drains and exits
+        await task
+
+    async def submit(self, submission: PendingSubmission) -> None:
+        if self._task is None:
+            raise buffer_full_exception
+        try:
+            await asyncio.wait_for(self._queue.put(submission), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError as error:
+            self.rejected += 1
+            raise buffer_full_exception from error
+        self.enqueued += 1
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    # Drain whatever is still queued behind the stop marker.
+                    while not self._queue.empty():
+                        leftover = self._queue.get_nowait()
+                        if leftover is not None:
+                            batch.append(leftover)
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    def _flusher_done(self, task: asyncio.Task) -> None:
+        """Keeps what a crashed flusher had not written yet, and makes `submit`
+        refuse new submissions instead of queueing them for nobody."""
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error("The answer buffer flusher crashed", exc_info=task.exception())
+        if self._task is task:
+            self._task = None
+        unwritten, self._unwritten = self._unwritten, []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                unwritten.append(item)
+        self._dead_letter(unwritten, repr(task.exception()))
+
+    def _dead_letter(self, submissions: list[PendingSubmission], error: str) -> None:
+        if not submissions:
+            return
+        self.failed_submissions += len(submissions)
+        logger.error("Writing %s submissions to %s: %s", len(submissions), self.dead_letter_path, error)
+        with open(self.dead_letter_path, "a") as file:
+            file.writelines(json.dumps({**asdict(submission), "error": error}) + "\n" for submission in submissions)
+            file.flush()
+            os.fsync(file.fileno())
+
+    async def _flush(self, batch: list[PendingSubmission]) -> None:
+        started = time.perf_counter()
+        self._unwritten = list(batch)
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                await write_submissions(chunk)
+                self.flushed_submissions += len(chunk)
+            except DATABASE_ERRORS as error:
+                logger.error("Flushing %s submissions failed, retrying one by one: %s", len(chunk), error)
+                await self._flush_individually(chunk)
+            del self._unwritten[:len(chunk)]
+        elapsed = time.perf_counter() - started
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+    async def _flush_individually(self, chunk: list[PendingSubmission]) -> None:
+        for submission in chunk:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                try:
+                    await write_submissions([submission])
+                except DATABASE_ERRORS as error:
+                    logger.warning("Writing submission %s failed (attempt %s): %s", submission.reference,
+                                   attempt + 1, error)
+                    last_error = error
+                else:
+                    self.flushed_submissions += 1
+                    break
+            else:
+                self._dead_letter([submission], repr(last_error))
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "flushed_submissions": self.flushed_submissions,
+            "failed_submissions": self.failed_submissions,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.flushed_submissions / self.batches if self.batches else 0.0,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.batches if self.batches else 0.0,
+        }
+
+
+answer_buffer = AnswerBuffer(
+    max_queue=config.WRITE_BEHIND_MAX_QUEUE,
+    batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=config.WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+    enqueue_timeout=config.WRITE_BEHIND_ENQUEUE_TIMEOUT_MS / 1000,
+    retries=config.WRITE_BEHIND_RETRIES,
+    retry_delay=config.WRITE_BEHIND_RETRY_DELAY_MS / 1000,
+    dead_letter_path=config.WRITE_BEHIND_DEAD_LETTER_PATH,
+)
@@ -1,9 +1,13 @@
 # Here the database schema is defined,
+import sqlite3
+
 import databases
 import sqlalchemy
-from sqlalchemy import (TIMESTAMP, Column, Integer, String, Table,
-                        func, Boolean, ForeignKey, )
+from sqlalchemy import (DDL, TIMESTAMP, BigInteger, Column, Index, Integer, String, Table,
+                        event, func, Boolean, ForeignKey, UniqueConstraint, )
+from sqlalchemy.dialects import postgresql, sqlite
 
+from app_databases.routing import RoutingDatabase
 from config import config
 
 # BoilerPlate code #
@@ -28,11 +32,23 @@ user_table = Table(
     Column("fcm_token", String),
     Column("verification_code", String, default=None),
     Column("confirmed", Boolean, default=False),
-    Column("role_id", Integer, ForeignKey("roles.id"), nullable=False),
+    Column("role_id", Integer, ForeignKey("roles.id"), nullable=False, index=True),
+    Column("token_version", Integer, server_default="0", index=True),  # only revoked users are above 0
     Column("created_at", TIMESTAMP, default=func.now()),
     Column("updated_at", TIMESTAMP, default=func.now(), onupdate=func.now())
 )
 
+refresh_token_table = Table(
+    "refresh_tokens",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("token_hash", String, unique=True, nullable=False),  # sha256 of the opaque token
+    Column("expires_at", TIMESTAMP, nullable=False),
+    Column("revoked", Boolean, server_default=sqlalchemy.false()),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+)
+
 question_types_table = Table(
     "question_type",
     metadata,
@@ -48,17 +64,22 @@ feedback_form_table = Table(
     "feedback_forms",
     metadata,
     Column("id", Integer, primary_key=True, index=True),
-    Column("title", String),
+    Column("title", String, index=True),
     Column("created_by", Integer, ForeignKey("users.id")),  # Link to admin creator
+    Column("tree_version", Integer, server_default="0"),  # bumped on any change to the form, questions or options
+    Column("closed_at", TIMESTAMP, nullable=True),  # closed forms take no more answers
+    Column("archived_at", TIMESTAMP, nullable=True),  # answers moved to the columnar archive
     Column("created_at", TIMESTAMP, default=func.now()),
-    Column("updated_at", TIMESTAMP, default=func.now(), onupdate=func.now())
+    Column("updated_at", TIMESTAMP, default=func.now(), onupdate=func.now()),
+    # Serves the created_by filter of the form list along with its keyset order on id.
+    Index("ix_feedback_forms_created_by_id", "created_by", "id"),
 )
 
 question_table = Table(
     "questions",
     metadata,
     Column("id", Integer, primary_key=True, index=True),
-    Column("form_id", Integer, ForeignKey("feedback_forms.id")),
+    Column("form_id", Integer, ForeignKey("feedback_forms.id"), index=True),
     Column("text", String),
     Column("description", String),
     Column("type", Integer, ForeignKey("question_type.id"), nullable=False),
@@ -68,20 +89,51 @@ options_table = Table(
     "options",
     metadata,
     Column("id", Integer, primary_key=True, index=True),
-    Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+    Column("question_id", Integer, ForeignKey("questions.id"), nullable=False, index=True),
     Column("text", String),
     Column("description", String),
 )
 
+submission_table = Table(
+    "submissions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("reference", String, unique=True, nullable=False),  # handed to the client before the row exists
+    Column("form_id", Integer, ForeignKey("feedback_forms.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+    UniqueConstraint("user_id", "form_id", name="uq_submissions_user_form"),  # one submission per user and form
+)
+
 response_table = Table(
     "answers",
     metadata,
     Column("id", Integer, primary_key=True, index=True),
-    Column("question_id", Integer, ForeignKey("questions.id")),
-    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("submission_id", Integer, ForeignKey("submissions.id"), index=True),
+    Column("question_id", Integer, ForeignKey("questions.id"), index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True),
     Column("selected_answer", String),
     Column("user_input_answer", String),
     Column("rating", Integer, nullable=True),
+    # Answers to one question in submission order, read without sorting by the analytics and the archive.
+    Index("ix_answers_question_submission_id", "question_id", "submission_id", "id"),
+)
+
+# Ratings are bucketed as 0..RATING_BUCKETS - 1. Submissions with other ratings are rejected with 422.
+RATING_BUCKETS = 11
+
+# Running rating aggregates per question, maintained in the same transaction
+# as the answers so statistics never need to scan the answers table.
+question_rating_stats_table = Table(
+    "question_rating_stats",
+    metadata,
+    Column("question_id", Integer, ForeignKey("questions.id"), primary_key=True),
+    Column("form_id", Integer, ForeignKey("feedback_forms.id"), nullable=False, index=True),
+    Column("count", Integer, nullable=False, server_default="0"),
+    # 64 bit: squares of ratings up to 10 overflow a 32 bit column after ~21M answers.
+    Column("sum", BigInteger, nullable=False, server_default="0"),
+    Column("sum_of_squares", BigInteger, nullable=False, server_default="0"),
+    *[Column(f"bucket_{bucket}", Integer, nullable=False, server_default="0") for bucket in range(RATING_BUCKETS)],
 )
 
 profile_table = Table(
@@ -95,15 +147,138 @@ profile_table = Table(
     Column("updated_at", TIMESTAMP, default=func.now(), onupdate=func.now()),
 )
 
-connect_args = {"check_same_thread": False} if "sqlite" in config.DATABASE_URL else {}
-engine = sqlalchemy.create_engine(
-    config.DATABASE_URL, connect_args=connect_args
+# One row per migration applied by app_databases/migrations.py.
+schema_version_table = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String, nullable=False),
+    Column("applied_at", TIMESTAMP, server_default=func.now()),
 )
 
-db_args = {"min_size": 1, "max_size": 3} if "postgres" in config.DATABASE_URL else {}
 
-metadata.create_all(engine)
-database = databases.Database(
-    config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK, **db_args
-)
+# Full-text search over free text, by table name. On SQLite every table gets an
+# external content FTS5 index `<table>_fts` kept in sync by triggers; on Postgres
+# a generated tsvector column `search_vector` with a GIN index.
+SEARCHABLE_COLUMNS = {"answers": "user_input_answer", "questions": "text", "feedback_forms": "title"}
+
+
+def search_index_ddl(table: str, column: str, dialect: str) -> list[str]:
+    if dialect == "postgresql":
+        return [
+            f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+            f"(to_tsvector('english', coalesce({column}, ''))) STORED",
+            f"CREATE INDEX ix_{table}_search_vector ON {table} USING GIN (search_vector)",
+        ]
+    index = f"{table}_fts"
+    # Rows without text, like most rating answers, are left out of the index.
+    remove_old = (f"INSERT INTO {index} ({index}, rowid, {column}) "
+                  f"SELECT 'delete', old.id, old.{column} WHERE old.{column} IS NOT NULL;")
+    add_new = f"INSERT INTO {index} (rowid, {column}) SELECT new.id, new.{column} WHERE new.{column} IS NOT NULL;"
+    return [
+        f"CREATE VIRTUAL TABLE {index} USING fts5({column}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER {index}_insert AFTER INSERT ON {table} BEGIN {add_new} END",
+        f"CREATE TRIGGER {index}_delete AFTER DELETE ON {table} BEGIN {remove_old} END",
+        f"CREATE TRIGGER {index}_update AFTER UPDATE OF {column} ON {table} BEGIN {remove_old} {add_new} END",
+    ]
+
+
+for _table in (response_table, question_table, feedback_form_table):
+    for _dialect in ("sqlite", "postgresql"):
+        for _statement in search_index_ddl(_table.name, SEARCHABLE_COLUMNS[_table.name], _dialect):
+            event.listen(_table, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+
+
+class Database(databases.Database):
+    """`databases.Database` with a pooled SQLite backend."""
+    SUPPORTED_BACKENDS = {
+        **databases.Database.SUPPORTED_BACKENDS,
+        "sqlite": "app_databases.sqlite_pool:PooledSQLiteBackend",
+        "sqlite+aiosqlite": "app_databases.sqlite_pool:PooledSQLiteBackend",
+    }
+
+
+def pool_options(url: str, read_only: bool = False) -> dict:
+    if "postgres" in url:
+        options = {
+            "min_size": config.DB_POOL_MIN_SIZE,
+            "max_size": config.DB_POOL_MAX_SIZE,
+            "timeout": config.DB_CONNECT_TIMEOUT_SECONDS,
+            "statement_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+        }
+        if config.DB_COMMAND_TIMEOUT_SECONDS is not None:
+            options["command_timeout"] = config.DB_COMMAND_TIMEOUT_SECONDS
+        return options
+    pragmas = {
+        "journal_mode": config.SQLITE_JOURNAL_MODE,
+        "synchronous": config.SQLITE_SYNCHRONOUS,
+        "mmap_size": config.SQLITE_MMAP_SIZE,
+        "cache_size": config.SQLITE_CACHE_SIZE,
+    }
+    if read_only:
+        pragmas["query_only"] = "ON"
+    return {
+        # SQLite takes one writer at a time anyway, so writes queue for a single connection.
+        "max_size": config.DB_POOL_MAX_SIZE if read_only else min(config.DB_POOL_MAX_SIZE, 1),
+        "acquire_timeout": config.DB_POOL_TIMEOUT_SECONDS,
+        "cached_statements": config.DB_STATEMENT_CACHE_SIZE,
+        "timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        "pragmas": pragmas,
+    }
+
+
+def pool_stats(db: databases.Database) -> dict:
+    """Size and saturation of a database's connection pool."""
+    if isinstance(db, RoutingDatabase):
+        stats = {"writer": pool_stats(db.writer), "reads": db.reads, "writes": db.writes}
+        if db.reader is not db.writer:
+            stats["reader"] = pool_stats(db.reader)
+        return stats
+    backend = db._backend
+    if hasattr(backend, "pool_stats"):
+        return backend.pool_stats()
+    pool = getattr(backend, "_pool", None)
+    if pool is None or not hasattr(pool, "get_size"):
+        return {}
+    size, idle = pool.get_size(), pool.get_idle_size()
+    return {"backend": "postgres", "max_size": pool.get_max_size(), "size": size, "in_use": size - idle,
+            "idle": idle}
+
+
+def upsert(table: Table):
+    """INSERT statement of the configured dialect, which supports
+    `on_conflict_do_update` / `on_conflict_do_nothing`."""
+    if "postgres" in config.DATABASE_URL:
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+# What the drivers raise when a statement is refused, like a constraint
+# violation or a locked database; anything else is a bug and should propagate.
+DATABASE_ERRORS: tuple = (sqlite3.IntegrityError, sqlite3.OperationalError)
+try:
+    import asyncpg
+except ImportError:
+    pass
+else:
+    DATABASE_ERRORS += (asyncpg.exceptions.IntegrityConstraintViolationError,
+                        asyncpg.exceptions.TransactionRollbackError, asyncpg.exceptions.OperatorInterventionError,
+                        asyncpg.exceptions.PostgresConnectionError, asyncpg.exceptions.ConnectionDoesNotExistError)
+
+
+def create_database() -> RoutingDatabase:
+    """The writer on DATABASE_URL, and a reader: read-only connections to the
+    same file on SQLite, the replica on Postgres if DATABASE_REPLICA_URL is
+    set. Without a reader all queries use the writer."""
+    writer = Database(config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK,
+                      **pool_options(config.DATABASE_URL))
+    reader_url = config.DATABASE_REPLICA_URL if "postgres" in config.DATABASE_URL else config.DATABASE_URL
+    reader = None
+    if reader_url and config.DB_READ_WRITE_SPLIT and ":memory:" not in reader_url:
+        reader = Database(reader_url, **pool_options(reader_url, read_only=True))
+    return RoutingDatabase(writer, reader)
+
+
+database = create_database()
 # BoilerPlate code #
@@ -0,0 +1,46 @@
+# Batched loaders for related rows. Listing endpoints collect the foreign keys
+# of the rows they are about to return and resolve them here with one IN query
+# per batch, instead of awaiting a query per row.
+from collections import defaultdict
+from typing import Any, Iterable, Optional, Sequence
+
+from sqlalchemy import Column, Table
+
+from app_databases.database import database
+
+# Keeps the number of bound parameters well under SQLite's limit.
+IN_BATCH_SIZE = 500
+
+
+def _batches(keys: Iterable[Any]) -> list[list[Any]]:
+    unique_keys = sorted({key for key in keys if key is not None})
+    return [unique_keys[start:start + IN_BATCH_SIZE] for start in range(0, len(unique_keys), IN_BATCH_SIZE)]
+
+
+async def load_by_ids(table: Table, ids: Iterable[Any], key_column: Optional[Column] = None,
+                      columns: Optional[Sequence[Column]] = None) -> dict[Any, Any]:
+    """Map each of `ids` to its row of `table`, looked up on `key_column`
+    (the primary key by default). Missing ids are simply absent. Only
+    `columns`, and the key column, are selected when given."""
+    key_column = table.c.id if key_column is None else key_column
+    query = table.select()
+    if columns is not None:
+        query = query.with_only_columns(key_column, *(column for column in columns if column is not key_column))
+    rows = {}
+    for batch in _batches(ids):
+        for row in await database.fetch_all(query.where(key_column.in_(batch))):
+            rows[row[key_column.name]] = row
+    return rows
+
+
+async def load_children(table: Table, foreign_key: Column, parent_ids: Iterable[Any],
+                        order_by: Optional[Column] = None) -> dict[Any, list[Any]]:
+    """Group the rows of `table` by `foreign_key` for every id in
+    `parent_ids`. Parents without children map to nothing."""
+    order_by = table.c.id if order_by is None else order_by
+    children = defaultdict(list)
+    for batch in _batches(parent_ids):
+        query = table.select().where(foreign_key.in_(batch)).order_by(order_by)
+        for row in await database.fetch_all(query):
+            children[row[foreign_key.name]].append(row)
+    return dict(children)
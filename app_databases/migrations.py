@@ -0,0 +1,202 @@
+# Versioned schema migrations. The schema is no longer created when
+# app_databases.database is imported: `migrate()` compares the latest version
+# recorded in schema_version with MIGRATIONS and applies the missing ones in
+# one transaction, under a lock, so workers starting together do not race.
+# An up to date database costs a couple of cheap queries.
+#
+# Databases created by `metadata.create_all` before migrations existed have
+# no schema_version table and start at version 0. Every migration checks what
+# is already there, since such a database may have any of the later tables,
+# columns and indexes.
+#
+# Run with: python -m app_databases.migrations [--status]
+import argparse
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import sqlalchemy
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateColumn
+
+from app_databases.database import (SEARCHABLE_COLUMNS, metadata, response_table, schema_version_table,
+                                    search_index_ddl, submission_table)
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Postgres advisory lock held by the migrating worker.
+MIGRATION_LOCK_KEY = 720401
+# Columns added to tables which existed in the first release.
+ADDED_COLUMNS = {
+    "users": ["token_version"],
+    "feedback_forms": ["tree_version", "closed_at", "archived_at"],
+    "answers": ["submission_id"],
+}
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def create_tables(connection: Connection) -> None:
+    had_rating_stats = inspect(connection).has_table("question_rating_stats")
+    metadata.create_all(connection)
+    if not had_rating_stats and connection.scalar(select(response_table.c.id).limit(1)) is not None:
+        logger.warning("Rating aggregates start empty, fill them with: python -m rating_stats")
+
+
+def add_columns(connection: Connection) -> None:
+    inspector = inspect(connection)
+    for table_name, column_names in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        for name in column_names:
+            if name not in existing:
+                column = CreateColumn(metadata.tables[table_name].c[name]).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column}")
+
+
+def add_indexes(connection: Connection) -> None:
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def add_submission_uniqueness(connection: Connection) -> None:
+    inspector = inspect(connection)
+    names = ({constraint["name"] for constraint in inspector.get_unique_constraints("submissions")}
+             | {index["name"] for index in inspector.get_indexes("submissions")})
+    if "uq_submissions_user_form" in names:
+        return
+    duplicated = select(submission_table.c.user_id).group_by(
+        submission_table.c.user_id, submission_table.c.form_id).having(func.count() > 1).subquery()
+    duplicates = connection.scalar(select(func.count()).select_from(duplicated))
+    if duplicates:
+        raise RuntimeError(f"{duplicates} users have more than one submission to a form, "
+                           f"keep one per user and form and migrate again")
+    # SQLite cannot add a constraint to an existing table, a unique index serves ON CONFLICT all the same.
+    connection.exec_driver_sql("CREATE UNIQUE INDEX uq_submissions_user_form ON submissions (user_id, form_id)")
+
+
+def add_search_indexes(connection: Connection) -> None:
+    dialect = connection.dialect.name
+    inspector = inspect(connection)
+    for table, column in SEARCHABLE_COLUMNS.items():
+        if dialect == "postgresql":
+            present = "search_vector" in {existing["name"] for existing in inspector.get_columns(table)}
+        else:
+            present = inspector.has_table(f"{table}_fts")
+        if present:
+            continue
+        for statement in search_index_ddl(table, column, dialect):
+            connection.exec_driver_sql(statement)
+        if dialect != "postgresql":  # generated columns fill themselves
+            connection.exec_driver_sql(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def widen_rating_sums(connection: Connection) -> None:
+    # SQLite stores every integer in up to 8 bytes whatever the declared type.
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql('ALTER TABLE question_rating_stats ALTER COLUMN "sum" TYPE BIGINT, '
+                                   'ALTER COLUMN sum_of_squares TYPE BIGINT')
+
+
+MIGRATIONS = [
+    Migration(1, "create missing tables", create_tables),
+    Migration(2, "add columns introduced after the first release", add_columns),
+    Migration(3, "index foreign keys and filtered columns", add_indexes),
+    Migration(4, "one submission per user and form", add_submission_uniqueness),
+    Migration(5, "full-text search indexes", add_search_indexes),
+    Migration(6, "64 bit rating sums", widen_rating_sums),
+    Migration(7, "index forms by creator", add_indexes),
+    Migration(8, "index answers by question and submission", add_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def create_migration_engine(url: str) -> Engine:
+    if "sqlite" not in url:
+        return sqlalchemy.create_engine(url, poolclass=NullPool)
+    engine = sqlalchemy.create_engine(url, poolclass=NullPool,
+                                      connect_args={"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000})
+
+    @event.listens_for(engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        # pysqlite would begin transactions lazily and commit around DDL; begin them below instead.
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent migrators queue behind each other.
+        connection.exec_driver_sql(connection.get_execution_options().get("sqlite_begin", "BEGIN"))
+
+    return engine
+
+
+def current_version(connection: Connection) -> int:
+    if not inspect(connection).has_table(schema_version_table.name):
+        return 0
+    return connection.scalar(select(func.max(schema_version_table.c.version))) or 0
+
+
+def apply_pending(connection: Connection) -> list[int]:
+    version = current_version(connection)
+    pending = [migration for migration in MIGRATIONS if migration.version > version]
+    if not pending:
+        return []
+    if version == 0 and not inspect(connection).get_table_names():
+        # An empty database gets the current schema in one go.
+        metadata.create_all(connection)
+        logger.info("Created the schema at version %s", LATEST_VERSION)
+    else:
+        schema_version_table.create(connection, checkfirst=True)
+        for migration in pending:
+            logger.info("Applying migration %s: %s", migration.version, migration.description)
+            migration.apply(connection)
+    connection.execute(schema_version_table.insert(), [
+        {"version": migration.version, "description": migration.description} for migration in pending
+    ])
+    return [migration.version for migration in pending]
+
+
+def migrate(url: Optional[str] = None) -> list[int]:
+    """Bring the database up to LATEST_VERSION and return the versions
+    applied, none when it already was."""
+    engine = create_migration_engine(url or config.DATABASE_URL)
+    try:
+        with engine.connect() as connection:
+            if current_version(connection) >= LATEST_VERSION:
+                return []
+        with engine.connect() as connection:
+            connection.execution_options(sqlite_begin="BEGIN IMMEDIATE")
+            with connection.begin():
+                if connection.dialect.name == "postgresql":
+                    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                # Checked again under the lock, another worker may have just migrated.
+                return apply_pending(connection)
+    finally:
+        engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--status", action="store_true", help="Only print the current and the latest version")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.status:
+        engine = create_migration_engine(config.DATABASE_URL)
+        with engine.connect() as connection:
+            print(f"schema version {current_version(connection)}, latest {LATEST_VERSION}")
+        engine.dispose()
+        return
+    applied = migrate()
+    print(f"applied migrations {applied}" if applied else f"already at schema version {LATEST_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
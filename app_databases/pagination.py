@@ -0,0 +1,103 @@
+# Keyset pagination on integer primary keys. Pages are fetched with
+# `WHERE id > :last_id ORDER BY id LIMIT :n`, so the cost of a page does not
+# grow with the size of the table or with how deep the client has paged.
+import base64
+import json
+from typing import AsyncIterator, Literal, Optional, Sequence
+
+from fastapi import HTTPException, Query, status
+from pydantic import BaseModel
+from sqlalchemy import Column, Select, and_, select
+
+from app_databases.database import database, response_table
+from config import config
+
+invalid_cursor_exception = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+class PageParams(BaseModel):
+    cursor: Optional[str] = None
+    limit: int
+    order: Literal["asc", "desc"] = "asc"
+
+
+def page_params(
+        cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+        limit: Optional[int] = Query(None, ge=1, description="Page size, capped at PAGE_SIZE_MAX"),
+        order: Literal["asc", "desc"] = Query("asc", description="Sort order on id"),
+) -> PageParams:
+    limit = min(limit or config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX)
+    return PageParams(cursor=cursor, limit=limit, order=order)
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"]
+    except (ValueError, KeyError, TypeError) as error:
+        raise invalid_cursor_exception from error
+    if not isinstance(last_id, int):
+        raise invalid_cursor_exception
+    return last_id
+
+
+def prefix_filter(column: Column, prefix: str):
+    # A range rather than LIKE 'prefix%' so that an index on the column is used.
+    return and_(column >= prefix, column < prefix + "\U0010ffff")
+
+
+async def fetch_page(query: Select, id_column: Column, page: PageParams) -> tuple[list, Optional[str]]:
+    """Run `query` for one page and return its rows and the cursor of the next
+    page, which is None on the last page."""
+    if page.cursor is not None:
+        last_id = decode_cursor(page.cursor)
+        query = query.where(id_column > last_id if page.order == "asc" else id_column < last_id)
+    query = query.order_by(id_column.asc() if page.order == "asc" else id_column.desc()).limit(page.limit + 1)
+    rows = await database.fetch_all(query)
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    return rows, encode_cursor(rows[-1][id_column.name])
+
+
+async def iter_submission_pages(question_ids: list[int], columns: Sequence[Column],
+                                page_size: int) -> AsyncIterator[list]:
+    """Answers to `question_ids` which belong to a submission, in pages of
+    whole submissions in submission id order. Within a page the answers are
+    grouped by question, each question's in (submission id, answer id) order.
+
+    Every question is read on its own along ix_answers_question_submission_id,
+    so no page needs a sort: the page ends at the smallest submission id which
+    any question reaches within its share of `page_size`. A submission has at
+    most one answer per question, so a page holds at most `page_size` answers,
+    or one per question when there are more questions than that."""
+    if not question_ids:
+        return
+    per_question = max(1, page_size // len(question_ids))
+    after = 0
+    while True:
+        ends = []
+        for question_id in question_ids:
+            end = await database.fetch_val(
+                select(response_table.c.submission_id).where(
+                    response_table.c.question_id == question_id, response_table.c.submission_id > after,
+                ).order_by(response_table.c.submission_id).offset(per_question - 1).limit(1))
+            if end is not None:
+                ends.append(end)
+        end = min(ends) if ends else None
+        rows = []
+        for question_id in question_ids:
+            query = select(*columns).where(response_table.c.question_id == question_id,
+                                           response_table.c.submission_id > after)
+            if end is not None:
+                query = query.where(response_table.c.submission_id <= end)
+            rows.extend(await database.fetch_all(
+                query.order_by(response_table.c.submission_id, response_table.c.id)))
+        if rows:
+            yield rows
+        if end is None:
+            return
+        after = end
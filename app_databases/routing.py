@@ -0,0 +1,128 @@
+# Read/write routing over two `databases.Database` instances. Writes,
+# transactions and anything issued inside a transaction go to the writer;
+# plain SELECTs go to the reader. On SQLite the writer is a single pooled
+# connection, so writes queue in the pool instead of spinning on the file
+# lock, and the readers are read-only connections which WAL lets run next to
+# it. On Postgres the reader is the replica pool, when a replica is configured.
+import contextvars
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional, Union
+
+import databases
+from sqlalchemy.sql import ClauseElement
+
+_in_transaction: contextvars.ContextVar[bool] = contextvars.ContextVar("in_write_transaction", default=False)
+
+
+def is_read_only(query: Union[ClauseElement, str]) -> bool:
+    if isinstance(query, str):
+        words = query.split(None, 1)
+        return bool(words) and words[0].upper() == "SELECT"
+    return getattr(query, "is_select", False)
+
+
+class _RoutedTransaction:
+    """The writer's transaction, which also sends every query made inside it
+    to the writer, so the transaction reads its own writes."""
+
+    def __init__(self, transaction: databases.core.Transaction):
+        self._transaction = transaction
+        self._token: Optional[contextvars.Token] = None
+
+    async def __aenter__(self):
+        self._token = _in_transaction.set(True)
+        try:
+            return await self._transaction.__aenter__()
+        except BaseException:
+            _in_transaction.reset(self._token)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._transaction.__aexit__(*exc_info)
+        finally:
+            _in_transaction.reset(self._token)
+
+
+class RoutingDatabase:
+    def __init__(self, writer: databases.Database, reader: Optional[databases.Database] = None):
+        self.writer = writer
+        # force_rollback keeps everything on the writer's single rolled back connection.
+        self.reader = reader if reader is not None and not writer._force_rollback else writer
+        self.reads = 0
+        self.writes = 0
+        # Called with the duration of every query, see metrics.py.
+        self.query_observer: Optional[Callable[[float], None]] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.writer.is_connected
+
+    async def connect(self) -> None:
+        await self.writer.connect()
+        if self.reader is not self.writer:
+            await self.reader.connect()
+
+    async def disconnect(self) -> None:
+        if self.reader is not self.writer:
+            await self.reader.disconnect()
+        await self.writer.disconnect()
+
+    def _route(self, query: Union[ClauseElement, str]) -> databases.Database:
+        if self.reader is not self.writer and not _in_transaction.get() and is_read_only(query):
+            self.reads += 1
+            return self.reader
+        self.writes += 1
+        return self.writer
+
+    async def _observed(self, query: Awaitable) -> Any:
+        if self.query_observer is None:
+            return await query
+        started = time.perf_counter()
+        try:
+            return await query
+        finally:
+            self.query_observer(time.perf_counter() - started)
+
+    async def fetch_all(self, query: Union[ClauseElement, str], values: Optional[dict] = None) -> list:
+        return await self._observed(self._route(query).fetch_all(query, values))
+
+    async def fetch_one(self, query: Union[ClauseElement, str], values: Optional[dict] = None) -> Any:
+        return await self._observed(self._route(query).fetch_one(query, values))
+
+    async def fetch_val(self, query: Union[ClauseElement, str], values: Optional[dict] = None,
+                        column: Any = 0) -> Any:
+        return await self._observed(self._route(query).fetch_val(query, values, column=column))
+
+    async def iterate(self, query: Union[ClauseElement, str], values: Optional[dict] = None) -> AsyncGenerator:
+        records = self._route(query).iterate(query, values).__aiter__()
+        waited = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    record = await records.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    waited += time.perf_counter() - started
+                yield record
+        finally:
+            await records.aclose()
+            # One query, timed while waiting for rows and not while the caller handles them.
+            if self.query_observer is not None:
+                self.query_observer(waited)
+
+    async def execute(self, query: Union[ClauseElement, str], values: Optional[dict] = None) -> Any:
+        self.writes += 1
+        return await self._observed(self.writer.execute(query, values))
+
+    async def execute_many(self, query: Union[ClauseElement, str], values: list) -> None:
+        self.writes += 1
+        return await self._observed(self.writer.execute_many(query, values))
+
+    def transaction(self, **kwargs: Any) -> _RoutedTransaction:
+        return _RoutedTransaction(self.writer.transaction(**kwargs))
+
+    def connection(self) -> databases.core.Connection:
+        return self.writer.connection()
@@ -0,0 +1,147 @@
+# Connection pooling for the SQLite backend of `databases`. The stock backend
+# opens a fresh aiosqlite connection (and its thread) every time a query
+# needs one and closes it afterwards. This backend keeps up to `max_size`
+# connections open, applies the configured PRAGMAs once when a connection is
+# opened, and records how long callers waited for one.
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+
+import aiosqlite
+from databases.backends.sqlite import SQLiteBackend, SQLiteConnection, SQLitePool
+from fastapi import HTTPException, status
+from sqlalchemy.sql import ClauseElement
+
+logger = logging.getLogger(__name__)
+
+pool_exhausted_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="All database connections are busy, please retry shortly",
+    headers={"Retry-After": "1"},
+)
+
+
+class PooledSQLitePool(SQLitePool):
+    def __init__(self, url, *, max_size: int, acquire_timeout: float, pragmas: dict[str, Any], **options: Any):
+        super().__init__(url, **options)
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.pragmas = pragmas
+        self._idle: list[aiosqlite.Connection] = []
+        self._opened = 0
+        self._available = asyncio.Condition() if max_size > 0 else None
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def _open(self) -> aiosqlite.Connection:
+        connection = await super().acquire()
+        for name, value in self.pragmas.items():
+            await connection.execute(f"PRAGMA {name}={value}")
+        return connection
+
+    async def acquire(self) -> aiosqlite.Connection:
+        self.acquired += 1
+        if self._available is None:  # max_size <= 0: a connection per use, like the stock backend
+            self.in_use += 1
+            return await self._open()
+        started = time.perf_counter()
+        async with self._available:
+            if not self._idle and self._opened >= self.max_size:
+                self.waited += 1
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._available.wait_for(lambda: self._idle or self._opened < self.max_size),
+                        timeout=self.acquire_timeout)
+                except asyncio.TimeoutError as error:
+                    self.timeouts += 1
+                    raise pool_exhausted_exception from error
+                finally:
+                    self.waiting -= 1
+                    waited = time.perf_counter() - started
+                    self.total_wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.in_use += 1
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            return await self._open()
+        except BaseException:
+            async with self._available:
+                self._opened -= 1
+                self.in_use -= 1
+                self._available.notify()
+            raise
+
+    async def release(self, connection: aiosqlite.Connection) -> None:
+        if self._available is None:
+            self.in_use -= 1
+            await super().release(connection)
+            return
+        if connection.in_transaction:
+            # Whoever held it failed half way through a transaction.
+            await connection.rollback()
+        async with self._available:
+            self.in_use -= 1
+            self._idle.append(connection)
+            self._available.notify()
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        self._opened -= len(idle)
+        for connection in idle:
+            await super().release(connection)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "max_size": self.max_size,
+            "size": self._opened if self._available is not None else self.in_use,
+            "in_use": self.in_use,
+            "idle": len(self._idle),
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "timeouts": self.timeouts,
+            "avg_wait_seconds": self.total_wait_seconds / self.waited if self.waited else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class PooledSQLiteConnection(SQLiteConnection):
+    async def execute(self, query: ClauseElement) -> Any:
+        # The stock backend returns lastrowid whenever it is non zero. A reused
+        # connection remembers the rowid of its last INSERT, which would be
+        # returned for later UPDATEs and DELETEs instead of their row count.
+        assert self._connection is not None, "Connection is not acquired"
+        query_str, args, _, _ = self._compile(query)
+        async with self._connection.cursor() as cursor:
+            await cursor.execute(query_str, args)
+            if cursor.lastrowid and query_str.lstrip()[:6].upper() == "INSERT":
+                return cursor.lastrowid
+            return cursor.rowcount
+
+
+class PooledSQLiteBackend(SQLiteBackend):
+    def __init__(self, database_url, *, max_size: int = 10, acquire_timeout: float = 10.0,
+                 pragmas: Optional[dict[str, Any]] = None, **options: Any):
+        super().__init__(database_url, **options)
+        self._pool = PooledSQLitePool(self._database_url, max_size=max_size, acquire_timeout=acquire_timeout,
+                                      pragmas=pragmas or {}, **options)
+
+    def connection(self) -> PooledSQLiteConnection:
+        return PooledSQLiteConnection(self._pool, self._dialect)
+
+    async def disconnect(self) -> None:
+        await self._pool.close()
+        await super().disconnect()
+
+    def pool_stats(self) -> dict:
+        return self._pool.stats()
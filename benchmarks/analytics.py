@@ -0,0 +1,93 @@
+"""Analytics engine benchmark.
+
+Generates a form with a rating question and a segmenting question answered by
+`--submissions` respondents (two answers each) in a throwaway SQLite database,
+then times the vectorized question analytics and crosstab and measures their
+peak traced memory for each chunk size.
+
+    python -m benchmarks.analytics --submissions 500000 --chunk-size 10000 --chunk-size 100000
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import benchmark_env, temporary_database
+
+PERCENTILES = [50, 90, 99]
+
+
+def generate_answers(db_path: str, submissions: int, batch: int = 100_000) -> tuple[int, int]:
+    connection = sqlite3.connect(db_path)
+    rng = np.random.default_rng(42)
+    with connection:
+        form_id = connection.execute("INSERT INTO feedback_forms (title) VALUES ('analytics benchmark')").lastrowid
+        rating_question = connection.execute(
+            "INSERT INTO questions (form_id, text, type) VALUES (?, 'How likely are you to recommend us?', 1)",
+            (form_id,)).lastrowid
+        segment_question = connection.execute(
+            "INSERT INTO questions (form_id, text, type) VALUES (?, 'Plan', 1)", (form_id,)).lastrowid
+        plans = np.array(["free", "pro", "enterprise"])
+        for start in range(0, submissions, batch):
+            submission_ids = np.arange(start + 1, min(start + batch, submissions) + 1)
+            ratings = rng.integers(0, 11, len(submission_ids))
+            selected = plans[rng.integers(0, len(plans), len(submission_ids))]
+            connection.executemany(
+                "INSERT INTO answers (submission_id, question_id, rating) VALUES (?, ?, ?)",
+                zip(submission_ids.tolist(), [rating_question] * len(submission_ids), ratings.tolist()))
+            connection.executemany(
+                "INSERT INTO answers (submission_id, question_id, selected_answer) VALUES (?, ?, ?)",
+                zip(submission_ids.tolist(), [segment_question] * len(submission_ids), selected.tolist()))
+    connection.close()
+    return rating_question, segment_question
+
+
+async def measure(name: str, answers: int, run) -> None:
+    started = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    await run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:<20} {elapsed:7.2f}s  {answers / elapsed:12,.0f} answers/s  peak {peak / 2 ** 20:8.1f} MiB")
+
+
+async def run_benchmark(submissions: int, chunk_sizes: list[int]) -> None:
+    # Imported late, the environment has to point the app at the benchmark database first.
+    from analytics import question_rating_analytics, rating_crosstab
+    from app_databases.database import database
+    from app_databases.migrations import migrate
+
+    migrate()
+    rating_question, segment_question = generate_answers(os.environ["BENCHMARK_DB_PATH"], submissions)
+    await database.connect()
+    try:
+        for chunk_size in chunk_sizes:
+            print(f"chunk_size={chunk_size}")
+            await measure("question analytics", submissions,
+                          lambda: question_rating_analytics(rating_question, PERCENTILES, chunk_size))
+            await measure("crosstab", 2 * submissions,
+                          lambda: rating_crosstab(rating_question, segment_question, PERCENTILES, chunk_size))
+    finally:
+        await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=500_000)
+    parser.add_argument("--chunk-size", type=int, action="append", dest="chunk_sizes")
+    args = parser.parse_args()
+
+    with temporary_database() as db_path:
+        os.environ.update(benchmark_env(db_path))
+        os.environ["BENCHMARK_DB_PATH"] = db_path
+        asyncio.run(run_benchmark(args.submissions, args.chunk_sizes or [10_000, 100_000]))
+
+
+if __name__ == "__main__":
+    main()
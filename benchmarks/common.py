@@ -0,0 +1,118 @@
+# Helpers shared by the benchmark scripts. They run the real app under uvicorn
+# in a subprocess against a throwaway SQLite file, so client load does not
+# share an event loop with the server being measured.
+import contextlib
+import datetime
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from jose import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+SECRET_KEY = "benchmark-secret"
+
+
+def benchmark_env(db_path: str, **overrides: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "ENV_STATE": "test",
+        "TEST_DATABASE_URL": f"sqlite:///{db_path}",
+        "TEST_DB_FORCE_ROLL_BACK": "false",
+        "TEST_TOKEN_SECRET_KEY": SECRET_KEY,
+        "TEST_ALGORITHM": "HS256",
+    })
+    env.update({f"TEST_{key}": str(value) for key, value in overrides.items()})
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def bearer_headers(email: str) -> dict:
+    """Mint an access token directly instead of paying for a bcrypt login."""
+    expire = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    token = jwt.encode({"sub": email, "exp": expire}, key=SECRET_KEY, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+@contextlib.contextmanager
+def temporary_database():
+    with tempfile.TemporaryDirectory() as directory:
+        yield os.path.join(directory, "bench.db")
+
+
+@contextlib.contextmanager
+def running_server(db_path: str = None, **overrides: str):
+    """Start `main:app` and yield its base url. The database is a throwaway
+    file unless `db_path` is given."""
+    with temporary_database() as default_db_path:
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+             "--no-access-log"],
+            cwd=ROOT,
+            env=benchmark_env(db_path or default_db_path, **overrides),
+            # The app configures its own console logging, which would drown the results.
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.time() + 30
+            while True:
+                try:
+                    if httpx.get(f"{base_url}/role").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.time() > deadline:
+                    raise RuntimeError("Server did not start in time")
+                time.sleep(0.1)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(name: str, values: list[float]) -> str:
+    return (f"{name:<12} n={len(values):<6} p50={percentile(values, 50) * 1000:8.1f}ms "
+            f"p99={percentile(values, 99) * 1000:8.1f}ms max={max(values, default=0) * 1000:8.1f}ms")
+
+
+def seed_form(db_path: str, users: int, questions: int, password_hash: str = "not-a-real-hash") -> tuple[int, list]:
+    """Insert end users and a form with rating questions straight into the
+    database and return the form id and the user emails."""
+    connection = sqlite3.connect(db_path)
+    with connection:
+        end_user_role = connection.execute("SELECT id FROM roles WHERE name = 'endUser'").fetchone()[0]
+        emails = [f"respondent{index}@example.com" for index in range(users)]
+        connection.executemany("INSERT INTO users (email, password, role_id) VALUES (?, ?, ?)",
+                               [(email, password_hash, end_user_role) for email in emails])
+        owner = connection.execute("SELECT min(id) FROM users").fetchone()[0]
+        question_type = connection.execute(
+            "INSERT INTO question_type (name, created_by_user) VALUES ('benchmark rating', ?)", (owner,)).lastrowid
+        form_id = connection.execute(
+            "INSERT INTO feedback_forms (title, created_by) VALUES ('benchmark form', ?)", (owner,)).lastrowid
+        connection.executemany("INSERT INTO questions (form_id, text, type) VALUES (?, ?, ?)",
+                               [(form_id, f"Question {index}", question_type) for index in range(questions)])
+    connection.close()
+    return form_id, emails
@@ -0,0 +1,106 @@
+"""Connection pool and SQLite tuning benchmark.
+
+Runs a mixed workload (form stats and listings read by admins while
+respondents submit answers) at increasing concurrency, first against the
+stock setup (a connection per query, rollback journal, synchronous=FULL) and
+then with the pooled, WAL tuned defaults, and prints the concurrency curve
+of both.
+
+    python -m benchmarks.db_pool --levels 1,4,16,64 --seconds 3
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import sqlite3
+import time
+
+import httpx
+
+from benchmarks.common import bearer_headers, percentile, running_server, seed_form, temporary_database
+
+BASELINE = {
+    "DB_READ_WRITE_SPLIT": "false",
+    "DB_POOL_MAX_SIZE": "0",
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_MMAP_SIZE": "0",
+    "SQLITE_CACHE_SIZE": "-2000",
+}
+
+
+async def run_level(base_url: str, form_id: int, question_ids: list[int], respondents, admin_headers: dict,
+                    concurrency: int, seconds: float, write_ratio: float) -> dict:
+    reads, writes, failures = [], [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal failures
+        while time.perf_counter() < deadline:
+            write = random.random() < write_ratio
+            started = time.perf_counter()
+            try:
+                if write:
+                    body = {"answers": [{"question_id": question_id, "rating": random.randint(0, 10)}
+                                        for question_id in question_ids]}
+                    response = await client.post(f"/feedback_form/{form_id}/answers", json=body,
+                                                 headers=bearer_headers(next(respondents)))
+                else:
+                    path = random.choice([f"/feedback_form/{form_id}/stats", "/feedback_form?limit=20"])
+                    response = await client.get(path, headers=admin_headers)
+                if response.status_code >= 300:
+                    failures += 1
+            except httpx.TransportError:
+                failures += 1
+            (writes if write else reads).append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    return {"elapsed": elapsed, "reads": reads, "writes": writes, "failures": failures}
+
+
+def run_setup(name: str, overrides: dict, args) -> None:
+    print(f"== {name} {overrides or ''}")
+    print(f"{'concurrency':>11} {'req/s':>8} {'read p50':>9} {'read p99':>9} {'write p50':>10} {'write p99':>10} "
+          f"{'failed':>7}")
+    with temporary_database() as db_path, running_server(db_path, **overrides) as base_url:
+        form_id, emails = seed_form(db_path, users=args.respondents, questions=args.questions)
+        with sqlite3.connect(db_path) as connection:
+            question_ids = [row[0] for row in connection.execute(
+                "SELECT id FROM questions WHERE form_id = ?", (form_id,))]
+            admin_role = connection.execute("SELECT id FROM roles WHERE name = 'admin'").fetchone()[0]
+            connection.execute("INSERT INTO users (email, password, role_id) VALUES ('owner@example.com', '-', ?)",
+                               (admin_role,))
+        respondents = itertools.cycle(emails)
+        for concurrency in args.levels:
+            result = asyncio.run(run_level(base_url, form_id, question_ids, respondents,
+                                           bearer_headers("owner@example.com"), concurrency, args.seconds,
+                                           args.write_ratio))
+            total = len(result["reads"]) + len(result["writes"])
+            print(f"{concurrency:>11} {total / result['elapsed']:>8.1f} "
+                  f"{percentile(result['reads'], 50) * 1000:>7.1f}ms {percentile(result['reads'], 99) * 1000:>7.1f}ms "
+                  f"{percentile(result['writes'], 50) * 1000:>8.1f}ms "
+                  f"{percentile(result['writes'], 99) * 1000:>8.1f}ms {result['failures']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 4, 16, 64])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--respondents", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--setting", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra config override for the tuned run, e.g. DB_POOL_MAX_SIZE=20")
+    args = parser.parse_args()
+
+    run_setup("baseline", BASELINE, args)
+    run_setup("tuned", dict(setting.split("=", 1) for setting in args.setting), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Live results fan-out benchmark.
+
+Opens `--subscribers` Server-Sent Events streams on one form while
+respondents submit answers to it, and reports how many updates each
+subscriber received per second against the submission rate.
+
+    python -m benchmarks.live_results --subscribers 50 --respondents 2000 --setting WRITE_BEHIND_ENABLED=true
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+
+import httpx
+
+from benchmarks.common import bearer_headers, running_server, seed_form, temporary_database
+from benchmarks.submissions import submit_all
+
+
+async def subscribe(client: httpx.AsyncClient, form_id: int, headers: dict, events: list, stop: asyncio.Event):
+    async with client.stream("GET", f"/feedback_form/{form_id}/live", headers=headers) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                events.append(time.perf_counter())
+            if stop.is_set():
+                return
+
+
+async def run(base_url: str, form_id: int, question_ids: list[int], emails: list[str], subscribers: int,
+              concurrency: int, admin_email: str):
+    stop = asyncio.Event()
+    events = [[] for _ in range(subscribers)]
+    limits = httpx.Limits(max_connections=subscribers + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        streams = [asyncio.create_task(subscribe(client, form_id, bearer_headers(admin_email), received, stop))
+                   for received in events]
+        await asyncio.sleep(1)
+        elapsed, latencies, failures = await submit_all(base_url, form_id, question_ids, emails, concurrency)
+        await asyncio.sleep(1)
+        stop.set()
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+    return elapsed, len(latencies), failures, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--respondents", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--setting", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra config override for the server, e.g. LIVE_RESULTS_MAX_UPDATES_PER_SECOND=5")
+    args = parser.parse_args()
+    overrides = dict(setting.split("=", 1) for setting in args.setting)
+
+    with temporary_database() as db_path, running_server(db_path, **overrides) as base_url:
+        form_id, emails = seed_form(db_path, users=args.respondents, questions=args.questions)
+        with sqlite3.connect(db_path) as connection:
+            question_ids = [row[0] for row in connection.execute(
+                "SELECT id FROM questions WHERE form_id = ?", (form_id,))]
+            admin_role = connection.execute("SELECT id FROM roles WHERE name = 'admin'").fetchone()[0]
+            connection.execute("INSERT INTO users (email, password, role_id) VALUES ('owner@example.com', '-', ?)",
+                               (admin_role,))
+        elapsed, submitted, failures, events = asyncio.run(
+            run(base_url, form_id, question_ids, emails, args.subscribers, args.concurrency, "owner@example.com"))
+
+    received = [len(subscriber) for subscriber in events]
+    print(f"subscribers={args.subscribers} respondents={args.respondents} settings={overrides or '-'}")
+    print(f"{submitted / elapsed:.1f} submissions/sec over {elapsed:.1f}s, {failures} failed")
+    print(f"updates per subscriber: min={min(received)} max={max(received)} "
+          f"({max(received) / (elapsed + 2):.1f}/sec including 2s idle)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Logging pipeline benchmark.
+
+First measures what a log call costs the calling thread (the event loop in
+the app) with the console and file handlers attached directly, as before,
+and through the queue, plus with sampling and with the level disabled. Then
+serves GET /questions_options, which logs on every request, at
+LOG_LEVEL=DEBUG and at LOG_LEVEL=WARNING and compares the two.
+
+    python -m benchmarks.logging_pipeline --calls 20000 --seconds 5
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import logging.handlers
+import os
+import queue
+import sqlite3
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import bearer_headers, percentile, running_server, seed_form, temporary_database
+
+
+def caller_cost(logger: logging.Logger, calls: int) -> float:
+    started = time.perf_counter()
+    for index in range(calls):
+        logger.info("Submitting %s answers to form %s", index % 7, index)
+    return (time.perf_counter() - started) / calls
+
+
+def pipeline_costs(calls: int, log_format: str) -> dict[str, float]:
+    os.environ.setdefault("ENV_STATE", "test")
+    from logging_conf import QueueHandler, SamplingFilter, output_handlers
+
+    setups = [("queue", {}, logging.INFO), ("queue, 10% sampled", {"benchmark": 0.1}, logging.INFO),
+              ("level disabled", {}, logging.WARNING)]
+    costs = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        logger = logging.getLogger("benchmark.direct")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        for handler in output_handlers(log_format):
+            logger.addHandler(handler)
+        costs["direct handlers"] = caller_cost(logger, calls)
+
+        for name, rates, level in setups:
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, *output_handlers(log_format))
+            listener.start()
+            logger = logging.getLogger(f"benchmark.{name}")
+            logger.propagate = False
+            logger.setLevel(level)
+            handler = QueueHandler(log_queue)
+            handler.addFilter(SamplingFilter(rates))
+            logger.addHandler(handler)
+            costs[name] = caller_cost(logger, calls)
+            listener.stop()
+    return costs
+
+
+async def endpoint_latencies(base_url: str, headers: dict, question_id: int, concurrency: int,
+                             seconds: float) -> list[float]:
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=60) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get("/questions_options", params={"question_id": question_id})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--format", choices=["json", "text"], default="json")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(directory)  # the file handler writes to the working directory
+    try:
+        costs = pipeline_costs(args.calls, args.format)
+    finally:
+        os.chdir(cwd)
+    print(f"cost of a log call on the calling thread, {args.format} output:")
+    for name, cost in costs.items():
+        print(f"  {name:<20} {cost * 1e6:8.2f}us")
+
+    print(f"GET /questions_options, concurrency {args.concurrency}:")
+    for level in ("DEBUG", "WARNING"):
+        with temporary_database() as db_path, running_server(db_path, LOG_LEVEL=level,
+                                                             LOG_FORMAT=args.format) as base_url:
+            form_id, emails = seed_form(db_path, users=1, questions=1)
+            with sqlite3.connect(db_path) as connection:
+                question_id = connection.execute("SELECT id FROM questions").fetchone()[0]
+                connection.executemany("INSERT INTO options (question_id, text) VALUES (?, ?)",
+                                       [(question_id, f"Option {index}") for index in range(5)])
+                connection.execute(
+                    "INSERT INTO users (email, password, role_id) VALUES ('root@example.com', '-', 1)")
+            latencies = asyncio.run(endpoint_latencies(base_url, bearer_headers("root@example.com"), question_id,
+                                                       args.concurrency, args.seconds))
+        print(f"  LOG_LEVEL={level:<8} {len(latencies) / args.seconds:7.1f} req/s  "
+              f"p50={percentile(latencies, 50) * 1000:6.1f}ms  p99={percentile(latencies, 99) * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
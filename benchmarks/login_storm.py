@@ -0,0 +1,67 @@
+"""Login storm benchmark.
+
+Fires concurrent `/token` requests while a single client keeps polling `/role`
+and reports the latency of both. Run it once per pool configuration, e.g.
+
+    python -m benchmarks.login_storm --workers 0   # bcrypt on the event loop
+    python -m benchmarks.login_storm --workers 4
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.common import latency_summary, running_server
+
+
+async def login_storm(base_url: str, concurrency: int, duration: float):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await client.post("/register", json={"email": "storm@example.com", "password": "storm-password"})
+        token_latencies, role_latencies, rejected = [], [], 0
+        deadline = time.perf_counter() + duration
+
+        async def login_loop():
+            nonlocal rejected
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.post("/token", json={"email": "storm@example.com",
+                                                             "password": "storm-password"})
+                if response.status_code == 503:
+                    rejected += 1
+                else:
+                    token_latencies.append(time.perf_counter() - started)
+
+        async def role_loop():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await client.get("/role")
+                role_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(role_loop(), *[login_loop() for _ in range(concurrency)])
+        return token_latencies, role_latencies, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with running_server(PASSWORD_HASH_WORKERS=args.workers, PASSWORD_HASH_MAX_QUEUE=args.max_queue,
+                        PASSWORD_HASH_EXECUTOR=args.executor) as base_url:
+        token_latencies, role_latencies, rejected = asyncio.run(
+            login_storm(base_url, args.concurrency, args.duration))
+
+    print(f"workers={args.workers} executor={args.executor} concurrency={args.concurrency}")
+    print(latency_summary("/token", token_latencies))
+    print(latency_summary("/role", role_latencies))
+    print(f"/token rejected with 503: {rejected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Metrics middleware overhead benchmark.
+
+Serves GET /role, a cheap request with one query, with METRICS_ENABLED on
+and off, and prints throughput and latency of both along with the
+Server-Timing header of a request and the route's samples from /metrics.
+
+    python -m benchmarks.metrics_overhead --concurrency 16 --seconds 5
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.common import percentile, running_server
+
+
+async def hammer(base_url: str, concurrency: int, seconds: float) -> list[float]:
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                (await client.get("/role")).raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    for enabled in ("false", "true"):
+        with running_server(METRICS_ENABLED=enabled) as base_url:
+            latencies = asyncio.run(hammer(base_url, args.concurrency, args.seconds))
+            print(f"METRICS_ENABLED={enabled:<5} {len(latencies) / args.seconds:7.1f} req/s  "
+                  f"p50={percentile(latencies, 50) * 1000:6.1f}ms  p99={percentile(latencies, 99) * 1000:6.1f}ms")
+            if enabled == "true":
+                print(f"  Server-Timing: {httpx.get(f'{base_url}/role').headers['Server-Timing']}")
+                for line in httpx.get(f"{base_url}/metrics").text.splitlines():
+                    if 'route="/role"' in line and "_bucket" not in line:
+                        print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Profiler overhead benchmark.
+
+Serves GET /role with PROFILER_ENABLED off, on but idle, and on while
+POST /profiler is recording, and prints throughput and latency of the three
+along with the heaviest stacks of the profile.
+
+    python -m benchmarks.profiler_overhead --concurrency 16 --seconds 5
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+
+import httpx
+
+from benchmarks.common import bearer_headers, percentile, running_server, temporary_database
+
+
+async def hammer(base_url: str, concurrency: int, seconds: float, profile_params: dict = None,
+                 headers: dict = None) -> tuple[list[float], httpx.Response]:
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                (await client.get("/role")).raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        profile = None
+        if profile_params is not None:
+            profile = asyncio.create_task(client.post("/profiler", params=profile_params, headers=headers))
+            await asyncio.sleep(0.1)
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return latencies, (await profile) if profile is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, enabled, profiling in (("disabled", "false", False), ("idle", "true", False),
+                                     ("profiling", "true", True)):
+        with temporary_database() as db_path, running_server(db_path, PROFILER_ENABLED=enabled) as base_url:
+            with sqlite3.connect(db_path) as connection:
+                connection.execute("INSERT INTO users (email, password, role_id) VALUES ('root@example.com', '-', 1)")
+            profile_params = {"seconds": args.seconds, "interval_ms": args.interval_ms} if profiling else None
+            latencies, profile = asyncio.run(hammer(base_url, args.concurrency, args.seconds, profile_params,
+                                                    bearer_headers("root@example.com")))
+        print(f"{name:<10} {len(latencies) / args.seconds:7.1f} req/s  "
+              f"p50={percentile(latencies, 50) * 1000:6.1f}ms  p99={percentile(latencies, 99) * 1000:6.1f}ms")
+        if profile is not None:
+            profile.raise_for_status()
+            print(f"  {profile.headers['X-Profile-Samples']} samples from {profile.headers['X-Profile-Requests']} "
+                  f"requests, heaviest stacks (innermost frames):")
+            for line in profile.text.splitlines()[:args.top]:
+                stack, count = line.rsplit(" ", 1)
+                print(f"  {count:>7} {';'.join(stack.split(';')[-3:])}")
+
+
+if __name__ == "__main__":
+    main()
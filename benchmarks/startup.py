@@ -0,0 +1,71 @@
+"""Cold start benchmark.
+
+Starts fresh interpreters which import `main` and run the app's lifespan
+startup, the way a new worker does before it can take traffic, and reports
+how long the import and the startup took. Each scenario runs `--runs` times:
+
+    empty     a database file which does not exist yet
+    existing  a database already set up by an earlier start
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import ROOT, benchmark_env, percentile, temporary_database
+
+PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def start():
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(start())
+print(json.dumps({"import": imported - started, "lifespan": ready - imported}))
+"""
+
+
+def probe(db_path: str) -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=benchmark_env(db_path), check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summary(name: str, timings: list[dict]) -> str:
+    parts = []
+    for phase in ("import", "lifespan"):
+        values = [timing[phase] for timing in timings]
+        parts.append(f"{phase} p50={percentile(values, 50) * 1000:7.1f}ms max={max(values) * 1000:7.1f}ms")
+    total = [timing["import"] + timing["lifespan"] for timing in timings]
+    parts.append(f"ready p50={percentile(total, 50) * 1000:7.1f}ms")
+    return f"{name:<9} " + "  ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    empty, existing = [], []
+    with temporary_database() as db_path:
+        for _ in range(args.runs):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            empty.append(probe(db_path))
+        for _ in range(args.runs):
+            existing.append(probe(db_path))
+    print(summary("empty", empty))
+    print(summary("existing", existing))
+
+
+if __name__ == "__main__":
+    main()
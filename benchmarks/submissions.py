@@ -0,0 +1,74 @@
+"""Answer submission benchmark.
+
+Every respondent submits a rating for every question of one form through
+`POST /feedback_form/{id}/answers` against the SQLite backend, and the script
+reports submissions/sec, answers/sec and request latency.
+
+    python -m benchmarks.submissions --respondents 2000 --questions 10
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import time
+
+import httpx
+
+from benchmarks.common import bearer_headers, latency_summary, running_server, seed_form, temporary_database
+
+
+async def submit_all(base_url: str, form_id: int, question_ids: list[int], emails: list[str], concurrency: int):
+    pending = asyncio.Queue()
+    for email in emails:
+        pending.put_nowait(email)
+    latencies, failures = [], 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal failures
+        while not pending.empty():
+            email = pending.get_nowait()
+            body = {"answers": [{"question_id": question_id, "rating": random.randint(0, 10)}
+                                for question_id in question_ids]}
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/feedback_form/{form_id}/answers", json=body,
+                                             headers=bearer_headers(email))
+                if response.status_code >= 300:
+                    failures += 1
+            except httpx.TransportError:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        return time.perf_counter() - started, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--respondents", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--setting", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra config override for the server, e.g. WRITE_BEHIND_ENABLED=true")
+    args = parser.parse_args()
+    overrides = dict(setting.split("=", 1) for setting in args.setting)
+
+    with temporary_database() as db_path, running_server(db_path, **overrides) as base_url:
+        form_id, emails = seed_form(db_path, users=args.respondents, questions=args.questions)
+        with sqlite3.connect(db_path) as connection:
+            question_ids = [row[0] for row in connection.execute(
+                "SELECT id FROM questions WHERE form_id = ?", (form_id,))]
+        elapsed, latencies, failures = asyncio.run(
+            submit_all(base_url, form_id, question_ids, emails, args.concurrency))
+
+    print(f"respondents={args.respondents} questions={args.questions} concurrency={args.concurrency} "
+          f"settings={overrides or '-'}")
+    print(f"{len(latencies) / elapsed:.1f} submissions/sec, {len(latencies) * args.questions / elapsed:.1f} answers/sec, "
+          f"{failures} failed")
+    print(latency_summary("submit", latencies))
+
+
+if __name__ == "__main__":
+    main()
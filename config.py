@@ -17,9 +17,69 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None
     DB_FORCE_ROLL_BACK: bool = False
+    # Apply pending migrations when a worker starts. Turn off when a deploy step
+    # runs `python -m app_databases.migrations` before the workers start.
+    DB_MIGRATE_ON_STARTUP: bool = True
+    # Send plain reads to read-only connections (SQLite) or to DATABASE_REPLICA_URL (Postgres).
+    DB_READ_WRITE_SPLIT: bool = True
+    DATABASE_REPLICA_URL: Optional[str] = None
+    DB_POOL_MIN_SIZE: int = 1  # postgres only
+    DB_POOL_MAX_SIZE: int = 10  # SQLite: reader connections, writes share one. 0 connects per use, unpooled
+    DB_POOL_TIMEOUT_SECONDS: float = 10  # wait for a free connection before answering 503
+    DB_CONNECT_TIMEOUT_SECONDS: float = 60
+    DB_COMMAND_TIMEOUT_SECONDS: Optional[float] = None
+    DB_STATEMENT_CACHE_SIZE: int = 100  # prepared statements kept per connection
+    SQLITE_JOURNAL_MODE: str = "WAL"  # readers no longer wait for writers
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # safe with WAL, fsyncs at checkpoints only
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE: int = -64 * 1024  # negative values are KiB, so 64 MiB per connection
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
     LOGTAIL_API_KEY: Optional[str] = None
+    LOG_LEVEL: Optional[str] = None  # application loggers, DEBUG in dev and INFO otherwise by default
+    LOG_FORMAT: str = "json"  # "json", or "text" for the Rich console
+    # Fraction of the records below WARNING kept per logger (and its children), e.g. {"routers": 0.1}.
+    LOG_SAMPLE_RATES: dict[str, float] = {}
+    METRICS_ENABLED: bool = True  # per route timings, Server-Timing headers and GET /metrics
+    METRICS_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+    PROFILER_ENABLED: bool = True  # POST /profiler, for super admins
+    PROFILER_MAX_SECONDS: float = 60
+    PROFILER_SAMPLE_INTERVAL_MS: float = 5
     TOKEN_SECRET_KEY: Optional[str] = None
     ALGORITHM: Optional[str] = None
+    # Embed role claims and a token version in access tokens and authorize
+    # from them without touching the database.
+    STATELESS_AUTH: bool = False
+    REFRESH_TOKEN_EXPIRY_DAYS: int = 30
+    TOKEN_VERSIONS_REFRESH_SECONDS: int = 30
+    PRINCIPAL_CACHE_SIZE: int = 1024
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 300
+    PASSWORD_HASH_EXECUTOR: str = "thread"  # "thread" or "process"
+    PASSWORD_HASH_WORKERS: int = 4  # 0 hashes inline on the event loop
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+    BULK_IMPORT_CHUNK_SIZE: int = 500
+    PAGE_SIZE_DEFAULT: int = 50
+    PAGE_SIZE_MAX: int = 500
+    FORM_TREE_CACHE_SIZE: int = 256
+    # Acknowledge answer submissions once queued and write them in batches.
+    WRITE_BEHIND_ENABLED: bool = False
+    WRITE_BEHIND_MAX_QUEUE: int = 10000  # submissions
+    WRITE_BEHIND_BATCH_SIZE: int = 200  # submissions
+    WRITE_BEHIND_FLUSH_INTERVAL_MS: int = 50
+    WRITE_BEHIND_ENQUEUE_TIMEOUT_MS: int = 100
+    WRITE_BEHIND_RETRIES: int = 2  # per submission, after its batch failed
+    WRITE_BEHIND_RETRY_DELAY_MS: int = 100  # doubled on every retry
+    # Acknowledged submissions which could not be written are appended here, one JSON object per line.
+    WRITE_BEHIND_DEAD_LETTER_PATH: str = "answer_dead_letters.jsonl"
+    ANALYTICS_CHUNK_SIZE: int = 50000  # answers loaded into memory at a time
+    EXPORT_BATCH_SIZE: int = 5000
+    ARCHIVE_DIR: str = "archives"
+    IDEMPOTENCY_STORE: str = "memory"  # "memory", or "sqlite" to share keys between workers
+    IDEMPOTENCY_SQLITE_PATH: str = "idempotency.db"
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_MAX_KEYS: int = 100000  # memory store only
+    LIVE_RESULTS_MAX_UPDATES_PER_SECOND: float = 2  # per form
+    LIVE_RESULTS_POLL_SECONDS: float = 5  # catches answers written by other workers
+    LIVE_RESULTS_HEARTBEAT_SECONDS: float = 15
 
 
 class DevConfig(GlobalConfig):
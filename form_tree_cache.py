@@ -0,0 +1,77 @@
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from app_databases.database import database, feedback_form_table, question_table
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class FormTreeCache:
+    """LRU of serialized form trees keyed by form id. Every entry remembers the
+    `feedback_forms.tree_version` it was built from; writes to a form, its
+    questions or their options bump that version in the database, so stale
+    entries are detected by every worker, not just the one which made the
+    change."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[int, tuple[int, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, form_id: int, version: int) -> Optional[bytes]:
+        entry = self._entries.get(form_id)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(form_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, form_id: int, version: int, body: bytes) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[form_id] = (version, body)
+        self._entries.move_to_end(form_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, form_id: int) -> None:
+        self._entries.pop(form_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+form_tree_cache = FormTreeCache(max_size=config.FORM_TREE_CACHE_SIZE)
+
+
+def form_tree_etag(form_id: int, version: int) -> str:
+    return f'"form-{form_id}-v{version}"'
+
+
+async def bump_form_tree_version(form_id: Optional[int] = None, question_id: Optional[int] = None) -> None:
+    """Mark the tree of a form as changed, either directly or through one of
+    its questions."""
+    if form_id is not None:
+        target = feedback_form_table.c.id == form_id
+    else:
+        target = feedback_form_table.c.id == select(question_table.c.form_id).where(
+            question_table.c.id == question_id).scalar_subquery()
+    logger.debug("Bumping tree version of form %s / question %s", form_id, question_id)
+    await database.execute(
+        feedback_form_table.update().values(
+            tree_version=func.coalesce(feedback_form_table.c.tree_version, 0) + 1).where(target))
+    if form_id is not None:
+        form_tree_cache.invalidate(form_id)
@@ -0,0 +1,167 @@
+# Idempotency-Key support. The first request with a key reserves it, and once
+# it succeeds its response is stored for IDEMPOTENCY_TTL_SECONDS; retries with
+# the same key get that response back without reaching the database. The
+# store lives in process memory, or in a local SQLite file which every worker
+# on the host shares.
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import HTTPException, status
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# How long a reservation blocks retries if its request never completes.
+PENDING_TTL_SECONDS = 60
+
+in_progress_exception = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="A request with this Idempotency-Key is still being processed",
+    headers={"Retry-After": "1"},
+)
+key_reused_exception = HTTPException(
+    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    detail="This Idempotency-Key was already used for a different request",
+)
+
+
+def request_fingerprint(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: Any
+
+
+class MemoryIdempotencyStore:
+    """Idempotency keys of this process, oldest evicted beyond `max_keys`."""
+
+    def __init__(self, ttl_seconds: int, max_keys: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        # key -> (expires_at, fingerprint, response or None while pending)
+        self._entries: OrderedDict[str, tuple[float, str, Optional[StoredResponse]]] = OrderedDict()
+        self.replays = 0
+        self.reservations = 0
+
+    async def reserve(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """Return the stored response of `key`, or reserve `key` for the
+        caller and return None."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            _, stored_fingerprint, response = entry
+            if stored_fingerprint != fingerprint:
+                raise key_reused_exception
+            if response is None:
+                raise in_progress_exception
+            self.replays += 1
+            return response
+        self._entries[key] = (now + PENDING_TTL_SECONDS, fingerprint, None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        self.reservations += 1
+        return None
+
+    async def complete(self, key: str, fingerprint: str, response: StoredResponse) -> None:
+        self._entries[key] = (time.time() + self.ttl_seconds, fingerprint, response)
+
+    async def release(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "keys": len(self._entries), "reservations": self.reservations,
+                "replays": self.replays}
+
+
+class SqliteIdempotencyStore:
+    """Idempotency keys in a SQLite file, so that every worker process sees
+    the keys reserved by the others. Queries run on worker threads, each with
+    its own connection."""
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self.replays = 0
+        self.reservations = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+                "status_code INTEGER, body TEXT, expires_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at "
+                               "ON idempotency_keys (expires_at)")
+            self._local.connection = connection
+        return connection
+
+    def _reserve(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        connection = self._connection()
+        now = time.time()
+        # Takes the key unless someone else holds it and it has not expired.
+        reserved = connection.execute(
+            "INSERT INTO idempotency_keys (key, fingerprint, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, status_code = NULL, body = NULL, "
+            "expires_at = excluded.expires_at WHERE idempotency_keys.expires_at <= ?",
+            (key, fingerprint, now + PENDING_TTL_SECONDS, now)).rowcount
+        if reserved:
+            self.reservations += 1
+            if self.reservations % 1000 == 0:
+                connection.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+            return None
+        row = connection.execute("SELECT fingerprint, status_code, body FROM idempotency_keys WHERE key = ?",
+                                 (key,)).fetchone()
+        if row is None:  # released in the meantime
+            return self._reserve(key, fingerprint)
+        stored_fingerprint, status_code, body = row
+        if stored_fingerprint != fingerprint:
+            raise key_reused_exception
+        if status_code is None:
+            raise in_progress_exception
+        self.replays += 1
+        return StoredResponse(status_code=status_code, body=json.loads(body))
+
+    def _complete(self, key: str, response: StoredResponse) -> None:
+        self._connection().execute(
+            "UPDATE idempotency_keys SET status_code = ?, body = ?, expires_at = ? WHERE key = ?",
+            (response.status_code, json.dumps(response.body), time.time() + self.ttl_seconds, key))
+
+    def _release(self, key: str) -> None:
+        self._connection().execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    async def reserve(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        return await asyncio.to_thread(self._reserve, key, fingerprint)
+
+    async def complete(self, key: str, fingerprint: str, response: StoredResponse) -> None:
+        await asyncio.to_thread(self._complete, key, response)
+
+    async def release(self, key: str) -> None:
+        await asyncio.to_thread(self._release, key)
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "path": self.path, "reservations": self.reservations, "replays": self.replays}
+
+
+def create_idempotency_store():
+    if config.IDEMPOTENCY_STORE == "sqlite":
+        return SqliteIdempotencyStore(path=config.IDEMPOTENCY_SQLITE_PATH, ttl_seconds=config.IDEMPOTENCY_TTL_SECONDS)
+    return MemoryIdempotencyStore(ttl_seconds=config.IDEMPOTENCY_TTL_SECONDS, max_keys=config.IDEMPOTENCY_MAX_KEYS)
+
+
+idempotency_store = create_idempotency_store()
@@ -0,0 +1,128 @@
+# Live rating results per form, pushed to subscribers as Server-Sent Events.
+# Every form with subscribers has one channel task which recomputes the form's
+# aggregates when answers arrive, at most LIVE_RESULTS_MAX_UPDATES_PER_SECOND
+# times a second, and hands the same payload to all of its subscribers. Writes
+# made by other worker processes are picked up by polling every
+# LIVE_RESULTS_POLL_SECONDS.
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+from config import config
+from rating_stats import form_rating_stats
+
+logger = logging.getLogger(__name__)
+
+
+class FormChannel:
+    def __init__(self, form_id: int):
+        self.form_id = form_id
+        self.subscribers: set[asyncio.Queue] = set()
+        self.changed = asyncio.Event()
+        self.changed.set()  # compute the first snapshot straight away
+        self.payload: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+def offer(queue: asyncio.Queue, payload: Optional[str]) -> None:
+    """Replace whatever a subscriber has not read yet, so a slow client only
+    ever gets the latest snapshot."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(payload)
+
+
+class LiveResults:
+    def __init__(self, max_updates_per_second: float, poll_seconds: float):
+        self.min_interval = 1 / max_updates_per_second
+        self.poll_seconds = poll_seconds
+        self._channels: dict[int, FormChannel] = {}
+        self.notifications = 0
+        self.computations = 0
+        self.broadcasts = 0
+
+    def subscribe(self, form_id: int) -> asyncio.Queue:
+        channel = self._channels.get(form_id)
+        if channel is None:
+            channel = self._channels[form_id] = FormChannel(form_id)
+            channel.task = asyncio.create_task(self._run(channel))
+        queue = asyncio.Queue(maxsize=1)
+        if channel.payload is not None:
+            queue.put_nowait(channel.payload)
+        channel.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, form_id: int, queue: asyncio.Queue) -> None:
+        channel = self._channels.get(form_id)
+        if channel is None:
+            return
+        channel.subscribers.discard(queue)
+        if not channel.subscribers:
+            del self._channels[form_id]
+            channel.task.cancel()
+
+    def notify(self, form_id: int) -> None:
+        """Mark the results of a form as changed. Free when nobody listens."""
+        channel = self._channels.get(form_id)
+        if channel is not None:
+            self.notifications += 1
+            channel.changed.set()
+
+    async def _run(self, channel: FormChannel) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(channel.changed.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            # Notifications arriving from here on are folded into the next round.
+            channel.changed.clear()
+            try:
+                payload = json.dumps(await form_rating_stats(channel.form_id))
+                self.computations += 1
+            except Exception as error:
+                logger.error("Computing live results of form %s failed: %s", channel.form_id, error)
+            else:
+                if payload != channel.payload:
+                    channel.payload = payload
+                    self.broadcasts += 1
+                    for queue in channel.subscribers:
+                        offer(queue, payload)
+            await asyncio.sleep(self.min_interval)
+
+    async def stream(self, form_id: int) -> AsyncIterator[bytes]:
+        queue = self.subscribe(form_id)
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=config.LIVE_RESULTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if payload is None:
+                    return
+                yield f"event: results\ndata: {payload}\n\n".encode()
+        finally:
+            self.unsubscribe(form_id, queue)
+
+    async def close(self) -> None:
+        """End every stream, so that shutdown does not wait for clients to
+        hang up."""
+        channels, self._channels = list(self._channels.values()), {}
+        for channel in channels:
+            channel.task.cancel()
+            for queue in channel.subscribers:
+                offer(queue, None)
+
+    def stats(self) -> dict:
+        return {
+            "forms": len(self._channels),
+            "subscribers": sum(len(channel.subscribers) for channel in self._channels.values()),
+            "notifications": self.notifications,
+            "computations": self.computations,
+            "broadcasts": self.broadcasts,
+        }
+
+
+live_results = LiveResults(max_updates_per_second=config.LIVE_RESULTS_MAX_UPDATES_PER_SECOND,
+                           poll_seconds=config.LIVE_RESULTS_POLL_SECONDS)
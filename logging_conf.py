@@ -1,66 +1,165 @@
+# Logging goes through a queue: the handler on the application's loggers only
+# merges the arguments into the message and puts the record on a queue, and a
+# QueueListener thread renders it (JSON or Rich text) and writes it to the
+# console and the rotating file. The event loop never waits on terminal or
+# disk I/O. Records below WARNING can be sampled per logger with
+# LOG_SAMPLE_RATES, and since loggers are called with %-style arguments,
+# nothing is formatted for records which are disabled or sampled out.
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
 from logging.config import dictConfig
+from typing import Optional
 
 from config import DevConfig, config
 
+# Attributes every LogRecord has, anything else was passed with `extra=`.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including the fields passed with `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps the given fraction of the records below WARNING of a logger and
+    of its children, e.g. {"routers": 0.1}. Warnings and errors always pass."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+        self._rate_by_logger: dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._rate_by_logger.get(name)
+        if rate is None:
+            rate = 1.0
+            parts = name.split(".")
+            for end in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:end])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._rate_by_logger[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler fully formats the record on the calling thread.
+        # Only merge the arguments, while they still hold the values they had
+        # when the logger was called, and leave rendering to the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def output_handlers(log_format: str) -> list[logging.Handler]:
+    """The handlers run by the listener thread."""
+    if log_format == "json":
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(JsonFormatter())
+        file_formatter = JsonFormatter()
+    else:
+        from rich.logging import RichHandler
+
+        console = RichHandler()
+        console.setFormatter(logging.Formatter("%(name)s:%(lineno)d :: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+        file_formatter = logging.Formatter(
+            "%(asctime)s.%(msecs)03d || %(levelname)-8s || %(name)s:%(lineno)d || %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S")
+    rotating_file = logging.handlers.RotatingFileHandler(
+        "fastLearningApp.log", maxBytes=1024 * 1024 * 5, backupCount=5, encoding="utf-8", delay=True)  # 5 MB
+    rotating_file.setFormatter(file_formatter)
+    return [console, rotating_file]
+
+
+def stop_logging() -> None:
+    """Write out whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 
 def configure_logging() -> None:
+    global _listener
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *output_handlers(config.LOG_FORMAT),
+                                               respect_handler_level=True)
+    _listener.start()
+    app_level = config.LOG_LEVEL or ("DEBUG" if isinstance(config, DevConfig) else "INFO")
     dictConfig(
         {
             "version": 1,
             "disable_existing_loggers": False,
-            "formatters": {
-                "console": {
-                    "class": "logging.Formatter",
-                    "datefmt": "%Y-%m-%d %H:%M:%S",
-                    "format": "%(name)s:%(lineno)d :: %(message)s",
+            "filters": {
+                "sampling": {
+                    "()": SamplingFilter,
+                    "rates": config.LOG_SAMPLE_RATES,
                 },
-                "file": {
-                    "class": "logging.Formatter",
-                    "datefmt": "%Y-%m-%d %H:%M:%S",
-                    "format": "%(asctime)s.%(msecs)03d || %(levelname)-8s || %(name)s:%(lineno)d || %(message)s"
-                }
             },
             "handlers": {
-                "default": {
-                    "class": "rich.logging.RichHandler",
-                    "level": "DEBUG",
-                    "formatter": "console",
+                "queue": {
+                    "()": QueueHandler,
+                    "queue": log_queue,
+                    "filters": ["sampling"],
                 },
-                "rotating_file": {
-                    "class": "logging.handlers.RotatingFileHandler",
-                    "level": "DEBUG",
-                    "filename": "fastLearningApp.log",
-                    "formatter": "file",
-                    "maxBytes": 1024 * 1024 * 5,  # (5 MB)
-                    "backupCount": 5,
-                    "encoding": "utf-8",
-                    "delay": True,
-                }
             },
             "loggers": {
                 "uvicorn": {
-                    "handlers": ["default", "rotating_file"],
+                    "handlers": ["queue"],
                     "level": "INFO",
                     "propagate": False,
                 },
                 "databases": {
-                    "handlers": ["default"],
                     "level": "WARNING",
-                    "propagate": False,
                 },
                 "aiosqlite": {
-                    "handlers": ["default"],
                     "level": "WARNING",
-                    "propagate": False,
                 },
-                "source_code": {
-                    "handlers": ["default", "rotating_file"],
-                    "level": "DEBUG" if isinstance(config, DevConfig) else "INFO",
-                    "propagate": False,
-                }
             },
+            # Application modules log under their own names (`__name__`), so they are configured through the root.
             "root": {
-                "level": "INFO"
+                "handlers": ["queue"],
+                "level": app_level,
             }
         }
     )
+
+
+atexit.register(stop_logging)
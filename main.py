@@ -2,27 +2,44 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
-from app_databases.database import database, role_table
+from answer_buffer import answer_buffer
+from app_databases.database import database
+from app_databases.migrations import migrate
+from config import config
+from live_results import live_results
 from logging_conf import configure_logging
+from metrics import MetricsMiddleware, metrics
+from profiler import ProfilerMiddleware
+from routers.analytics import router as analytics_router
+from routers.answers import router as answers_router
 from routers.feedback_forms import router as feedback_forms_router
 from routers.question_type import router as question_type_router
 from routers.roles import router as roles_router
+from routers.search import router as search_router
+from routers.system import router as system_router
 from routers.users import router as users_router
 from routers.options_to_questions import router as question_options_router
+from security import load_token_versions, password_hash_pool, seed_roles
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     configure_logging()
+    if config.DB_MIGRATE_ON_STARTUP:
+        migrate()
     await database.connect()
-    if len(await database.fetch_all(role_table.select().where(role_table.c.name == "superAdmin", ))) == 0:
-        await database.execute(role_table.insert().values(name="superAdmin", ))
-    if len(await database.fetch_all(role_table.select().where(role_table.c.name == "admin", ))) == 0:
-        await database.execute(role_table.insert().values(name="admin", ))
-    if len(await database.fetch_all(role_table.select().where(role_table.c.name == "endUser", ))) == 0:
-        await database.execute(role_table.insert().values(name="endUser", ))
+    await seed_roles()
+    await load_token_versions()
+    if config.METRICS_ENABLED:
+        metrics.start(config.METRICS_LOOP_LAG_INTERVAL_SECONDS)
+    if config.WRITE_BEHIND_ENABLED:
+        answer_buffer.start()
     yield
+    await metrics.stop()
+    await live_results.close()
+    await answer_buffer.stop()
     await database.disconnect()
+    password_hash_pool.shutdown()
 
 
 version = "0.005"
@@ -34,8 +51,18 @@ app = FastAPI(lifespan=lifespan, version=version, summary="A Feedback System API
                   "Phone": "9611886339"
               }, title=f"Feedback System (v{version})")
 
+if config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    database.query_observer = metrics.record_query
+if config.PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
 app.include_router(users_router)
 app.include_router(roles_router)
 app.include_router(question_type_router)
 app.include_router(feedback_forms_router)
 app.include_router(question_options_router)
+app.include_router(answers_router)
+app.include_router(analytics_router)
+app.include_router(search_router)
+app.include_router(system_router)
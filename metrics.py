@@ -0,0 +1,213 @@
+# Request and runtime metrics in the Prometheus text format, served at
+# GET /metrics. MetricsMiddleware times every request and adds up, per route,
+# the database queries it made through `database` (RoutingDatabase reports
+# each one to `metrics.record_query`), their time and the response bytes, and
+# returns the request's share in a Server-Timing header. Pool usage and the
+# counters of the caches and queues are read from their `stats()` when
+# scraped. Event loop lag is sampled by a background task.
+import asyncio
+import bisect
+import contextvars
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Other request methods are counted as "other", like unmatched paths, since clients pick them freely.
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT"})
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    query_seconds: float = 0.0
+
+
+@dataclass
+class RouteStats:
+    latency: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    queries: int = 0
+    query_seconds: float = 0.0
+    response_bytes: int = 0
+    responses: dict[int, int] = field(default_factory=lambda: defaultdict(int))  # by status code
+
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats",
+                                                                                          default=None)
+
+
+def labels(**values) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(values, escaped)) + "}"
+
+
+class MetricsText:
+    """Samples grouped by metric family, since the text format wants each
+    family's TYPE line once, ahead of all of its samples."""
+
+    def __init__(self):
+        self._families: dict[str, tuple[str, str, list[str]]] = {}
+
+    def add(self, name: str, kind: str, help_text: str, value: float, label_text: str = "") -> None:
+        family = self._families.setdefault(name, (kind, help_text, []))
+        family[2].append(f"{name}{label_text} {value}")
+
+    def add_histogram(self, name: str, help_text: str, histogram: Histogram, **label_values) -> None:
+        family = self._families.setdefault(name, ("histogram", help_text, []))
+        cumulative = 0
+        for bound, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+            cumulative += count
+            family[2].append(f"{name}_bucket{labels(**label_values, le=bound)} {cumulative}")
+        family[2].append(f"{name}_sum{labels(**label_values) if label_values else ''} {histogram.sum}")
+        family[2].append(f"{name}_count{labels(**label_values) if label_values else ''} {histogram.count}")
+
+    def add_stats(self, prefix: str, stats: dict, **label_values) -> None:
+        """Every number of a component's `stats()` as a gauge. Nested dicts
+        (the writer and reader pools) become a `pool` label."""
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                self.add_stats(prefix, value, **label_values, pool=key)
+            elif isinstance(value, (bool, int, float)):
+                self.add(f"{prefix}_{key}", "gauge", f"{key.replace('_', ' ')} of {prefix.replace('_', ' ')}",
+                         float(value), labels(**label_values) if label_values else "")
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class Metrics:
+    def __init__(self):
+        self.routes: dict[tuple[str, str], RouteStats] = defaultdict(RouteStats)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.max_loop_lag_seconds = 0.0
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def record_query(self, seconds: float) -> None:
+        self.queries += 1
+        self.query_seconds += seconds
+        request = _current_request.get()
+        if request is not None:
+            request.queries += 1
+            request.query_seconds += seconds
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, request: RequestStats,
+                       response_bytes: int) -> None:
+        stats = self.routes[method, route]
+        stats.latency.observe(seconds)
+        stats.queries += request.queries
+        stats.query_seconds += request.query_seconds
+        stats.response_bytes += response_bytes
+        stats.responses[status] += 1
+
+    async def _watch_loop_lag(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            # Anything beyond the interval was spent waiting for a busy loop.
+            lag = max(loop.time() - started - interval, 0.0)
+            self.loop_lag.observe(lag)
+            self.max_loop_lag_seconds = max(self.max_loop_lag_seconds, lag)
+
+    def start(self, loop_lag_interval: float) -> None:
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._watch_loop_lag(loop_lag_interval))
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    def render(self, components: dict[str, dict]) -> str:
+        text = MetricsText()
+        for (method, route), stats in sorted(self.routes.items()):
+            text.add_histogram("http_request_duration_seconds", "Time to serve a request, by route", stats.latency,
+                               method=method, route=route)
+        for (method, route), stats in sorted(self.routes.items()):
+            for status, count in sorted(stats.responses.items()):
+                text.add("http_requests_total", "counter", "Requests served, by route and status", count,
+                         labels(method=method, route=route, status=status))
+            route_labels = labels(method=method, route=route)
+            text.add("http_request_db_queries_total", "counter", "Database queries made by requests to a route",
+                     stats.queries, route_labels)
+            text.add("http_request_db_seconds_total", "counter",
+                     "Time requests to a route spent in database queries, waits for a connection included",
+                     stats.query_seconds, route_labels)
+            text.add("http_response_bytes_total", "counter", "Response body bytes sent, by route",
+                     stats.response_bytes, route_labels)
+        text.add("db_queries_total", "counter", "Database queries, including those made outside requests",
+                 self.queries)
+        text.add("db_query_seconds_total", "counter", "Time spent in database queries", self.query_seconds)
+        text.add_histogram("event_loop_lag_seconds", "How late the event loop woke up a sleeping task", self.loop_lag)
+        text.add("event_loop_lag_max_seconds", "gauge", "Largest event loop lag seen", self.max_loop_lag_seconds)
+        for name, stats in components.items():
+            text.add_stats(name, stats)
+        return text.render()
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are counted to their last
+    byte and nothing is buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = RequestStats()
+        token = _current_request.set(request)
+        started = time.perf_counter()
+        status = 500
+        response_bytes = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # The handler has run by now, except for the body of streamed responses.
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                MutableHeaders(scope=message).append(
+                    "Server-Timing",
+                    f'db;dur={request.query_seconds * 1000:.2f};desc="{request.queries} queries", '
+                    f"app;dur={elapsed_ms:.2f}")
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current_request.reset(token)
+            route = scope.get("route")
+            # Unmatched paths are counted together, or every scanner's guess would become a time series.
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+            metrics.record_request(method, getattr(route, "path", "unmatched"), status,
+                                   time.perf_counter() - started, request, response_bytes)
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class PrincipalCache:
+    """Bounded LRU cache of authenticated principals keyed by a hash of the
+    bearer token. Entries live until the token's `exp` or `ttl_seconds`,
+    whichever comes first."""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, dict, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[Any]:
+        if self.max_size <= 0:
+            return None
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, user = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, claims: dict, user: Any) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if claims.get("exp") is not None:
+            expires_at = min(expires_at, float(claims["exp"]))
+        key = self._key(token)
+        self._entries[key] = (expires_at, claims, user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _invalidate_where(self, predicate) -> int:
+        stale = [key for key, (_, _, user) in self._entries.items() if predicate(user)]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def invalidate_user(self, user_id: int) -> int:
+        logger.debug("Invalidating cached principals of user %s", user_id)
+        return self._invalidate_where(lambda user: user.id == user_id)
+
+    def invalidate_role(self, role_id: int) -> int:
+        logger.debug("Invalidating cached principals with role %s", role_id)
+        return self._invalidate_where(lambda user: user.role_id == role_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+principal_cache = PrincipalCache(max_size=config.PRINCIPAL_CACHE_SIZE, ttl_seconds=config.PRINCIPAL_CACHE_TTL_SECONDS)
@@ -0,0 +1,203 @@
+# On-demand statistical profiler for a live worker, started through
+# POST /profiler. While it runs, ProfilerMiddleware registers the task of
+# every request and a sampler thread wakes up every few milliseconds and
+# records, for each of those tasks, its async stack: the chain of coroutines
+# it is awaiting, followed by the regular frames below the innermost one if
+# the task is the one running on the event loop right now. Suspended tasks
+# are sampled too, so the time a request spends waiting on `databases` (a
+# query running, or a wait for a pool connection) shows up as stacks ending
+# in those calls. Samples are kept per request and merged when the request
+# ends, if its route matches the filter. Results are flamegraph.pl compatible
+# collapsed stacks.
+#
+# When no profile is running, the middleware costs one attribute check.
+import asyncio
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STDLIB = sysconfig.get_paths()["stdlib"]
+
+profiler_busy_exception = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="A profile is already being recorded",
+)
+
+_frame_labels: dict = {}
+
+
+def frame_label(code) -> str:
+    label = _frame_labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if "site-packages" in path:
+            path = path.split("site-packages" + os.sep, 1)[1]
+        elif path.startswith(ROOT):
+            path = os.path.relpath(path, ROOT)
+        elif path.startswith(STDLIB):
+            path = os.path.relpath(path, STDLIB)
+        else:
+            path = os.path.basename(path)
+        label = _frame_labels[code] = f"{path}:{code.co_qualname}"
+    return label
+
+
+def task_stack(task: asyncio.Task, running_frame) -> list[str]:
+    """Frames of a task from its outermost coroutine inwards. `running_frame`
+    is the frame the event loop thread is executing at the moment."""
+    stack = []
+    coroutine = task.get_coro()
+    innermost = None
+    while coroutine is not None:
+        frame = getattr(coroutine, "cr_frame", None) or getattr(coroutine, "gi_frame", None) or getattr(
+            coroutine, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(frame_label(frame.f_code))
+        innermost = frame
+        awaited = getattr(coroutine, "cr_await", None) or getattr(coroutine, "gi_yieldfrom", None) or getattr(
+            coroutine, "ag_await", None)
+        if awaited is None:
+            break
+        if not any(hasattr(awaited, name) for name in ("cr_frame", "gi_frame", "ag_frame")):
+            # A future or similar: the task is waiting, on I/O, a lock or another task.
+            stack.append(f"[await {type(awaited).__name__}]")
+            return stack
+        coroutine = awaited
+    if innermost is None:
+        return stack
+    # Not awaiting anything: either running right now or scheduled and waiting for the loop.
+    below = []
+    frame = running_frame
+    while frame is not None and frame is not innermost:
+        below.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    if frame is None:
+        stack.append("[ready]")
+    else:
+        stack.extend(reversed(below))
+    return stack
+
+
+@dataclass
+class ProfiledRequest:
+    task: asyncio.Task
+    samples: Counter = field(default_factory=Counter)
+
+
+class Profiler:
+    def __init__(self):
+        self.active = False  # read by the middleware on every request
+        self.route: Optional[str] = None
+        self.remaining_requests: Optional[int] = None
+        self.deadline = 0.0
+        self.interval = 0.005
+        self.samples: Counter = Counter()
+        self.profiled_requests = 0
+        self.sample_count = 0
+        self._requests: dict[asyncio.Task, ProfiledRequest] = {}
+        self._lock = threading.Lock()
+        self._done: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+        self._run = 0  # a sampler thread only serves the run it was started for
+
+    def start(self, seconds: float, requests: Optional[int], route: Optional[str], interval: float) -> None:
+        if self.active:
+            raise profiler_busy_exception
+        self.route = route
+        self.remaining_requests = requests
+        self.deadline = time.monotonic() + seconds
+        self.interval = interval
+        self.samples = Counter()
+        self.profiled_requests = 0
+        self.sample_count = 0
+        self._done = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._run += 1
+        self.active = True
+        threading.Thread(target=self._sample_until_done, args=(self._run,), name="profiler", daemon=True).start()
+
+    async def wait(self) -> None:
+        """Until the profile is complete. If the caller goes away, the profile is stopped."""
+        run = self._run
+        try:
+            await self._done.wait()
+        finally:
+            self._stop(run)
+
+    def _stop(self, run: int) -> None:
+        if run != self._run or not self.active:
+            return
+        self.active = False
+        with self._lock:
+            self._requests.clear()
+        self._done.set()
+
+    def _sample_until_done(self, run: int) -> None:
+        while self.active and run == self._run:
+            time.sleep(self.interval)
+            if time.monotonic() >= self.deadline:
+                self._loop.call_soon_threadsafe(self._stop, run)
+                return
+            running_frame = sys._current_frames().get(self._loop_thread_id)
+            with self._lock:
+                for request in list(self._requests.values()):
+                    stack = task_stack(request.task, running_frame)
+                    if stack:
+                        request.samples[";".join(stack)] += 1
+                        self.sample_count += 1
+
+    def track(self) -> Optional[ProfiledRequest]:
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        request = ProfiledRequest(task)
+        with self._lock:
+            self._requests[task] = request
+        return request
+
+    def finish(self, request: ProfiledRequest, method: str, route: Optional[str]) -> None:
+        with self._lock:
+            if self._requests.pop(request.task, None) is None:  # the profile ended meanwhile
+                return
+            if self.route is not None and route != self.route:
+                return
+            prefix = f"{method} {route or 'unmatched'}"
+            for stack, count in request.samples.items():
+                self.samples[f"{prefix};{stack}"] += count
+            self.profiled_requests += 1
+        if self.remaining_requests is not None:
+            self.remaining_requests -= 1
+            if self.remaining_requests <= 0:
+                self._stop(self._run)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+profiler = Profiler()
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.active or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = profiler.track()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if request is not None:
+                profiler.finish(request, scope["method"], getattr(scope.get("route"), "path", None))
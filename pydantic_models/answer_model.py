@@ -0,0 +1,16 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from app_databases.database import RATING_BUCKETS
+
+
+class Answer(BaseModel):
+    question_id: int
+    selected_answer: Optional[str] = None
+    user_input_answer: Optional[str] = None
+    rating: Optional[int] = Field(None, ge=0, le=RATING_BUCKETS - 1)
+
+
+class Submission(BaseModel):
+    answers: list[Answer] = Field(min_length=1)
@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+
+class RefreshTokenIn(BaseModel):
+    refresh_token: str
@@ -12,3 +12,9 @@ class UserIn(User):
 
 class UserInWithRole(UserIn):
     role_id: int
+
+
+class Principal(User):
+    role_id: int
+    role_name: str
+    token_version: int = 0
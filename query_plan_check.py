@@ -0,0 +1,248 @@
+# Query plan regression check. Drives every router through the real app
+# against a seeded throwaway SQLite database, records each distinct SQL
+# statement the app sends, runs EXPLAIN QUERY PLAN on it and fails when a
+# statement reads a whole table. A scan is accepted only when the statement
+# is bounded by a LIMIT, needs no temporary sort and does not filter the
+# scanned table (the first page of an unfiltered keyset listing), or when the
+# table is listed in ALLOWED_FULL_SCANS.
+#
+# Run with: python -m query_plan_check [--verbose], or through pytest, see
+# tests/test_query_plans.py.
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from collections import OrderedDict
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql import ClauseElement
+
+# Small reference tables which are cheaper to read whole than through an index.
+ALLOWED_FULL_SCANS = {
+    "roles": "a handful of rows, loaded whole into the role id cache",
+}
+RECORDED_METHODS = ["fetch_all", "fetch_one", "fetch_val", "execute", "execute_many", "iterate"]
+SCAN = re.compile(r"^SCAN (?!\d+ CONSTANT ROWS)(\w+)(?: AS (\w+))?(?! VIRTUAL TABLE)")  # not multi-row VALUES
+
+
+class QueryRecorder:
+    """Wraps the query methods of a `databases.Database` and keeps the first
+    use of every distinct statement, with the values it was run with."""
+
+    def __init__(self, database):
+        self.database = database
+        self.label = "startup"
+        self.statements: OrderedDict[str, tuple[str, str, list | dict]] = OrderedDict()
+        self._originals = {}
+
+    def _record(self, query, values) -> None:
+        sql, parameters = compile_statement(query, values)
+        key = re.sub(r"\(\?(?:, \?)*\)", "(?)", sql)  # IN lists of any length are one statement
+        self.statements.setdefault(key, (self.label, sql, parameters))
+
+    def install(self) -> None:
+        for name in RECORDED_METHODS:
+            original = self._originals[name] = getattr(self.database, name)
+            if name == "iterate":
+                def wrapper(query, values=None, _original=original):
+                    self._record(query, values)
+                    return _original(query, values)
+            elif name == "execute_many":
+                async def wrapper(query, values, _original=original):
+                    self._record(query, values[0] if values else None)
+                    return await _original(query, values)
+            else:
+                async def wrapper(query, values=None, _original=original):
+                    self._record(query, values)
+                    return await _original(query, values)
+            setattr(self.database, name, wrapper)
+
+    def uninstall(self) -> None:
+        for name, original in self._originals.items():
+            setattr(self.database, name, original)
+
+
+def compile_statement(query, values) -> tuple[str, list | dict]:
+    if not isinstance(query, ClauseElement):
+        return query, dict(values or {})
+    if values:
+        query = query.values(**values)
+    compiled = query.compile(dialect=sqlite.dialect(), compile_kwargs={"render_postcompile": True})
+    parameters = compiled.construct_params()
+    return str(compiled), [parameters[name] for name in compiled.positiontup]
+
+
+def explain(connection: sqlite3.Connection, sql: str, parameters) -> list[str]:
+    return [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+
+
+def filters(sql: str, table: str) -> bool:
+    """Whether a WHERE clause of `sql` has a predicate on a column of `table`."""
+    return any(re.search(rf"\b{table}\.\w+", where) for where in re.split(r"\bWHERE\b", sql)[1:])
+
+
+def plan_problems(sql: str, plan: list[str]) -> list[str]:
+    bounded = re.search(r"\bLIMIT\b", sql) and not any("USE TEMP B-TREE" in step for step in plan)
+    problems = []
+    for step in plan:
+        match = SCAN.match(step)
+        if match is None or "VIRTUAL TABLE" in step or match.group(1) in ALLOWED_FULL_SCANS:
+            continue
+        if bounded and not filters(sql, match.group(2) or match.group(1)):
+            continue
+        problems.append(step)
+    return problems
+
+
+def seed(connection: sqlite3.Connection) -> None:
+    """Rows the exercised endpoints read. Plans do not depend on the amount of
+    data since nothing runs ANALYZE, so a little of everything is enough."""
+    with connection:
+        question_type = connection.execute(
+            "INSERT INTO question_type (name, created_by_user) VALUES ('rating', 1)").lastrowid
+        for form in range(1, 3):
+            connection.execute("INSERT INTO feedback_forms (title, created_by) VALUES (?, 1)", (f"Form {form}",))
+        for form_id in (1, 2):
+            for question in range(3):
+                question_id = connection.execute("INSERT INTO questions (form_id, text, type) VALUES (?, ?, ?)",
+                                                 (form_id, f"Question {question}", question_type)).lastrowid
+                connection.execute("INSERT INTO options (question_id, text) VALUES (?, 'Yes'), (?, 'No')",
+                                   (question_id, question_id))
+
+
+def exercise(client, check) -> None:
+    """Call every endpoint at least once, labelling the statements it sends."""
+    check("POST /register/user", "post", "/register/user",
+          json={"email": "root@example.com", "password": "secret", "role_id": 1})
+    check("POST /register", "post", "/register", json={"email": "someone@example.com", "password": "secret"})
+    tokens = check("POST /token", "post", "/token", json={"email": "root@example.com", "password": "secret"})
+    client.headers["Authorization"] = f"Bearer {tokens['access_token']}"
+    seed(sqlite3.connect(client.db_path))
+    check("POST /register/bulk", "post", "/register/bulk",
+          content="email,password,role\nbulk1@example.com,secret,endUser\nbulk2@example.com,secret,admin\n",
+          headers={"Content-Type": "text/csv"})
+    page = check("GET /user", "get", "/user", params={"limit": 1})
+    check("GET /user (next page)", "get", "/user", params={"limit": 1, "cursor": page["next_cursor"]})
+    check("GET /user?role&email_prefix", "get", "/user", params={"role": "endUser", "email_prefix": "bulk"})
+
+    check("POST /role", "post", "/role", json={"name": "auditor"})
+    roles = check("GET /role", "get", "/role")
+    auditor = next(role["id"] for role in roles["items"] if role["name"] == "auditor")
+    check("PUT /role", "put", "/role", json={"id": auditor, "name": "reviewer"})
+
+    check("POST /question_type", "post", "/question_type", json={"name": "choice"})
+    check("GET /question_type", "get", "/question_type", params={"name_prefix": "ch"})
+    types = check("GET /question_type (page)", "get", "/question_type", params={"limit": 1})
+    check("PUT /question_type", "put", "/question_type", json={"id": types["items"][0]["id"], "name": "stars"})
+
+    check("POST /feedback_form", "post", "/feedback_form", json={"title": "Form 3"})
+    check("GET /feedback_form?created_by", "get", "/feedback_form", params={"created_by": 1})
+    check("GET /feedback_form?title_prefix", "get", "/feedback_form", params={"title_prefix": "Form"})
+    check("GET /feedback_form?created_by&title_prefix", "get", "/feedback_form",
+          params={"created_by": 1, "title_prefix": "Form"})
+    check("GET /feedback_form (page)", "get", "/feedback_form", params={"limit": 1, "order": "desc"})
+    check("GET /feedback_form/{id}/tree", "get", "/feedback_form/1/tree")
+    check("PUT /feedback_form", "put", "/feedback_form", json={"id": 3, "title": "Form three", "created_by": 1})
+
+    check("POST /questions_options", "post", "/questions_options", json={"question_id": 1, "text": "Maybe"})
+    options = check("GET /questions_options", "get", "/questions_options", params={"question_id": 1})
+    check("PUT /questions_options", "put", "/questions_options",
+          json={"id": options["items"][0]["id"], "question_id": 1, "text": "Yes!"})
+    check("DELETE /questions_options", "delete", "/questions_options", params={"options_id": options["items"][-1]["id"]})
+
+    answers = {"answers": [{"question_id": 1, "rating": 9}, {"question_id": 2, "selected_answer": "Yes"},
+                           {"question_id": 3, "user_input_answer": "quick and friendly support"}]}
+    check("POST /feedback_form/{id}/answers", "post", "/feedback_form/1/answers", json=answers)
+    check("POST /feedback_form/{id}/answers (again)", "post", "/feedback_form/1/answers", json=answers,
+          headers={"Idempotency-Key": "plan-check"})
+    check("POST /feedback_form/{id}/answers (form 2)", "post", "/feedback_form/2/answers",
+          json={"answers": [{"question_id": 4, "rating": 3}]})
+    check("GET /question/{id}/stats", "get", "/question/1/stats")
+    check("GET /feedback_form/{id}/stats", "get", "/feedback_form/1/stats")
+    check("GET /question/{id}/analytics", "get", "/question/1/analytics")
+    check("GET /feedback_form/{id}/analytics", "get", "/feedback_form/1/analytics")
+    check("GET /feedback_form/{id}/crosstab", "get", "/feedback_form/1/crosstab",
+          params={"question_id": 1, "segment_question_id": 2})
+    check("GET /feedback_form/{id}/export", "get", "/feedback_form/1/export")
+    for kind in ("answers", "questions", "forms"):
+        check(f"GET /search?kind={kind}", "get", "/search", params={"q": "support", "kind": kind})
+
+    check("POST /feedback_form/{id}/close", "post", "/feedback_form/2/close")
+    check("POST /feedback_form/{id}/archive", "post", "/feedback_form/2/archive")
+    check("GET /feedback_form/{id}/analytics (archived)", "get", "/feedback_form/2/analytics")
+    check("GET /feedback_form/{id}/export (archived)", "get", "/feedback_form/2/export")
+
+    refresh = check("POST /token (again)", "post", "/token", json={"email": "root@example.com", "password": "secret"})
+    check("POST /token/refresh", "post", "/token/refresh", json={"refresh_token": refresh["refresh_token"]})
+    check("DELETE /feedback_form", "delete", "/feedback_form", params={"question_type_id": 3})
+    check("DELETE /question_type", "delete", "/question_type", params={"question_type_id": types["items"][0]["id"]})
+    check("DELETE /role", "delete", "/role", params={"role_id": auditor})
+    check("POST /token/revoke", "post", "/token/revoke")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail on SQL statements which scan whole tables")
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every statement")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, "plans.db")
+    os.environ.update({
+        "ENV_STATE": "test",
+        "TEST_DATABASE_URL": f"sqlite:///{db_path}",
+        "TEST_DB_FORCE_ROLL_BACK": "false",
+        "TEST_TOKEN_SECRET_KEY": "query-plan-check",
+        "TEST_ALGORITHM": "HS256",
+        "TEST_PASSWORD_HASH_WORKERS": "0",
+        # Caches would hide the statements of every request but the first.
+        "TEST_PRINCIPAL_CACHE_SIZE": "0",
+        "TEST_FORM_TREE_CACHE_SIZE": "0",
+        "TEST_ARCHIVE_DIR": os.path.join(directory, "archives"),
+    })
+    from fastapi.testclient import TestClient
+
+    import main as app_main
+    from app_databases.database import database
+
+    recorder = QueryRecorder(database)
+    recorder.install()
+    failures = []
+    with TestClient(app_main.app) as client:
+        client.db_path = db_path
+
+        def check(label, method, url, **kwargs):
+            recorder.label = label
+            response = getattr(client, method)(url, **kwargs)
+            if response.status_code >= 400:
+                failures.append(f"{label}: HTTP {response.status_code} {response.text[:200]}")
+            try:
+                return response.json()
+            except ValueError:
+                return None
+
+        exercise(client, check)
+    recorder.uninstall()
+
+    connection = sqlite3.connect(db_path)
+    scans = []
+    for label, sql, parameters in recorder.statements.values():
+        plan = explain(connection, sql, parameters)
+        problems = plan_problems(sql, plan)
+        if args.verbose or problems:
+            print(f"[{label}] {' '.join(sql.split())}")
+            for step in plan:
+                print(f"    {'!! ' if step in problems else ''}{step}")
+        if problems:
+            scans.append(label)
+    connection.close()
+
+    print(f"{len(recorder.statements)} distinct statements, {len(scans)} with full table scans")
+    for failure in failures:
+        print(f"request failed: {failure}")
+    return 1 if scans or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# Incrementally maintained rating aggregates. Writers fold the ratings they
+# insert into question_rating_stats inside their own transaction; readers get
+# count, mean, standard deviation and histogram from one row per question.
+#
+# Rebuild from scratch with: python -m rating_stats [--form-id N]
+import argparse
+import asyncio
+import logging
+import math
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import case, func, select
+
+from answer_archive import read_archive
+from app_databases.database import (RATING_BUCKETS, database, feedback_form_table, question_rating_stats_table,
+                                    question_table, response_table, upsert)
+
+logger = logging.getLogger(__name__)
+
+COUNTER_COLUMNS = ["count", "sum", "sum_of_squares"] + [f"bucket_{bucket}" for bucket in range(RATING_BUCKETS)]
+
+
+def rating_bucket(rating: int) -> int:
+    return min(max(rating, 0), RATING_BUCKETS - 1)
+
+
+def rating_deltas(rated_answers: Iterable[tuple[int, int, int]], sign: int = 1) -> dict[int, dict]:
+    """Fold (form_id, question_id, rating) triples into one counter delta per
+    question. `sign=-1` produces the deltas which remove those answers."""
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+    for form_id, question_id, rating in rated_answers:
+        if rating is None:
+            continue
+        delta = deltas[question_id]
+        delta["form_id"] = form_id
+        delta["count"] += sign
+        delta["sum"] += sign * rating
+        delta["sum_of_squares"] += sign * rating * rating
+        delta[f"bucket_{rating_bucket(rating)}"] += sign
+    return deltas
+
+
+async def apply_rating_deltas(deltas: dict[int, dict]) -> None:
+    """Add `deltas` to the aggregate rows, creating missing ones. Call it in the
+    transaction which writes the answers."""
+    if not deltas:
+        return
+    table = question_rating_stats_table
+    statement = upsert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.question_id],
+        set_={column: table.c[column] + statement.excluded[column] for column in COUNTER_COLUMNS},
+    )
+    await database.execute_many(statement, [
+        {"question_id": question_id, **delta} for question_id, delta in deltas.items()
+    ])
+
+
+def summarize(rows: Iterable) -> dict:
+    """Mean, population standard deviation and histogram of aggregate rows,
+    which may belong to one question or to all the questions of a form."""
+    totals = dict.fromkeys(COUNTER_COLUMNS, 0)
+    for row in rows:
+        for column in COUNTER_COLUMNS:
+            totals[column] += row[column]
+    count = totals["count"]
+    mean = totals["sum"] / count if count else None
+    stddev = math.sqrt(max(totals["sum_of_squares"] / count - mean * mean, 0.0)) if count else None
+    return {
+        "count": count,
+        "mean": mean,
+        "stddev": stddev,
+        "histogram": {str(bucket): totals[f"bucket_{bucket}"] for bucket in range(RATING_BUCKETS)},
+    }
+
+
+async def form_rating_stats(form_id: int) -> dict:
+    """Aggregates of a form as a whole and of each of its questions."""
+    table = question_rating_stats_table
+    rows = await database.fetch_all(table.select().where(table.c.form_id == form_id).order_by(table.c.question_id))
+    return {
+        "form_id": form_id,
+        **summarize(rows),
+        "questions": [{"question_id": row.question_id, **summarize([row])} for row in rows],
+    }
+
+
+async def rebuild_rating_stats(form_id: Optional[int] = None) -> None:
+    """Recompute the aggregates of one form, or of every form, from the
+    answers table and the archives of archived forms."""
+    logger.info("Rebuilding rating stats for %s", f"form {form_id}" if form_id else "all forms")
+    table = question_rating_stats_table
+    rating = response_table.c.rating
+    bucketed = case((rating < 0, 0), (rating > RATING_BUCKETS - 1, RATING_BUCKETS - 1), else_=rating)
+    aggregates = select(
+        response_table.c.question_id,
+        question_table.c.form_id,
+        func.count(rating),
+        func.sum(rating),
+        func.sum(rating * rating),
+        *[func.sum(case((bucketed == bucket, 1), else_=0)) for bucket in range(RATING_BUCKETS)],
+    ).join_from(response_table, question_table, response_table.c.question_id == question_table.c.id).where(
+        rating.is_not(None)).group_by(response_table.c.question_id, question_table.c.form_id)
+    delete = table.delete()
+    archived = feedback_form_table.select().with_only_columns(feedback_form_table.c.id).where(
+        feedback_form_table.c.archived_at.is_not(None))
+    if form_id is not None:
+        aggregates = aggregates.where(question_table.c.form_id == form_id)
+        delete = delete.where(table.c.form_id == form_id)
+        archived = archived.where(feedback_form_table.c.id == form_id)
+    archived_form_ids = [row.id for row in await database.fetch_all(archived)]
+    async with database.transaction():
+        await database.execute(delete)
+        await database.execute(table.insert().from_select(["question_id", "form_id"] + COUNTER_COLUMNS, aggregates))
+        for archived_form_id in archived_form_ids:
+            await apply_rating_deltas(archived_rating_deltas(archived_form_id))
+
+
+def archived_rating_deltas(form_id: int) -> dict[int, dict]:
+    # Only called for forms whose archived_at is set, so the files are complete.
+    archive = read_archive(form_id)
+    if archive is None:
+        return {}
+    rated = archive.columns["has_rating"].astype(bool)
+    question_ids = archive.columns["question_id"][rated].tolist()
+    ratings = archive.columns["rating"][rated].tolist()
+    return rating_deltas((form_id, question_id, rating) for question_id, rating in zip(question_ids, ratings))
+
+
+async def _main(form_id: Optional[int]) -> None:
+    await database.connect()
+    try:
+        await rebuild_rating_stats(form_id)
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the question_rating_stats table from the answers")
+    parser.add_argument("--form-id", type=int, default=None, help="Only rebuild this form")
+    asyncio.run(_main(parser.parse_args().form_id))
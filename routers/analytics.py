@@ -0,0 +1,104 @@
+import logging
+
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import StreamingResponse
+
+from analytics import form_question_ids, form_rating_analytics, question_rating_analytics, rating_crosstab
+from app_databases.database import database, feedback_form_table, question_rating_stats_table, question_table
+from live_results import live_results
+from rating_stats import form_rating_stats, summarize
+from security import super_admin_or_admin_required
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+@router.get(
+    "/question/{question_id}/stats",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Count, mean, standard deviation and histogram of the ratings given to a question",
+)
+async def get_question_rating_stats(question_id: int):
+    logger.info("Fetching rating stats of question %s", question_id)
+    if not await database.fetch_one(question_table.select().where(question_table.c.id == question_id)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
+    row = await database.fetch_one(
+        question_rating_stats_table.select().where(question_rating_stats_table.c.question_id == question_id))
+    return {
+        "question_id": question_id,
+        **summarize([row] if row else []),
+    }
+
+
+@router.get(
+    "/feedback_form/{form_id}/stats",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Rating statistics of a form as a whole and of each of its questions",
+)
+async def get_form_rating_stats(form_id: int):
+    logger.info("Fetching rating stats of form %s", form_id)
+    return await form_rating_stats(form_id)
+
+
+@router.get(
+    "/feedback_form/{form_id}/live",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Server-Sent Events stream of the form's rating stats, sent again whenever answers change them",
+)
+async def stream_live_results(form_id: int):
+    logger.info("Subscribing to live results of form %s", form_id)
+    if not await database.fetch_one(feedback_form_table.select().where(feedback_form_table.c.id == form_id)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
+    return StreamingResponse(live_results.stream(form_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def parse_percentiles(percentiles: str = Query("50,90,99", description="Comma separated, between 0 and 100")):
+    try:
+        values = [float(value) for value in percentiles.split(",") if value.strip()]
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid percentiles") from error
+    if not all(0 <= value <= 100 for value in values):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Percentiles must be within 0 and 100")
+    return values
+
+
+@router.get(
+    "/question/{question_id}/analytics",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Percentiles, histogram and NPS of the ratings given to a question",
+)
+async def get_question_analytics(question_id: int, percentiles: list[float] = Depends(parse_percentiles)):
+    logger.info("Computing analytics of question %s", question_id)
+    return await question_rating_analytics(question_id, percentiles)
+
+
+@router.get(
+    "/feedback_form/{form_id}/analytics",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Percentiles, histogram and NPS of the ratings of every question of a form",
+)
+async def get_form_analytics(form_id: int, percentiles: list[float] = Depends(parse_percentiles)):
+    logger.info("Computing analytics of form %s", form_id)
+    return await form_rating_analytics(form_id, percentiles)
+
+
+@router.get(
+    "/feedback_form/{form_id}/crosstab",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Ratings of one question segmented by the answer selected on another question of the form",
+)
+async def get_form_crosstab(form_id: int, question_id: int, segment_question_id: int,
+                            percentiles: list[float] = Depends(parse_percentiles)):
+    logger.info("Computing crosstab of question %s by %s on form %s", question_id, segment_question_id, form_id)
+    question_ids = await form_question_ids(form_id)
+    if question_id not in question_ids or segment_question_id not in question_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found on this form")
+    return await rating_crosstab(question_id, segment_question_id, percentiles, form_id=form_id)
@@ -0,0 +1,215 @@
+import csv
+import io
+import json
+import logging
+import uuid
+import zlib
+from typing import Annotated, AsyncIterator, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Response
+from fastapi.responses import StreamingResponse
+
+from answer_archive import load_archive
+from answer_buffer import PendingSubmission, answer_buffer, write_submissions
+from app_databases.database import database, feedback_form_table, question_table, response_table, user_table
+from app_databases.loaders import load_by_ids
+from config import config
+from idempotency import StoredResponse, idempotency_store, request_fingerprint
+from pydantic_models.answer_model import Submission
+from pydantic_models.user_model import User
+from security import get_current_user_from_token, super_admin_required, super_admin_or_admin_required
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+async def validate_submission(form_id: int, submission: Submission):
+    question_ids = [answer.question_id for answer in submission.answers]
+    if len(set(question_ids)) != len(question_ids):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="A question can only be answered once per submission")
+    form = await database.fetch_one(feedback_form_table.select().where(feedback_form_table.c.id == form_id))
+    if not form:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
+    if form.closed_at is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This form is closed")
+    form_question_ids = {
+        question.id for question in await database.fetch_all(
+            question_table.select().with_only_columns(question_table.c.id).where(
+                question_table.c.form_id == form_id, question_table.c.id.in_(question_ids)))
+    }
+    unknown_question_ids = sorted(set(question_ids) - form_question_ids)
+    if unknown_question_ids:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Questions {unknown_question_ids} do not belong to this form")
+
+
+def answer_rows(user_id: int, submission: Submission) -> list[dict]:
+    return [
+        {
+            "question_id": answer.question_id,
+            "user_id": user_id,
+            "selected_answer": answer.selected_answer,
+            "user_input_answer": answer.user_input_answer,
+            "rating": answer.rating,
+        } for answer in submission.answers
+    ]
+
+
+@router.post(
+    "/feedback_form/{form_id}/answers",
+    status_code=status.HTTP_201_CREATED,
+    description="Submit all of the current user's answers to a form at once. A user has one submission per form; "
+                "submitting again replaces the earlier answers. Retries carrying the same Idempotency-Key header "
+                "get the original response back. With write-behind enabled the submission is queued and 202 "
+                "returned at once; a submission which then cannot be written is kept in the dead letter file "
+                "rather than in the database.",
+)
+async def submit_answers(form_id: int, submission: Submission, response: Response,
+                         current_user: Annotated[User, Depends(get_current_user_from_token)],
+                         idempotency_key: Annotated[Optional[str], Header(max_length=255)] = None, ):
+    if idempotency_key is None:
+        return await store_submission(form_id, submission, response, current_user)
+    key = f"{current_user.id}:{idempotency_key}"
+    fingerprint = request_fingerprint(form_id, submission.model_dump())
+    stored = await idempotency_store.reserve(key, fingerprint)
+    if stored is not None:
+        logger.info("Replaying the response to idempotency key %r of user %s", idempotency_key, current_user.id)
+        response.status_code = stored.status_code
+        response.headers["Idempotent-Replayed"] = "true"
+        return stored.body
+    try:
+        body = await store_submission(form_id, submission, response, current_user)
+    except BaseException:
+        await idempotency_store.release(key)
+        raise
+    await idempotency_store.complete(key, fingerprint, StoredResponse(response.status_code or status.HTTP_201_CREATED,
+                                                                      body))
+    return body
+
+
+async def store_submission(form_id: int, submission: Submission, response: Response, current_user: User) -> dict:
+    logger.info("Submitting %s answers to form %s", len(submission.answers), form_id)
+    await validate_submission(form_id, submission)
+    pending = PendingSubmission(reference=uuid.uuid4().hex, form_id=form_id, user_id=current_user.id,
+                                answers=answer_rows(current_user.id, submission))
+    if config.WRITE_BEHIND_ENABLED:
+        await answer_buffer.submit(pending)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "submission_id": None,
+            "submission_reference": pending.reference,
+            "answers": len(submission.answers),
+            "status": "queued",
+        }
+    submission_ids = await write_submissions([pending])
+    return {
+        "submission_id": submission_ids[pending.reference],
+        "submission_reference": pending.reference,
+        "answers": len(submission.answers),
+        "status": "stored",
+    }
+
+
+@router.get(
+    "/answers/buffer",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_required)],
+    description="Queue depth, batch sizes and flush latency of the answer write-behind buffer",
+)
+async def get_answer_buffer_stats():
+    return answer_buffer.stats()
+
+
+EXPORT_COLUMNS = ["answer_id", "submission_id", "question_id", "question", "user_email", "selected_answer",
+                  "user_input_answer", "rating"]
+
+
+async def iter_archived_export_rows(form_id: int) -> AsyncIterator[list]:
+    archive = await load_archive(form_id)
+    if archive is None:
+        return
+    questions = {
+        row.id: row.text for row in await database.fetch_all(
+            question_table.select().where(question_table.c.form_id == form_id))
+    }
+    for batch in archive.iter_rows(config.EXPORT_BATCH_SIZE):
+        users = await load_by_ids(user_table, (row["user_id"] for row in batch), columns=[user_table.c.email])
+        yield [
+            [row["id"], row["submission_id"], row["question_id"], questions.get(row["question_id"]),
+             users[row["user_id"]].email if row["user_id"] in users else None, row["selected_answer"],
+             row["user_input_answer"], row["rating"]] for row in batch
+        ]
+
+
+async def iter_export_rows(form_id: int) -> AsyncIterator[list]:
+    """Answers of a form joined with question text and user email, read in
+    keyset pages so neither memory nor a database connection is held for the
+    whole download. Archived answers come first, then the live ones question
+    by question, each question's paged on answer id along ix_answers_question_id."""
+    async for rows in iter_archived_export_rows(form_id):
+        yield rows
+    question_ids = [row.id for row in await database.fetch_all(
+        question_table.select().with_only_columns(question_table.c.id).where(
+            question_table.c.form_id == form_id).order_by(question_table.c.id))]
+    query = response_table.select().with_only_columns(
+        response_table.c.id, response_table.c.submission_id, response_table.c.question_id, question_table.c.text,
+        user_table.c.email, response_table.c.selected_answer, response_table.c.user_input_answer,
+        response_table.c.rating,
+    ).join_from(response_table, question_table, response_table.c.question_id == question_table.c.id).outerjoin(
+        user_table, response_table.c.user_id == user_table.c.id).order_by(
+        response_table.c.id).limit(config.EXPORT_BATCH_SIZE)
+    for question_id in question_ids:
+        last_id = 0
+        while True:
+            rows = await database.fetch_all(query.where(response_table.c.question_id == question_id,
+                                                        response_table.c.id > last_id))
+            if not rows:
+                break
+            yield [list(row.values()) for row in rows]
+            if len(rows) < config.EXPORT_BATCH_SIZE:
+                break
+            last_id = rows[-1][0]
+
+
+def encode_csv(rows: list[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(rows: list[list]) -> bytes:
+    return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows).encode()
+
+
+async def stream_export(form_id: int, export_format: str, compress: bool) -> AsyncIterator[bytes]:
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    # gzip framing; every page is sync-flushed so bytes leave as soon as they are read.
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+    def emit(data: bytes) -> bytes:
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+
+    if export_format == "csv":
+        yield emit(encode_csv([EXPORT_COLUMNS]))
+    async for rows in iter_export_rows(form_id):
+        yield emit(encode(rows))
+    if compressor:
+        yield compressor.flush()
+
+
+@router.get(
+    "/feedback_form/{form_id}/export",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Stream every answer of a form as CSV or NDJSON, optionally gzip compressed",
+)
+async def export_answers(form_id: int, format: Literal["csv", "ndjson"] = "csv", gzip: bool = False):
+    logger.info("Exporting answers of form %s as %s", form_id, format)
+    if not await database.fetch_one(feedback_form_table.select().where(feedback_form_table.c.id == form_id)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
+    filename = f"form-{form_id}-answers.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(stream_export(form_id, format, gzip), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
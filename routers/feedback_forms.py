@@ -1,11 +1,17 @@
+import datetime
+import json
 import logging
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response
 
-from app_databases.database import database, feedback_form_table, user_table
+from answer_archive import archive_form
+from app_databases.database import database, feedback_form_table, user_table, question_table, options_table
+from app_databases.loaders import load_by_ids, load_children
+from app_databases.pagination import PageParams, page_params, fetch_page, prefix_filter
 from pydantic_models.feedback_form_model import FeedbackForm, FeedbackFormEdit
 from pydantic_models.user_model import User
+from form_tree_cache import form_tree_cache, form_tree_etag, bump_form_tree_version
 from security import super_admin_or_admin_required, get_current_user_from_token
 
 router = APIRouter()
@@ -26,7 +32,7 @@ async def check_if_form_already_exists(type_name: str):
 )
 async def add_a_feedback_form(feedback_form: FeedbackForm,
                               current_user: Annotated[User, Depends(get_current_user_from_token, ),], ):
-    logger.info(f"Adding a new feedback_form : {feedback_form.title}")
+    logger.info("Adding a new feedback_form : %s", feedback_form.title)
     if not await check_if_form_already_exists(feedback_form.title):
         await database.execute(
             feedback_form_table.insert().values(title=feedback_form.title,
@@ -41,26 +47,74 @@ async def add_a_feedback_form(feedback_form: FeedbackForm,
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(super_admin_or_admin_required)],
 )
-async def get_all_feedback_forms():
+async def get_all_feedback_forms(page: PageParams = Depends(page_params), created_by: Optional[int] = None,
+                                 title_prefix: Optional[str] = None):
     logger.info("Fetching all the feedback forms")
-    forms = await database.fetch_all(feedback_form_table.select())
-    return [
-        {
-            "id": single_form.id,
-            "title": single_form.title,
-            "created_by": await user_who_created_form(user_id=single_form.created_by)
-        } for single_form in
-        forms
-    ]
-
-
-async def user_who_created_form(user_id: int) -> str:
-    user = await database.fetch_one(
-        user_table.select().where(user_table.c.id == user_id))
-    if not user:
-        return ""
-    else:
-        return user.email
+    query = feedback_form_table.select()
+    if created_by is not None:
+        query = query.where(feedback_form_table.c.created_by == created_by)
+    if title_prefix:
+        query = query.where(prefix_filter(feedback_form_table.c.title, title_prefix))
+    forms, next_cursor = await fetch_page(query, feedback_form_table.c.id, page)
+    creators = await load_by_ids(user_table, (single_form.created_by for single_form in forms),
+                                 columns=[user_table.c.email])
+    return {
+        "items": [
+            {
+                "id": single_form.id,
+                "title": single_form.title,
+                "created_by": creators[single_form.created_by].email if single_form.created_by in creators else ""
+            } for single_form in
+            forms
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+async def build_form_tree(form) -> bytes:
+    questions = await database.fetch_all(
+        question_table.select().where(question_table.c.form_id == form.id).order_by(question_table.c.id))
+    options = await load_children(options_table, options_table.c.question_id,
+                                  (question.id for question in questions))
+    tree = {
+        "id": form.id,
+        "title": form.title,
+        "questions": [
+            {
+                "id": question.id,
+                "text": question.text,
+                "description": question.description,
+                "type": question.type,
+                "options": [
+                    {"id": option.id, "text": option.text, "description": option.description}
+                    for option in options.get(question.id, [])
+                ],
+            } for question in questions
+        ],
+    }
+    return json.dumps(tree, separators=(",", ":")).encode()
+
+
+@router.get(
+    "/feedback_form/{form_id}/tree",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(get_current_user_from_token)],
+    description="The whole form with its questions and their options. Supports If-None-Match.",
+)
+async def get_feedback_form_tree(form_id: int, request: Request):
+    form = await database.fetch_one(feedback_form_table.select().where(feedback_form_table.c.id == form_id))
+    if form is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
+    version = form.tree_version or 0
+    headers = {"ETag": form_tree_etag(form_id, version), "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = form_tree_cache.get(form_id, version)
+    if body is None:
+        logger.info("Building the tree of form %s", form_id)
+        body = await build_form_tree(form)
+        form_tree_cache.put(form_id, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.put(
@@ -74,6 +128,7 @@ async def update_a_feedback_form(feedback_form: FeedbackFormEdit,
     await database.execute(
         feedback_form_table.update().values(title=feedback_form.title, created_by=current_user.id).where(
             feedback_form_table.c.id == feedback_form.id))
+    await bump_form_tree_version(form_id=feedback_form.id)
 
     updated_form = await database.fetch_one(
         feedback_form_table.select().where(feedback_form_table.c.id == feedback_form.id))
@@ -84,6 +139,41 @@ async def update_a_feedback_form(feedback_form: FeedbackFormEdit,
     }
 
 
+@router.post(
+    "/feedback_form/{form_id}/close",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Stop accepting answers to a form",
+)
+async def close_a_feedback_form(form_id: int):
+    logger.info("Closing feedback form %s", form_id)
+    form = await database.fetch_one(feedback_form_table.select().where(feedback_form_table.c.id == form_id))
+    if not form:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
+    if form.closed_at is None:
+        await database.execute(feedback_form_table.update().values(closed_at=datetime.datetime.utcnow()).where(
+            feedback_form_table.c.id == form_id))
+    return {"details": "Form closed successfully"}
+
+
+@router.post(
+    "/feedback_form/{form_id}/archive",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Move the answers of a closed form to its columnar archive",
+)
+async def archive_a_feedback_form(form_id: int):
+    logger.info("Archiving feedback form %s", form_id)
+    form = await database.fetch_one(feedback_form_table.select().where(feedback_form_table.c.id == form_id))
+    if not form:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
+    if form.closed_at is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Only closed forms can be archived")
+    if form.archived_at is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This form is already archived")
+    return await archive_form(form_id)
+
+
 @router.delete(
     "/feedback_form",
     status_code=status.HTTP_201_CREATED,
@@ -93,6 +183,7 @@ async def delete_a_feedback_form(question_type_id: int):
     logger.info("Deleting a feedback form")
     deleted_form = await database.execute(
         feedback_form_table.delete().where(feedback_form_table.c.id == question_type_id))
+    form_tree_cache.invalidate(question_type_id)
 
     if deleted_form == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Form not found")
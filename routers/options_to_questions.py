@@ -3,7 +3,9 @@ import logging
 from fastapi import APIRouter, HTTPException, status, Depends
 
 from app_databases.database import database, feedback_form_table, options_table, question_table
+from app_databases.pagination import PageParams, page_params, fetch_page
 from pydantic_models.questions_option_model import QuestionsOptions, QuestionsOptionsEdit
+from form_tree_cache import bump_form_tree_version
 from security import super_admin_or_admin_required
 
 router = APIRouter()
@@ -23,9 +25,10 @@ logger = logging.getLogger(__name__)
     description="This method is used to add a new option to a question",
 )
 async def add_a_questions_option(option: QuestionsOptions, ):
-    logger.info(f"Adding a new option to question : {option.question_id}")
+    logger.info("Adding a new option to question : %s", option.question_id)
     await database.execute(
         options_table.insert().values(question_id=option.question_id, text=option.text, description=option.description))
+    await bump_form_tree_version(question_id=option.question_id)
     return {
         "message": f"{option.text} added successfully",
     }
@@ -37,19 +40,25 @@ async def add_a_questions_option(option: QuestionsOptions, ):
     dependencies=[Depends(super_admin_or_admin_required)],
     description="This method is used fetch all the options of a question",
 )
-async def get_all_options_of_a_question(question_id: int):
-    logger.info(f"Fetching all the options for question {await parent_question_of_an_option(question_id=question_id)}")
-    options = await database.fetch_all(options_table.select().where(options_table.c.question_id == question_id))
-    return [
-        {
-            "id": single_option.id,
-            "title": single_option.text,
-            "description": single_option.description,
-            "question": await parent_question_of_an_option(question_id=single_option.question_id),
-
-        } for single_option in
-        options
-    ]
+async def get_all_options_of_a_question(question_id: int, page: PageParams = Depends(page_params)):
+    logger.info("Fetching all the options for question %s", question_id)
+    options, next_cursor = await fetch_page(
+        options_table.select().where(options_table.c.question_id == question_id), options_table.c.id, page)
+    # Every option here shares the same parent question, so resolve it once.
+    question = await parent_question_of_an_option(question_id=question_id)
+    return {
+        "items": [
+            {
+                "id": single_option.id,
+                "title": single_option.text,
+                "description": single_option.description,
+                "question": question,
+
+            } for single_option in
+            options
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 async def parent_question_of_an_option(question_id: int) -> str:
@@ -68,13 +77,15 @@ async def parent_question_of_an_option(question_id: int) -> str:
     description="This method is used update an option of a question",
 )
 async def update_a_questions_option(option: QuestionsOptionsEdit, ):
-    logger.info(f"Updating an option of a question, {await parent_question_of_an_option(question_id=option.question_id)}")
+    logger.info("Updating option %s of question %s", option.id, option.question_id)
     await database.execute(
         options_table.update().values(text=option.text, description=option.description).where(
             options_table.c.id == option.id))
 
     updated_option = await database.fetch_one(
         options_table.select().where(options_table.c.id == option.id))
+    if updated_option:
+        await bump_form_tree_version(question_id=updated_option.question_id)
     return {
         "id": updated_option.id,
         "text": updated_option.text,
@@ -90,8 +101,11 @@ async def update_a_questions_option(option: QuestionsOptionsEdit, ):
 )
 async def delete_a_feedback_form(options_id: int):
     logger.info("Deleting an option")
+    option = await database.fetch_one(options_table.select().where(options_table.c.id == options_id))
     deleted_option = await database.execute(
         options_table.delete().where(options_table.c.id == options_id))
+    if option:
+        await bump_form_tree_version(question_id=option.question_id)
 
     if deleted_option == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Option not found")
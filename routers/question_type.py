@@ -1,9 +1,10 @@
 import logging
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import APIRouter, HTTPException, status, Depends
 
 from app_databases.database import database, question_types_table
+from app_databases.pagination import PageParams, page_params, fetch_page, prefix_filter
 from pydantic_models.question_type_model import QuestionType, QuestionTypeEdit
 from pydantic_models.user_model import User
 from security import super_admin_or_admin_required, get_current_user_from_token
@@ -25,7 +26,7 @@ async def check_if_type_already_exists(type_name: str):
 )
 async def add_a_question_type(question_type: QuestionType,
                               current_user: Annotated[User, Depends(get_current_user_from_token)], ):
-    logger.info(f"Adding a new question type: {question_type.name}")
+    logger.info("Adding a new question type: %s", question_type.name)
     if not await check_if_type_already_exists(question_type.name):
         await database.execute(
             question_types_table.insert().values(name=question_type.name, description=question_type.description,
@@ -40,13 +41,19 @@ async def add_a_question_type(question_type: QuestionType,
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(super_admin_or_admin_required)],
 )
-async def get_all_question_types():
+async def get_all_question_types(page: PageParams = Depends(page_params), name_prefix: Optional[str] = None):
     logger.info("Fetching all the question types")
-    types = await database.fetch_all(question_types_table.select())
-    return [
-        {"id": single_type.id, "name": single_type.name, "description": single_type.description} for single_type in
-        types
-    ]
+    query = question_types_table.select()
+    if name_prefix:
+        query = query.where(prefix_filter(question_types_table.c.name, name_prefix))
+    types, next_cursor = await fetch_page(query, question_types_table.c.id, page)
+    return {
+        "items": [
+            {"id": single_type.id, "name": single_type.name, "description": single_type.description} for single_type
+            in types
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 @router.put(
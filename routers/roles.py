@@ -3,8 +3,9 @@ import logging
 from fastapi import APIRouter, HTTPException, status, Depends
 
 from app_databases.database import database, role_table
+from app_databases.pagination import PageParams, page_params, fetch_page
 from pydantic_models.role_model import Role, RoleUpdate
-from security import is_super_admin, super_admin_required
+from security import is_super_admin, super_admin_required, invalidate_role_ids, revoke_role_tokens
 
 router = APIRouter()
 
@@ -22,9 +23,10 @@ async def check_if_role_already_exists(role_name: str):
     dependencies=[Depends(super_admin_required)],
 )
 async def add_a_new_role(role: Role):
-    logger.info(f"Adding a new role: {role.name}")
+    logger.info("Adding a new role: %s", role.name)
     if not await check_if_role_already_exists(role.name):
         await database.execute(role_table.insert().values(name=role.name))
+        invalidate_role_ids()
         return {
             "message": f"Role {role.name} added successfully",
         }
@@ -34,12 +36,15 @@ async def add_a_new_role(role: Role):
     "/role",
     status_code=status.HTTP_200_OK,
 )
-async def get_all_the_roles():
+async def get_all_the_roles(page: PageParams = Depends(page_params)):
     logger.info("Fetching all the roles")
-    roles = await database.fetch_all(role_table.select())
-    return [
-        {"id": role.id, "name": role.name} for role in roles
-    ]
+    roles, next_cursor = await fetch_page(role_table.select(), role_table.c.id, page)
+    return {
+        "items": [
+            {"id": role.id, "name": role.name} for role in roles
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 @router.put(
@@ -50,6 +55,8 @@ async def get_all_the_roles():
 async def update_role(role: RoleUpdate):
     logger.info("Updating role")
     await database.execute(role_table.update().values(name=role.name).where(role_table.c.id == role.id))
+    invalidate_role_ids()
+    await revoke_role_tokens(role.id)
 
     updated_role = await database.fetch_one(role_table.select().where(role_table.c.id == role.id))
     return {
@@ -65,6 +72,8 @@ async def update_role(role: RoleUpdate):
 async def update_role(role_id: int):
     logger.info("Deleting role")
     deleted_role_id = await database.execute(role_table.delete().where(role_table.c.id == role_id))
+    invalidate_role_ids()
+    await revoke_role_tokens(role_id)
 
     if deleted_role_id == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Role not found")
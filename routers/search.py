@@ -0,0 +1,28 @@
+import logging
+from typing import Literal, Optional
+
+from fastapi import APIRouter, status, Depends, Query
+
+from config import config
+from search import search
+from security import super_admin_or_admin_required
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+@router.get(
+    "/search",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_or_admin_required)],
+    description="Full-text search over free-text answers, questions or form titles, best matches first, with the "
+                "matched words highlighted in a snippet",
+)
+async def search_text(q: str = Query(..., min_length=1, max_length=200),
+                      kind: Literal["answers", "questions", "forms"] = "answers",
+                      cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                      limit: Optional[int] = Query(None, ge=1, description="Page size, capped at PAGE_SIZE_MAX")):
+    logger.info("Searching %s for %r", kind, q)
+    hits, next_cursor = await search(kind, q, min(limit or config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX), cursor)
+    return {"items": hits, "next_cursor": next_cursor}
@@ -0,0 +1,82 @@
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import PlainTextResponse
+
+from answer_buffer import answer_buffer
+from app_databases.database import database, pool_stats
+from config import config
+from form_tree_cache import form_tree_cache
+from idempotency import idempotency_store
+from live_results import live_results
+from metrics import metrics
+from principal_cache import principal_cache
+from profiler import profiler
+from security import password_hash_pool, super_admin_required
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+@router.get(
+    "/database/pool",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_required)],
+    description="Size, connections in use and acquire waits of the database connection pool",
+)
+async def get_database_pool_stats():
+    return pool_stats(database)
+
+
+def component_stats() -> dict[str, dict]:
+    return {
+        "db_pool": pool_stats(database),
+        "principal_cache": principal_cache.stats(),
+        "form_tree_cache": form_tree_cache.stats(),
+        "password_hash_pool": password_hash_pool.stats(),
+        "answer_buffer": answer_buffer.stats(),
+        "live_results": live_results.stats(),
+        "idempotency": idempotency_store.stats(),
+    }
+
+
+@router.get(
+    "/metrics",
+    status_code=status.HTTP_200_OK,
+    response_class=PlainTextResponse,
+    description="Request, database, pool, cache and event loop metrics in the Prometheus text format. "
+                "Unauthenticated so that scrapers can read it, turn it off with METRICS_ENABLED=false",
+)
+async def get_metrics():
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(component_stats()), media_type="text/plain; version=0.0.4")
+
+
+@router.post(
+    "/profiler",
+    status_code=status.HTTP_200_OK,
+    response_class=PlainTextResponse,
+    dependencies=[Depends(super_admin_required)],
+    description="Samples the stacks of the requests this worker serves, including the time they spend waiting on the "
+                "database, for the next `requests` requests (to `route` if given) or `seconds`, whichever comes "
+                "first, and returns them as collapsed stacks for flamegraph.pl or speedscope",
+)
+async def profile(requests: Optional[int] = Query(None, ge=1),
+                  seconds: float = Query(10, gt=0, le=config.PROFILER_MAX_SECONDS),
+                  route: Optional[str] = Query(None,
+                                               description="Route template, e.g. /feedback_form/{form_id}/answers"),
+                  interval_ms: float = Query(config.PROFILER_SAMPLE_INTERVAL_MS, ge=1, le=1000)):
+    if not config.PROFILER_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiling is disabled")
+    profiler.start(seconds, requests, route, interval_ms / 1000)
+    logger.warning("Profiling requests%s for %ss or %s requests", f" to {route}" if route else "", seconds,
+                   requests or "any number of")
+    await profiler.wait()
+    logger.warning("Profile done: %s samples from %s requests", profiler.sample_count, profiler.profiled_requests)
+    return PlainTextResponse(profiler.collapsed(), headers={
+        "X-Profile-Samples": str(profiler.sample_count),
+        "X-Profile-Requests": str(profiler.profiled_requests),
+    })
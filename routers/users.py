@@ -1,10 +1,20 @@
+import codecs
+import csv
+import json
 import logging
+import time
+from typing import AsyncIterator, Optional
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 
-from app_databases.database import user_table, database, role_table
-from pydantic_models.user_model import UserIn, UserInWithRole
-from security import get_user, get_password_hash, authenticate_user, create_access_token, super_admin_required
+from app_databases.database import DATABASE_ERRORS, user_table, database, role_table
+from app_databases.pagination import PageParams, page_params, fetch_page, prefix_filter
+from config import config
+from pydantic_models.token_model import RefreshTokenIn
+from pydantic_models.user_model import UserIn, UserInWithRole, User
+from security import get_user, get_password_hash, authenticate_user, create_access_token, super_admin_required, \
+    get_role_id, END_USER, create_refresh_token, rotate_refresh_token, revoke_refresh_tokens, revoke_user_tokens, \
+    get_current_user_from_token, get_role_ids, get_password_hashes, principal_query
 
 router = APIRouter()
 
@@ -24,28 +34,155 @@ async def register_user_with_a_role(user: UserInWithRole):
     status_code=status.HTTP_201_CREATED
 )
 async def register_a_user(user: UserIn):
-    end_user_id = (await database.fetch_one(role_table.select().where(role_table.c.name == "endUser", ))).id
+    end_user_id = await get_role_id(END_USER)
     return await register_user(user=user, role_id=end_user_id)
 
 
+async def iter_request_lines(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_import_rows(request: Request) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """Yield (row number, row, parse error) for every non blank line of a CSV
+    (with a header line) or NDJSON request body."""
+    is_csv = "csv" in request.headers.get("content-type", "")
+    header = None
+    row_number = 0
+    async for line in iter_request_lines(request):
+        if not line.strip():
+            continue
+        if is_csv and header is None:
+            header = [column.strip() for column in next(csv.reader([line]))]
+            continue
+        row_number += 1
+        try:
+            row = dict(zip(header, next(csv.reader([line])))) if is_csv else json.loads(line)
+        except (ValueError, csv.Error) as error:
+            yield row_number, None, f"Malformed row: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield row_number, None, "Malformed row: expected an object"
+            continue
+        yield row_number, row, None
+
+
+async def import_users_chunk(chunk: list[tuple[int, dict]], role_ids: dict[str, int], errors: list[dict]) -> int:
+    valid_role_ids = set(role_ids.values())
+    candidates = []
+    seen_emails = set()
+    for row_number, row in chunk:
+        email, password = (row.get("email") or "").strip(), row.get("password") or ""
+        role = row.get("role_id") or row.get("role") or END_USER
+        role_id = int(role) if str(role).isdigit() else role_ids.get(role)
+        if not email or not password:
+            errors.append({"row": row_number, "email": email, "detail": "email and password are required"})
+        elif role_id not in valid_role_ids:
+            errors.append({"row": row_number, "email": email, "detail": f"Unknown role {role}"})
+        elif email in seen_emails:
+            errors.append({"row": row_number, "email": email, "detail": "Duplicate email in this import"})
+        else:
+            seen_emails.add(email)
+            candidates.append((row_number, email, password, role_id))
+    if not candidates:
+        return 0
+
+    existing = {
+        user.email for user in await database.fetch_all(
+            user_table.select().with_only_columns(user_table.c.email).where(user_table.c.email.in_(seen_emails)))
+    }
+    for row_number, email, _, _ in candidates:
+        if email in existing:
+            errors.append({"row": row_number, "email": email, "detail": "User with this email already exists"})
+    candidates = [candidate for candidate in candidates if candidate[1] not in existing]
+    if not candidates:
+        return 0
+
+    hashes = await get_password_hashes([password for _, _, password, _ in candidates])
+    try:
+        async with database.transaction():
+            await database.execute_many(user_table.insert(), [
+                {"email": email, "password": password_hash, "role_id": role_id}
+                for (_, email, _, role_id), password_hash in zip(candidates, hashes)
+            ])
+    except DATABASE_ERRORS as error:
+        logger.error("Bulk import chunk failed: %s", error)
+        errors.extend({"row": row_number, "email": email, "detail": "Insert failed, chunk rolled back"}
+                      for row_number, email, _, _ in candidates)
+        return 0
+    return len(candidates)
+
+
+@router.post(
+    "/register/bulk",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(super_admin_required)],
+    description="Import users from a streamed CSV (email,password[,role]) or NDJSON body. Rows are checked, "
+                "hashed and inserted in chunks; the response lists the rows which were rejected.",
+)
+async def bulk_register_users(request: Request):
+    logger.info("Bulk importing users")
+    started = time.perf_counter()
+    role_ids = dict(await get_role_ids())
+    errors = []
+    inserted = 0
+    total = 0
+    chunk = []
+    async for row_number, row, error in iter_import_rows(request):
+        total += 1
+        if error:
+            errors.append({"row": row_number, "email": None, "detail": error})
+            continue
+        chunk.append((row_number, row))
+        if len(chunk) >= config.BULK_IMPORT_CHUNK_SIZE:
+            inserted += await import_users_chunk(chunk, role_ids, errors)
+            chunk = []
+    if chunk:
+        inserted += await import_users_chunk(chunk, role_ids, errors)
+    elapsed = time.perf_counter() - started
+    logger.info("Bulk import finished: %s/%s rows in %.2fs", inserted, total, elapsed)
+    return {
+        "rows": total,
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": sorted(errors, key=lambda error: error["row"]),
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(total / elapsed, 1) if elapsed else None,
+    }
+
+
 @router.get(
     "/user",
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(super_admin_required)]
 )
-async def get_all_end_users_list(
-        dependencies=None
-):
-    if dependencies is None:
-        dependencies = [Depends(super_admin_required)]
-    all_users = await database.fetch_all(user_table.select())
-    return [
-        {
-            "id": singleUser.id,
-            "email": singleUser.email,
-            "role": (await database.fetch_one(role_table.select().where(role_table.c.id == singleUser.role_id))).name
-        } for singleUser in all_users
-    ]
+async def get_all_end_users_list(page: PageParams = Depends(page_params), role: Optional[str] = None,
+                                 email_prefix: Optional[str] = None):
+    logger.info("Fetching all the users")
+    query = principal_query()
+    if role is not None:
+        query = query.where(role_table.c.name == role)
+    if email_prefix:
+        query = query.where(prefix_filter(user_table.c.email, email_prefix))
+    all_users, next_cursor = await fetch_page(query, user_table.c.id, page)
+    return {
+        "items": [
+            {
+                "id": singleUser.id,
+                "email": singleUser.email,
+                "role": singleUser.role_name
+            } for singleUser in all_users
+        ],
+        "next_cursor": next_cursor,
+    }
 
 
 # async def get_end_user():
@@ -76,13 +213,40 @@ async def get_all_end_users_list(
 )
 async def login(user: UserIn):
     user = await authenticate_user(email=user.email, password=user.password)
-    access_token = create_access_token(email=user.email)
+    access_token = create_access_token(email=user.email, user=user)
     return {
         "access_token": access_token,
+        "refresh_token": await create_refresh_token(user_id=user.id),
+        "token_type": "bearer"
+    }
+
+
+@router.post(
+    "/token/refresh",
+    status_code=status.HTTP_200_OK
+)
+async def refresh_access_token(token: RefreshTokenIn):
+    user, refresh_token = await rotate_refresh_token(token.refresh_token)
+    return {
+        "access_token": create_access_token(email=user.email, user=user),
+        "refresh_token": refresh_token,
         "token_type": "bearer"
     }
 
 
+@router.post(
+    "/token/revoke",
+    status_code=status.HTTP_200_OK
+)
+async def revoke_all_tokens(current_user: User = Depends(get_current_user_from_token)):
+    logger.info("Revoking all tokens of the current user")
+    await revoke_refresh_tokens(user_id=current_user.id)
+    await revoke_user_tokens(user_id=current_user.id)
+    return {
+        "detail": "All tokens revoked"
+    }
+
+
 async def register_user(user: UserIn, role_id: int):
     if await get_user(email=user.email):
         logger.error("User with this email already exists", )
@@ -91,7 +255,7 @@ async def register_user(user: UserIn, role_id: int):
             detail="User with this email already exists"
         )
     logger.info("Fetching user", )
-    query = user_table.insert().values(email=user.email, password=get_password_hash(password=user.password, ),
+    query = user_table.insert().values(email=user.email, password=await get_password_hash(password=user.password, ),
                                        role_id=role_id, )
     logger.debug(query)
     await database.execute(query)
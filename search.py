@@ -0,0 +1,105 @@
+# Ranked full-text search over answers, questions and form titles, backed by
+# the FTS5 tables (SQLite) or tsvector columns (Postgres) set up in
+# app_databases/database.py. Results are ordered best match first and paged
+# with a keyset cursor on (rank, id), lower rank being better on both
+# backends.
+import base64
+import html
+import json
+import re
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+from app_databases.database import SEARCHABLE_COLUMNS, database
+from app_databases.pagination import invalid_cursor_exception
+from config import config
+
+SEARCH_KINDS = {"answers": "answers", "questions": "questions", "forms": "feedback_forms"}
+# Extra columns returned with every hit of a kind.
+SEARCH_CONTEXT = {"answers": ["question_id", "submission_id"], "questions": ["form_id"], "forms": ["created_by"]}
+HIGHLIGHT_START, HIGHLIGHT_END = "<mark>", "</mark>"
+# The database delimits matches with these noncharacters. The snippet is HTML
+# escaped before they become HIGHLIGHT_START/END, so stored text cannot inject
+# markup, and the highlight tags are the only markup left.
+MATCH_START, MATCH_END = "\ufdd0", "\ufdd1"
+SNIPPET_TOKENS = 16
+
+
+def encode_search_cursor(rank: float, last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"rank": rank, "id": last_id}).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        rank, last_id = float(position["rank"]), position["id"]
+    except (ValueError, KeyError, TypeError) as error:
+        raise invalid_cursor_exception from error
+    if not isinstance(last_id, int):
+        raise invalid_cursor_exception
+    return rank, last_id
+
+
+def fts5_query(query: str) -> str:
+    """Turn user input into an FTS5 query matching all of its words, the last
+    one as a prefix, without exposing FTS5 query syntax."""
+    words = re.findall(r"\w+", query)
+    if not words:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Nothing to search for")
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def render_snippet(snippet: Optional[str]) -> Optional[str]:
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def sqlite_search_statement(table: str, column: str, context: list[str], after: bool) -> str:
+    index = f"{table}_fts"
+    columns = ", ".join(f"t.{name}" for name in context)
+    return (
+        f"SELECT t.id AS id, {index}.rank AS rank, "
+        f"snippet({index}, 0, '{MATCH_START}', '{MATCH_END}', '…', {SNIPPET_TOKENS}) AS snippet, {columns} "
+        f"FROM {index} JOIN {table} AS t ON t.id = {index}.rowid WHERE {index} MATCH :query "
+        + (f"AND ({index}.rank > :rank OR ({index}.rank = :rank AND t.id > :last_id)) " if after else "")
+        + f"ORDER BY {index}.rank, t.id LIMIT :limit"
+    )
+
+
+def postgres_search_statement(table: str, column: str, context: list[str], after: bool) -> str:
+    columns = ", ".join(f"ranked.{name}" for name in context)
+    options = f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords={SNIPPET_TOKENS}, MinWords=4"
+    return (
+        f"SELECT ranked.id, ranked.rank, ts_headline('english', ranked.content, "
+        f"websearch_to_tsquery('english', :query), '{options}') AS snippet, {columns} "
+        f"FROM (SELECT t.id, -ts_rank(t.search_vector, websearch_to_tsquery('english', :query)) AS rank, "
+        f"t.{column} AS content, {', '.join(f't.{name}' for name in context)} FROM {table} AS t "
+        f"WHERE t.search_vector @@ websearch_to_tsquery('english', :query)) AS ranked "
+        + ("WHERE ranked.rank > :rank OR (ranked.rank = :rank AND ranked.id > :last_id) " if after else "")
+        + "ORDER BY ranked.rank, ranked.id LIMIT :limit"
+    )
+
+
+async def search(kind: str, query: str, limit: int, cursor: Optional[str] = None) -> tuple[list[dict], Optional[str]]:
+    table = SEARCH_KINDS[kind]
+    context = SEARCH_CONTEXT[kind]
+    values = {"limit": limit + 1}
+    if "postgres" in config.DATABASE_URL:
+        build_statement = postgres_search_statement
+        values["query"] = query
+    else:
+        build_statement = sqlite_search_statement
+        values["query"] = fts5_query(query)
+    if cursor is not None:
+        values["rank"], values["last_id"] = decode_search_cursor(cursor)
+    statement = build_statement(table, SEARCHABLE_COLUMNS[table], context, after=cursor is not None)
+    rows = await database.fetch_all(statement, values)
+    hits = [
+        {"kind": kind, "id": row["id"], "rank": row["rank"], "snippet": render_snippet(row["snippet"]),
+         **{name: row[name] for name in context}}
+        for row in rows[:limit]
+    ]
+    next_cursor = encode_search_cursor(hits[-1]["rank"], hits[-1]["id"]) if len(rows) > limit else None
+    return hits, next_cursor
@@ -1,19 +1,34 @@
+import asyncio
 import datetime
+import hashlib
 import logging
-from typing import Annotated
+import secrets
+import time
+from typing import Annotated, Optional
 
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, ExpiredSignatureError, JWTError
 from passlib.context import CryptContext
+from sqlalchemy import select, func
 
-from app_databases.database import user_table, database, role_table
+from app_databases.database import user_table, database, role_table, refresh_token_table, upsert
 from config import config
-from pydantic_models.user_model import User
+from principal_cache import principal_cache
+from worker_pool import BoundedExecutor
+from pydantic_models.user_model import User, Principal
 
 logger = logging.getLogger(__name__)
 pwd_context = CryptContext(schemes=["bcrypt"], )
 oath2_scheme = OAuth2PasswordBearer(tokenUrl="token")  # the endpoint name which creates the token
+password_hash_pool = BoundedExecutor(
+    "password_hash",
+    max_workers=config.PASSWORD_HASH_WORKERS,
+    max_queue=config.PASSWORD_HASH_MAX_QUEUE,
+    kind=config.PASSWORD_HASH_EXECUTOR,
+)
+# Shared by all batches: concurrent bulk imports together never queue more than the pool has workers.
+_batch_hash_slots = asyncio.Semaphore(max(1, config.PASSWORD_HASH_WORKERS))
 
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -27,188 +42,287 @@ token_expired_exception = HTTPException(
     headers={"WWW-Authenticate": "Bearer"}
 )
 
+SUPER_ADMIN = "superAdmin"
+ADMIN = "admin"
+END_USER = "endUser"
+BUILT_IN_ROLES = (SUPER_ADMIN, ADMIN, END_USER)
+
+# Process-local role name -> id mapping. Warmed in main.lifespan and dropped
+# whenever routers/roles.py writes to the roles table.
+_role_ids: dict[str, int] = {}
+
+# Current token_version of every user whose tokens have been revoked at least
+# once, i.e. users.token_version > 0. Stateless tokens carrying an older
+# version are rejected. Reloaded every TOKEN_VERSIONS_REFRESH_SECONDS so that
+# bumps made by other workers are picked up.
+_token_versions: dict[int, int] = {}
+_token_versions_loaded_at = 0.0
+
 
 def access_token_expiry_minutes() -> int:
     return 30
 
 
-def create_access_token(email: str):
+def create_access_token(email: str, user=None):
     logger.info("Creating access token", extra={"email": email})
     expire = datetime.datetime.utcnow() + datetime.timedelta(minutes=access_token_expiry_minutes(), )
     jwt_data = {"sub": email, "exp": expire}
-    logger.info("algo :: ", extra={"algo": config.ALGORITHM})
-    logger.info("key :: ", extra={"key": config.TOKEN_SECRET_KEY})
-    logger.info("encoded_jwt")
+    if user is not None:
+        # Tokens older than the user's token version are revoked, whatever the auth mode.
+        jwt_data["ver"] = user.token_version or 0
+    if config.STATELESS_AUTH and user is not None:
+        jwt_data.update({
+            "uid": user.id,
+            "role_id": user.role_id,
+            "role": user.role_name,
+        })
     encoded_jwt = jwt.encode(jwt_data, key=config.TOKEN_SECRET_KEY, algorithm=config.ALGORITHM)
     # encoded_jwt = jwt.encode(jwt_data, 'secret', algorithm='HS256')
     return encoded_jwt
 
 
-def get_password_hash(password: str) -> str:
+def _refresh_token_hash(refresh_token: str) -> str:
+    # Refresh tokens are long random strings, so a fast digest is enough here,
+    # unlike passwords which need bcrypt.
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+async def create_refresh_token(user_id: int) -> str:
+    refresh_token = secrets.token_urlsafe(32)
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(days=config.REFRESH_TOKEN_EXPIRY_DAYS)
+    await database.execute(
+        refresh_token_table.insert().values(user_id=user_id, token_hash=_refresh_token_hash(refresh_token),
+                                            expires_at=expires_at, revoked=False))
+    return refresh_token
+
+
+async def rotate_refresh_token(refresh_token: str):
+    """Exchange a refresh token for the user it belongs to and a new refresh
+    token. The presented token is revoked; presenting an already revoked token
+    is treated as theft and revokes every refresh token of the user."""
+    query = principal_query().add_columns(
+        refresh_token_table.c.id.label("refresh_token_id"),
+        refresh_token_table.c.expires_at.label("refresh_token_expires_at"),
+        refresh_token_table.c.revoked.label("refresh_token_revoked"),
+    ).join_from(user_table, refresh_token_table, refresh_token_table.c.user_id == user_table.c.id).where(
+        refresh_token_table.c.token_hash == _refresh_token_hash(refresh_token))
+    user = await database.fetch_one(query)
+    if user is None:
+        raise credentials_exception
+    if user.refresh_token_revoked:
+        logger.warning("Revoked refresh token reused for user %s, revoking all of them", user.id)
+        await revoke_refresh_tokens(user.id)
+        raise credentials_exception
+    if user.refresh_token_expires_at <= datetime.datetime.utcnow():
+        raise token_expired_exception
+    async with database.transaction():
+        # Only revoke it if it still is live: of two concurrent refreshes with
+        # the same token, the one which finds it revoked here is a reuse too.
+        rotated = await database.fetch_val(
+            refresh_token_table.update().values(revoked=True).where(
+                refresh_token_table.c.id == user.refresh_token_id,
+                refresh_token_table.c.revoked.is_(False)).returning(refresh_token_table.c.id))
+        new_refresh_token = await create_refresh_token(user.id) if rotated is not None else None
+    if new_refresh_token is None:
+        logger.warning("Refresh token of user %s used by concurrent refreshes, revoking all of them", user.id)
+        await revoke_refresh_tokens(user.id)
+        raise credentials_exception
+    return user, new_refresh_token
+
+
+async def revoke_refresh_tokens(user_id: int) -> None:
+    logger.info("Revoking refresh tokens of user %s", user_id)
+    await database.execute(
+        refresh_token_table.update().values(revoked=True).where(refresh_token_table.c.user_id == user_id))
+
+
+def _hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def verify_password(plain_text_password: str, hashed_password: str) -> bool:
+def _verify_password(plain_text_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_text_password, hashed_password)
 
 
-async def get_user(email: str) -> dict:
-    logger.debug("Fetching user from DB", extra={"email": email})
-    query = user_table.select().where(user_table.c.email == email)
-    logger.debug("Query", extra={"query": query})
-    return await database.fetch_one(query)
+async def get_password_hash(password: str) -> str:
+    return await password_hash_pool.run(_hash_password, password)
 
 
-async def authenticate_user(email: str, password: str):
-    logger.debug("Authenticating user", extra={"email": email})
-    user = await get_user(email)
-    if not user:
-        raise credentials_exception
-    if not verify_password(password, user.password):
-        raise credentials_exception
-    return user
+async def _hash_for_batch(password: str) -> str:
+    async with _batch_hash_slots:
+        return await password_hash_pool.run(_hash_password, password, reject_when_full=False)
 
 
-async def get_current_user_from_token(token: Annotated[str, Depends(oath2_scheme)]):
-    try:
-        payload = jwt.decode(token, key=config.TOKEN_SECRET_KEY, algorithms=[config.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except ExpiredSignatureError as error:
-        raise token_expired_exception from error
-    except JWTError as error:
-        raise credentials_exception from error
-    user = await get_user(email=email)
-    if user is None:
-        raise credentials_exception
-    return user
+async def get_password_hashes(passwords: list[str]) -> list[str]:
+    """Hash a batch of passwords in parallel on the hashing pool. Batches wait
+    for a free worker instead of being rejected when the pool is busy, but
+    keep at most one password per worker in the pool at a time, so the queue
+    stays free for logins and registrations while a bulk import runs."""
+    return list(await asyncio.gather(*[_hash_for_batch(password) for password in passwords]))
 
 
-async def super_admin_required(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-):
-    super_admin_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "superAdmin")
-    )
+async def verify_password(plain_text_password: str, hashed_password: str) -> bool:
+    return await password_hash_pool.run(_verify_password, plain_text_password, hashed_password)
 
-    # Fetch user from the database and compare the role
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
 
-    if user_in_db.role_id != super_admin_role.id:  # Replace role_id with your actual attribute
-        raise HTTPException(status_code=403, detail="Forbidden - Super Admin access required.")
+async def load_role_ids() -> dict[str, int]:
+    logger.debug("Loading role ids into the cache")
+    roles = await database.fetch_all(role_table.select())
+    _role_ids.clear()
+    _role_ids.update({role.name: role.id for role in roles})
+    return _role_ids
 
-    return current_user
 
+async def seed_roles() -> dict[str, int]:
+    """Create whichever built in roles are missing with a single statement and
+    warm the role id cache from the writer, which sees them right away."""
+    statement = upsert(role_table).values([{"name": name} for name in BUILT_IN_ROLES])
+    async with database.transaction():
+        await database.execute(statement.on_conflict_do_nothing(index_elements=[role_table.c.name]))
+        return await load_role_ids()
 
-async def admin_required(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-):
-    admin_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "admin")
-    )
 
-    # Fetch user from the database and compare the role
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
+def invalidate_role_ids() -> None:
+    logger.debug("Invalidating the role id cache")
+    _role_ids.clear()
 
-    if user_in_db.role_id != admin_role.id:  # Replace role_id with your actual attribute
-        raise HTTPException(status_code=403, detail="Forbidden - Admin access required.")
 
-    return current_user
+async def get_role_id(name: str) -> Optional[int]:
+    if name not in _role_ids:
+        await load_role_ids()
+    return _role_ids.get(name)
 
 
-async def super_admin_or_admin_required(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-):
-    admin_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "admin")
-    )
+async def get_role_ids() -> dict[str, int]:
+    if not _role_ids:
+        await load_role_ids()
+    return _role_ids
 
-    super_admin_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "superAdmin")
-    )
 
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
+async def load_token_versions() -> dict[int, int]:
+    global _token_versions_loaded_at
+    logger.debug("Loading token versions")
+    users = await database.fetch_all(
+        select(user_table.c.id, user_table.c.token_version).where(user_table.c.token_version > 0))
+    _token_versions.clear()
+    _token_versions.update({user.id: user.token_version for user in users})
+    _token_versions_loaded_at = time.monotonic()
+    return _token_versions
 
-    if user_in_db.role_id == admin_role.id or user_in_db.role_id == super_admin_role.id:
-        return current_user
-    else:
-        raise HTTPException(status_code=403, detail="Access denied.")
 
+async def is_token_version_current(user_id: int, version: int) -> bool:
+    if time.monotonic() - _token_versions_loaded_at > config.TOKEN_VERSIONS_REFRESH_SECONDS:
+        await load_token_versions()
+    return version >= _token_versions.get(user_id, 0)
 
-async def end_user_required(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-):
-    end_user_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "endUser")
-    )
 
-    # Fetch user from the database and compare the role
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
+async def revoke_user_tokens(user_id: int) -> None:
+    """Invalidate every access token issued to the user so far."""
+    logger.info("Revoking access tokens of user %s", user_id)
+    await database.execute(
+        user_table.update().values(token_version=func.coalesce(user_table.c.token_version, 0) + 1).where(
+            user_table.c.id == user_id))
+    principal_cache.invalidate_user(user_id)
+    await load_token_versions()
 
-    if user_in_db.role_id != end_user_role.id:  # Replace role_id with your actual attribute
-        raise HTTPException(status_code=403, detail="Forbidden - end user access required.")
 
-    return current_user
+async def revoke_role_tokens(role_id: int) -> None:
+    """Invalidate every access token issued to holders of the role, used when
+    the role is renamed or deleted so that stale role claims stop working."""
+    logger.info("Revoking access tokens of role %s", role_id)
+    await database.execute(
+        user_table.update().values(token_version=func.coalesce(user_table.c.token_version, 0) + 1).where(
+            user_table.c.role_id == role_id))
+    principal_cache.invalidate_role(role_id)
+    await load_token_versions()
 
 
-async def is_super_admin(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-) -> bool:
-    super_admin_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "superAdmin")
+def principal_query():
+    # The user row together with the name of its role, so that authorization
+    # never needs a second round trip.
+    return select(user_table, role_table.c.name.label("role_name")).select_from(
+        user_table.join(role_table, user_table.c.role_id == role_table.c.id)
     )
 
-    # Fetch user from the database and compare the role
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
 
-    if user_in_db.role_id == super_admin_role.id:  # Replace role_id with your actual attribute
-        return True
+async def get_user(email: str) -> dict:
+    logger.debug("Fetching user from DB", extra={"email": email})
+    query = principal_query().where(user_table.c.email == email)
+    logger.debug("Query %s", query)
+    return await database.fetch_one(query)
 
-    return False
 
+async def authenticate_user(email: str, password: str):
+    logger.debug("Authenticating user", extra={"email": email})
+    user = await get_user(email)
+    if not user:
+        raise credentials_exception
+    if not await verify_password(password, user.password):
+        raise credentials_exception
+    return user
 
-async def is_admin(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-) -> bool:
-    admin_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "admin")
-    )
 
-    # Fetch user from the database and compare the role
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
+async def get_current_user_from_token(token: Annotated[str, Depends(oath2_scheme)]):
+    cached_user = principal_cache.get(token)
+    if cached_user is not None:
+        # Revocations made by other workers only reach this one through the
+        # token versions, so cached principals are checked again. A cached
+        # user row carries the version its token was checked against.
+        if not await is_token_version_current(cached_user.id, cached_user.token_version or 0):
+            raise credentials_exception
+        return cached_user
+    try:
+        payload = jwt.decode(token, key=config.TOKEN_SECRET_KEY, algorithms=[config.ALGORITHM])
+        email: str = payload.get("sub")
+        if email is None:
+            raise credentials_exception
+    except ExpiredSignatureError as error:
+        raise token_expired_exception from error
+    except JWTError as error:
+        raise credentials_exception from error
+    if config.STATELESS_AUTH and "role" in payload:
+        if not await is_token_version_current(payload["uid"], payload["ver"]):
+            raise credentials_exception
+        user = Principal(id=payload["uid"], email=email, role_id=payload["role_id"], role_name=payload["role"],
+                         token_version=payload["ver"])
+        principal_cache.put(token, payload, user)
+        return user
+    user = await get_user(email=email)
+    if user is None or payload.get("ver", 0) < (user.token_version or 0):
+        raise credentials_exception
+    principal_cache.put(token, payload, user)
+    return user
 
-    if user_in_db.role_id == admin_role.id:  # Replace role_id with your actual attribute
-        return True
 
-    return False
+def has_any_role(user, *role_names: str) -> bool:
+    return user.role_name in role_names
 
 
-async def is_end_user(
-        current_user: User = Depends(get_current_user_from_token),  # Optional dependency injection
-) -> bool:
-    end_user_role = await database.fetch_one(
-        role_table.select().where(role_table.c.name == "endUser")
-    )
+def roles_required(*role_names: str, detail: str = "Access denied."):
+    """Dependency factory which lets the request through only if the current
+    user holds one of `role_names`. The role comes from the principal query,
+    so this costs no extra database round trip."""
+
+    async def dependency(current_user: User = Depends(get_current_user_from_token)):
+        if not has_any_role(current_user, *role_names):
+            raise HTTPException(status_code=403, detail=detail)
+        return current_user
+
+    return dependency
+
+
+def role_check(*role_names: str):
+    async def dependency(current_user: User = Depends(get_current_user_from_token)) -> bool:
+        return has_any_role(current_user, *role_names)
+
+    return dependency
 
-    # Fetch user from the database and compare the role
-    user_in_db = await database.fetch_one(
-        user_table.select().where(user_table.c.id == current_user.id)  # replace id with correct attribute name
-    )
 
-    if user_in_db.role_id == end_user_role.id:  # Replace role_id with your actual attribute
-        return True
+super_admin_required = roles_required(SUPER_ADMIN, detail="Forbidden - Super Admin access required.")
+admin_required = roles_required(ADMIN, detail="Forbidden - Admin access required.")
+super_admin_or_admin_required = roles_required(SUPER_ADMIN, ADMIN)
+end_user_required = roles_required(END_USER, detail="Forbidden - end user access required.")
 
-    return False
+is_super_admin = role_check(SUPER_ADMIN)
+is_admin = role_check(ADMIN)
+is_end_user = role_check(END_USER)
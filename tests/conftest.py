@@ -0,0 +1,54 @@
+import os
+import tempfile
+from typing import AsyncGenerator
+
+# Settings are read when `config` is first imported, so they are set before
+# anything from the app is. Every session gets its own database file and
+# archive directory.
+_directory = tempfile.mkdtemp(prefix="feedback-tests-")
+os.environ["ENV_STATE"] = "test"
+os.environ["TEST_DATABASE_URL"] = f"sqlite:///{os.path.join(_directory, 'test.db')}"
+os.environ["TEST_ARCHIVE_DIR"] = os.path.join(_directory, "archives")
+# Some tests run transactions side by side, which force rollback would put on a
+# single connection. Tables are emptied after each test instead.
+os.environ["TEST_DB_FORCE_ROLL_BACK"] = "false"
+os.environ.setdefault("TEST_TOKEN_SECRET_KEY", "test-secret-key")
+os.environ.setdefault("TEST_ALGORITHM", "HS256")
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from app_databases.database import database, metadata, role_table, schema_version_table  # noqa: E402
+from app_databases.migrations import migrate  # noqa: E402
+from main import app  # noqa: E402
+from principal_cache import principal_cache  # noqa: E402
+from security import load_token_versions, seed_roles  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def schema():
+    migrate()
+
+
+@pytest.fixture()
+async def db(schema, anyio_backend) -> AsyncGenerator:
+    await database.connect()
+    await seed_roles()
+    await load_token_versions()
+    yield database
+    for table in reversed(metadata.sorted_tables):
+        if table not in (role_table, schema_version_table):
+            await database.execute(table.delete())
+    principal_cache.clear()
+    await database.disconnect()
+
+
+@pytest.fixture()
+async def async_client(db) -> AsyncGenerator:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
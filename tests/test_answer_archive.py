@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.sql import Update
+
+import answer_archive
+from answer_archive import archive_form, archive_path, load_archive, read_archive
+from app_databases.database import (database, feedback_form_table, question_table, question_types_table,
+                                    response_table, submission_table, user_table)
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_closed_form() -> int:
+    """A closed form with one legacy answer, from before whole-form
+    submissions, and one answer of a submission."""
+    user_id = await database.execute(user_table.insert().values(email="user@example.com", password="-", role_id=1))
+    form_id = await database.execute(feedback_form_table.insert().values(title="Closed form", closed_at=func.now()))
+    type_id = await database.execute(question_types_table.insert().values(name="rating", created_by_user=user_id))
+    question_id = await database.execute(
+        question_table.insert().values(form_id=form_id, text="How was it?", type=type_id))
+    submission_id = await database.execute(
+        submission_table.insert().values(reference="submission-1", form_id=form_id, user_id=user_id))
+    await database.execute(response_table.insert().values(question_id=question_id, user_id=user_id, rating=3))
+    await database.execute(response_table.insert().values(
+        submission_id=submission_id, question_id=question_id, user_id=user_id, rating=5))
+    return form_id
+
+
+async def live_answers() -> int:
+    return await database.fetch_val(select(func.count()).select_from(response_table))
+
+
+async def test_archive_includes_answers_without_a_submission(db):
+    form_id = await create_closed_form()
+
+    assert (await archive_form(form_id))["archived_answers"] == 2
+
+    archive = await load_archive(form_id)
+    assert archive.rows == 2
+    assert sorted(archive.columns["rating"].tolist()) == [3, 5]
+    assert await live_answers() == 0
+
+
+async def test_failed_archive_is_ignored_by_readers_and_can_be_retried(db, monkeypatch):
+    form_id = await create_closed_form()
+    execute = database.execute
+
+    async def fail_to_mark_archived(query, values=None):
+        if isinstance(query, Update) and query.table is feedback_form_table:
+            raise RuntimeError("disk I/O error")
+        return await execute(query, values)
+
+    monkeypatch.setattr(database, "execute", fail_to_mark_archived)
+    with pytest.raises(RuntimeError):
+        await archive_form(form_id)
+    monkeypatch.undo()
+
+    # The files are in place, but the answers were not deleted, so readers
+    # must keep reading them from the live table only.
+    assert os.path.exists(os.path.join(archive_path(form_id), "meta.json"))
+    assert read_archive(form_id).rows == 2
+    assert await load_archive(form_id) is None
+    assert await live_answers() == 2
+
+    assert (await archive_form(form_id))["archived_answers"] == 2
+
+    assert (await load_archive(form_id)).rows == 2
+    assert await live_answers() == 0
+    assert not os.path.exists(archive_path(form_id) + ".staging")
+
+
+async def test_failed_write_closes_and_removes_the_staged_files(db, monkeypatch):
+    form_id = await create_closed_form()
+    opened = []
+    init = answer_archive._ColumnWriter.__init__
+
+    def record_files(self, directory):
+        init(self, directory)
+        opened.extend(self.files.values())
+
+    def fail_to_write(self, rows):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(answer_archive._ColumnWriter, "__init__", record_files)
+    monkeypatch.setattr(answer_archive._ColumnWriter, "write", fail_to_write)
+    with pytest.raises(OSError):
+        await archive_form(form_id)
+
+    assert opened and all(file.closed for file in opened)
+    assert not os.path.exists(archive_path(form_id) + ".staging")
+    assert await live_answers() == 2
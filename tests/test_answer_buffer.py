@@ -0,0 +1,57 @@
+import json
+import sqlite3
+
+import pytest
+
+import answer_buffer as answer_buffer_module
+from answer_buffer import AnswerBuffer, PendingSubmission
+
+pytestmark = pytest.mark.anyio
+
+
+def make_buffer(path) -> AnswerBuffer:
+    return AnswerBuffer(max_queue=10, batch_size=10, flush_interval=0.01, enqueue_timeout=0.1, retries=2,
+                        retry_delay=0.001, dead_letter_path=str(path))
+
+
+def pending(reference: str) -> PendingSubmission:
+    return PendingSubmission(reference=reference, form_id=1, user_id=1, answers=[{"question_id": 1, "rating": 5}])
+
+
+async def test_submission_which_cannot_be_written_is_dead_lettered(monkeypatch, tmp_path):
+    attempts = []
+
+    async def write_submissions(submissions):
+        attempts.append([submission.reference for submission in submissions])
+        if any(submission.reference == "bad" for submission in submissions):
+            raise sqlite3.IntegrityError("FOREIGN KEY constraint failed")
+        return {}
+
+    monkeypatch.setattr(answer_buffer_module, "write_submissions", write_submissions)
+    buffer = make_buffer(tmp_path / "dead.jsonl")
+    buffer.start()
+    await buffer.submit(pending("good"))
+    await buffer.submit(pending("bad"))
+    await buffer.stop()
+
+    assert attempts == [["good", "bad"], ["good"], ["bad"], ["bad"], ["bad"]]
+    assert (buffer.flushed_submissions, buffer.failed_submissions) == (1, 1)
+    [line] = (tmp_path / "dead.jsonl").read_text().splitlines()
+    dead = json.loads(line)
+    assert dead["reference"] == "bad" and dead["answers"] == [{"question_id": 1, "rating": 5}]
+
+
+async def test_crashed_flusher_keeps_its_batch_and_refuses_new_submissions(monkeypatch, tmp_path):
+    async def write_submissions(submissions):
+        raise TypeError("a bug")
+
+    monkeypatch.setattr(answer_buffer_module, "write_submissions", write_submissions)
+    buffer = make_buffer(tmp_path / "dead.jsonl")
+    buffer.start()
+    task = buffer._task
+    await buffer.submit(pending("first"))
+    with pytest.raises(TypeError):
+        await task
+
+    assert not buffer.running
+    assert [json.loads(line)["reference"] for line in (tmp_path / "dead.jsonl").read_text().splitlines()] == ["first"]
@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import func
+
+from app_databases.database import (database, feedback_form_table, question_table, question_types_table,
+                                    response_table, user_table)
+from config import config
+from routers.answers import iter_export_rows
+from security import create_access_token
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_form() -> tuple[dict, int, int]:
+    user_id = await database.execute(user_table.insert().values(email="user@example.com", password="-", role_id=3))
+    form_id = await database.execute(feedback_form_table.insert().values(title="Form"))
+    type_id = await database.execute(question_types_table.insert().values(name="rating", created_by_user=user_id))
+    question_id = await database.execute(question_table.insert().values(form_id=form_id, text="How was it?",
+                                                                        type=type_id))
+    return {"Authorization": f"Bearer {create_access_token('user@example.com')}"}, form_id, question_id
+
+
+@pytest.mark.parametrize("rating", [-1, 11, 2 ** 63])
+async def test_out_of_range_rating_is_rejected(async_client, rating):
+    headers, form_id, question_id = await create_form()
+
+    response = await async_client.post(f"/feedback_form/{form_id}/answers", headers=headers,
+                                       json={"answers": [{"question_id": question_id, "rating": rating}]})
+
+    assert response.status_code == 422
+    assert await database.fetch_val(func.count(response_table.c.id).select()) == 0
+
+
+async def test_ratings_from_0_to_10_are_accepted(async_client):
+    headers, form_id, question_id = await create_form()
+
+    response = await async_client.post(f"/feedback_form/{form_id}/answers", headers=headers,
+                                       json={"answers": [{"question_id": question_id, "rating": 10}]})
+
+    assert response.status_code == 201
+
+
+async def test_export_pages_through_every_question(db, monkeypatch):
+    _, form_id, question_id = await create_form()
+    type_id = await database.fetch_val(question_types_table.select().with_only_columns(question_types_table.c.id))
+    other_question_id = await database.execute(question_table.insert().values(form_id=form_id,
+                                                                              text="Anything else?", type=type_id))
+    for rating, question in [(1, question_id), (2, other_question_id), (3, question_id)]:
+        await database.execute(response_table.insert().values(question_id=question, rating=rating))
+    monkeypatch.setattr(config, "EXPORT_BATCH_SIZE", 1)
+
+    rows = [row async for page in iter_export_rows(form_id) for row in page]
+
+    assert [(row[2], row[-1]) for row in rows] == [(question_id, 1), (question_id, 3), (other_question_id, 2)]
@@ -0,0 +1,32 @@
+import sqlite3
+
+import pytest
+
+from app_databases.database import database
+from routers.users import import_users_chunk
+from security import get_role_ids
+
+pytestmark = pytest.mark.anyio
+
+CHUNK = [(1, {"email": "user@example.com", "password": "secret"})]
+
+
+async def test_chunk_refused_by_the_database_is_reported(db, monkeypatch):
+    async def refuse(query, values):
+        raise sqlite3.IntegrityError("UNIQUE constraint failed: users.email")
+
+    monkeypatch.setattr(database, "execute_many", refuse)
+    errors = []
+
+    assert await import_users_chunk(CHUNK, dict(await get_role_ids()), errors) == 0
+    assert errors == [{"row": 1, "email": "user@example.com", "detail": "Insert failed, chunk rolled back"}]
+
+
+async def test_other_errors_are_not_reported_as_rejected_rows(db, monkeypatch):
+    async def fail(query, values):
+        raise TypeError("unexpected keyword argument")
+
+    monkeypatch.setattr(database, "execute_many", fail)
+
+    with pytest.raises(TypeError):
+        await import_users_chunk(CHUNK, dict(await get_role_ids()), [])
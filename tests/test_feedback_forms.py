@@ -0,0 +1,18 @@
+import pytest
+
+from app_databases.database import database, feedback_form_table, user_table
+from security import create_access_token
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_form_list_shows_the_creator_email(async_client):
+    user_id = await database.execute(user_table.insert().values(email="admin@example.com", password="-", role_id=2))
+    await database.execute(feedback_form_table.insert().values(title="Form", created_by=user_id))
+
+    response = await async_client.get(
+        "/feedback_form", headers={"Authorization": f"Bearer {create_access_token('admin@example.com')}"})
+
+    assert response.status_code == 200
+    assert [(item["title"], item["created_by"]) for item in response.json()["items"]] == [
+        ("Form", "admin@example.com")]
@@ -0,0 +1,14 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_unknown_methods_share_one_label(async_client):
+    await async_client.request("BREW", "/user")
+    await async_client.request("PROPFIND", "/user")
+
+    text = (await async_client.get("/metrics")).text
+
+    assert 'method="BREW"' not in text
+    assert 'method="PROPFIND"' not in text
+    assert 'http_requests_total{method="other",route="/user",status="405"} 2' in text
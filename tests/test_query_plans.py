@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+from query_plan_check import plan_problems
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_no_statement_scans_a_whole_table():
+    # The check configures the app itself before importing it, with caches
+    # off and its own database, so it gets an interpreter of its own.
+    result = subprocess.run([sys.executable, "-m", "query_plan_check"], cwd=ROOT, capture_output=True, text=True,
+                            timeout=300)
+
+    assert result.returncode == 0, result.stdout[-5000:]
+    assert "0 with full table scans" in result.stdout
+
+
+def test_bounded_scan_is_accepted_only_without_a_filter_on_the_scanned_table():
+    unfiltered = "SELECT forms.id FROM forms ORDER BY forms.id LIMIT ?"
+    filtered = "SELECT forms.id FROM forms WHERE forms.created_by = ? ORDER BY forms.id LIMIT ?"
+
+    assert plan_problems(unfiltered, ["SCAN forms"]) == []
+    assert plan_problems(filtered, ["SCAN forms"]) == ["SCAN forms"]
+    assert plan_problems(unfiltered, ["SCAN forms", "USE TEMP B-TREE FOR ORDER BY"]) == ["SCAN forms"]
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from app_databases.database import database, user_table
+from security import create_refresh_token
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_user_with_refresh_token() -> str:
+    user_id = await database.execute(user_table.insert().values(email="user@example.com", password="-", role_id=3))
+    return await create_refresh_token(user_id)
+
+
+async def test_refresh_rotates_the_token(async_client):
+    refresh_token = await create_user_with_refresh_token()
+
+    response = await async_client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    new_refresh_token = response.json()["refresh_token"]
+
+    assert (await async_client.post("/token/refresh", json={"refresh_token": new_refresh_token})).status_code == 200
+
+
+async def test_concurrent_refreshes_with_the_same_token_are_a_reuse(async_client):
+    refresh_token = await create_user_with_refresh_token()
+
+    responses = await asyncio.gather(
+        *[async_client.post("/token/refresh", json={"refresh_token": refresh_token}) for _ in range(2)])
+
+    assert sorted(response.status_code for response in responses) == [200, 401]
+    # The reuse revoked the whole family, including the token the winner got.
+    winner = next(response for response in responses if response.status_code == 200)
+    response = await async_client.post("/token/refresh", json={"refresh_token": winner.json()["refresh_token"]})
+    assert response.status_code == 401
@@ -0,0 +1,33 @@
+import pytest
+
+import security
+from app_databases.database import database, user_table
+from config import config
+from security import create_access_token, get_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def login(monkeypatch) -> tuple[int, dict]:
+    monkeypatch.setattr(config, "STATELESS_AUTH", False)
+    await database.execute(user_table.insert().values(email="user@example.com", password="-", role_id=3))
+    user = await get_user("user@example.com")
+    return user.id, {"Authorization": f"Bearer {create_access_token(user.email, user)}"}
+
+
+async def test_revoked_access_token_is_rejected(async_client, monkeypatch):
+    _, headers = await login(monkeypatch)
+
+    assert (await async_client.post("/token/revoke", headers=headers)).status_code == 200
+
+    assert (await async_client.post("/token/revoke", headers=headers)).status_code == 401
+
+
+async def test_cached_token_revoked_by_another_worker_is_rejected(async_client, monkeypatch):
+    user_id, headers = await login(monkeypatch)
+    assert (await async_client.get("/feedback_form", headers=headers)).status_code == 403  # cached from now on
+
+    await database.execute(user_table.update().values(token_version=1).where(user_table.c.id == user_id))
+    monkeypatch.setattr(security, "_token_versions_loaded_at", 0.0)
+
+    assert (await async_client.get("/feedback_form", headers=headers)).status_code == 401
@@ -0,0 +1,19 @@
+import pytest
+
+from app_databases.database import database, response_table, user_table
+from security import create_access_token
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_snippets_escape_stored_text(async_client):
+    await database.execute(user_table.insert().values(email="admin@example.com", password="-", role_id=2))
+    await database.execute(response_table.insert().values(
+        question_id=1, user_input_answer='<img src=x onerror="alert(1)"> great & friendly'))
+
+    response = await async_client.get("/search", params={"q": "great"},
+                                      headers={"Authorization": f"Bearer {create_access_token('admin@example.com')}"})
+
+    assert response.status_code == 200
+    assert [item["snippet"] for item in response.json()["items"]] == [
+        "&lt;img src=x onerror=&quot;alert(1)&quot;&gt; <mark>great</mark> &amp; friendly"]
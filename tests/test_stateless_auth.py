@@ -0,0 +1,25 @@
+import pytest
+from fastapi import HTTPException
+
+import security
+from app_databases.database import database, user_table
+from config import config
+from security import create_access_token, get_current_user_from_token, get_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_cached_stateless_token_revoked_by_another_worker_is_rejected(db, monkeypatch):
+    monkeypatch.setattr(config, "STATELESS_AUTH", True)
+    await database.execute(user_table.insert().values(email="user@example.com", password="-", role_id=3))
+    user = await get_user("user@example.com")
+    token = create_access_token(user.email, user)
+    assert (await get_current_user_from_token(token)).id == user.id  # cached from now on
+
+    # Another worker revokes the user's tokens; this worker notices at its next token version refresh.
+    await database.execute(user_table.update().values(token_version=1).where(user_table.c.id == user.id))
+    monkeypatch.setattr(security, "_token_versions_loaded_at", 0.0)
+
+    with pytest.raises(HTTPException) as error:
+        await get_current_user_from_token(token)
+    assert error.value.status_code == 401
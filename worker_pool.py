@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+pool_saturated_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Server is busy, please retry shortly",
+    headers={"Retry-After": "1"},
+)
+
+
+def _timed_call(fn: Callable, *args: Any) -> tuple[float, Any]:
+    # Runs on the worker, so the time between submitting and this timestamp is
+    # the time the call spent queued.
+    return time.perf_counter(), fn(*args)
+
+
+class BoundedExecutor:
+    """Runs blocking callables off the event loop on at most `max_workers`
+    threads (or processes). Once `max_queue` calls are waiting for a worker,
+    further calls are rejected with a 503 instead of queueing indefinitely.
+    `max_workers=0` runs the callable inline, which is the old behaviour."""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, kind: str = "thread"):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, fn: Callable, *args: Any, reject_when_full: bool = True) -> Any:
+        """Run `fn(*args)` on the pool. `fn` has to be a module level function
+        when the pool is process based."""
+        if self.max_workers <= 0:
+            return fn(*args)
+        if reject_when_full and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            logger.warning("%s pool is saturated, rejecting the call", self.name)
+            raise pool_saturated_exception
+        self.in_flight += 1
+        submitted_at = time.perf_counter()
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), _timed_call, fn, *args)
+        finally:
+            self.in_flight -= 1
+        wait = started_at - submitted_at
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.completed += 1
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait_seconds / self.completed if self.completed else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }